@@ -1,16 +1,3010 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext, filedialog
+import argparse
+from tkinter import ttk, messagebox, scrolledtext, filedialog, simpledialog
 import datetime
 import os
 import tempfile
-from PIL import Image, ImageTk
-from tkinter.font import Font
-import webbrowser
 import json
 import pickle
+import queue
+import threading
+import bisect
+import collections
+import csv
+import functools
+import gc
+import heapq
+import itertools
+import math
+import mmap
+import struct
+import sys
+import time
+import zlib
+from array import array
+from decimal import Decimal, ROUND_HALF_UP
+
+
+def render_receipt(sale, settings):
+    """Render receipt text purely from a stored sale record and receipt settings"""
+    receipt = []
+    width = settings["receipt_width"]
+    
+    # Header
+    receipt.append("="*width)
+    receipt.append(settings["header_text"].center(width))
+    receipt.append(settings["address"].center(width))
+    receipt.append(settings["phone"].center(width))
+    receipt.append("="*width)
+    
+    # Sale number, date and customer info
+    if 'id' in sale:
+        receipt.append(f"Receipt No: {sale['id']}")
+    if sale.get('type') == 'refund':
+        receipt.append(f"REFUND for Receipt No: {sale['refund_of']}")
+    receipt.append(f"Date: {sale.get('timestamp', sale['date'])}")
+    
+    if settings["show_customer_name"]:
+        receipt.append(f"Customer: {sale.get('customer', 'Walk-in Customer')}")
+    
+    receipt.append("-"*width)
+    
+    # Items header
+    receipt.append("{:<25} {:<6} {:<8} {:<10}".format("ITEM", "QTY", "PRICE", "TOTAL"))
+    receipt.append("-"*width)
+    
+    # Items
+    for item in sale['items']:
+        amount = item['price'] * item['qty']
+        receipt.append("{:<25} {:<6} {:<8.2f} {:<10.2f}".format(
+            item['name'][:25], item['qty'], item['price'], amount))
+    
+    receipt.append("-"*width)
+    
+    # Totals
+    gross_total = sale['gross_total']
+    receipt.append("GROSS TOTAL:".ljust(40) + f"PKR {gross_total:.2f}".rjust(10))
+    
+    discount_percent = sale_discount_percent(sale)
+    show_discount = settings["show_discount"] and discount_percent > 0
+    if show_discount:
+        sign = "-" if sale['discount'] >= 0 else "+"  # refunds give the discount back
+        receipt.append(f"DISCOUNT ({discount_percent}%):".ljust(40) + f"{sign}PKR {abs(sale['discount']):.2f}".rjust(10))
+    tax_label = settings.get("tax_label", DEFAULT_TAX_SETTINGS['tax_label'])
+    for line in sale.get('tax', ()):
+        receipt.append(f"{tax_label} ({line['rate']:g}% on {line['taxable']:.2f}):".ljust(40)
+                       + f"PKR {line['amount']:.2f}".rjust(10))
+    if show_discount or sale.get('tax'):
+        receipt.append("NET TOTAL:".ljust(40) + f"PKR {sale['total']:.2f}".rjust(10))
+    
+    receipt.append("-"*width)
+    
+    # Generator name in a box
+    generator_line = f" Generated by: {sale.get('cashier', settings['generator_name'])} "
+    box_width = width - 4
+    if len(generator_line) > box_width:
+        generator_line = generator_line[:box_width]
+    
+    receipt.append("+" + "-"*(width-2) + "+")
+    receipt.append("|" + generator_line.center(width-2) + "|")
+    receipt.append("+" + "-"*(width-2) + "+")
+    
+    # Footer
+    receipt.append(settings["footer_text"].center(width))
+    receipt.append("="*width)
+    
+    return "\n".join(receipt)
+
+
+def sale_discount_percent(sale):
+    """Return the discount percent of a sale, deriving it for records saved before it was stored"""
+    if 'discount_percent' in sale:
+        return sale['discount_percent']
+    if sale.get('gross_total'):
+        return round(sale.get('discount', 0) / sale['gross_total'] * 100, 2)
+    return 0
+
+
+# Money: amounts are stored in rupees but always hold a whole number of paisa, and
+# sums and discounts are worked in integer paisa so totals are exact at any scale.
+PAISA = Decimal(1)
+
+
+def to_paisa(amount):
+    """Convert rupees (a number or numeric text) to integer paisa, rounding half away from zero"""
+    if type(amount) is float:
+        scaled = amount * 100
+        paisa = round(scaled)
+        if -1e-6 < scaled - paisa < 1e-6:
+            return paisa  # already whole paisa, as every stored amount is
+    elif isinstance(amount, int):
+        return amount * 100
+    return int((Decimal(str(amount)) * 100).quantize(PAISA, rounding=ROUND_HALF_UP))
+
+
+def to_rupees(paisa):
+    return paisa / 100
+
+
+def money(amount):
+    """Round a rupee amount to whole paisa"""
+    return to_rupees(to_paisa(amount))
+
+
+def percent_of(paisa, percent):
+    """Return percent% of a paisa amount in whole paisa, rounding half away from zero.
+    
+    This is the one rounding rule for discounts and any other percentage of a total.
+    """
+    return int((Decimal(paisa) * Decimal(str(percent)) / 100).quantize(PAISA, rounding=ROUND_HALF_UP))
+
+
+def migrate_money(data):
+    """Round prices and sale amounts saved as raw floats to whole paisa, in place"""
+    def whole(amount):
+        scaled = amount * 100
+        return -1e-6 < scaled - round(scaled) < 1e-6
+    
+    for med in data.get('medicines', {}).values():
+        if not whole(med['price']):
+            med['price'] = money(med['price'])
+    for sale in data.get('sales_history', []):
+        for item in sale['items']:
+            if not whole(item['price']):
+                item['price'] = money(item['price'])
+        for key in ('gross_total', 'discount', 'tax_total', 'total'):
+            if key in sale and not whole(sale[key]):
+                sale[key] = money(sale[key])
+    return data
+
+
+class Cart:
+    """Lines being sold (name -> {'price', 'quantity', 'tax_rate', 'batch'}) with running gross totals in paisa.
+    
+    Each change adjusts the gross, overall and for the line's tax rate, by the changed
+    line's difference, so totals cost O(1) per change however many lines a wholesale
+    order has; tax is then worked out once per rate rather than per line.
+    """
+    
+    def __init__(self, discount_percent=0):
+        self.lines = {}
+        self.gross_paisa = 0
+        self.by_rate = {}  # tax rate -> gross paisa of the lines taxed at it
+        self.discount_percent = discount_percent
+    
+    def __len__(self):
+        return len(self.lines)
+    
+    def __contains__(self, name):
+        return name in self.lines
+    
+    def __iter__(self):
+        return iter(self.lines)
+    
+    def __getitem__(self, name):
+        return self.lines[name]
+    
+    def quantity(self, name):
+        line = self.lines.get(name)
+        return line['quantity'] if line else 0
+    
+    def set(self, name, price, quantity, tax_rate=0.0, batch=''):
+        """Set a line's quantity (0 removes it), keeping the price, tax rate and batch it was first added at"""
+        line = self.lines.get(name)
+        if line is not None:
+            price, tax_rate, batch = line['price'], line['tax_rate'], line['batch']
+            self.charge(tax_rate, -to_paisa(price) * line['quantity'])
+        if quantity:
+            self.lines[name] = {'price': price, 'quantity': quantity, 'tax_rate': tax_rate, 'batch': batch}
+            self.charge(tax_rate, to_paisa(price) * quantity)
+        else:
+            self.lines.pop(name, None)
+    
+    def charge(self, tax_rate, paisa):
+        self.gross_paisa += paisa
+        gross = self.by_rate.get(tax_rate, 0) + paisa
+        if gross:
+            self.by_rate[tax_rate] = gross
+        else:
+            self.by_rate.pop(tax_rate, None)
+    
+    def add(self, name, price, quantity, tax_rate=0.0, batch=''):
+        self.set(name, price, self.quantity(name) + quantity, tax_rate, batch)
+    
+    def remove(self, name):
+        self.set(name, 0, 0)
+    
+    def clear(self):
+        self.lines.clear()
+        self.by_rate.clear()
+        self.gross_paisa = 0
+    
+    @property
+    def discount_paisa(self):
+        return percent_of(self.gross_paisa, self.discount_percent)
+    
+    @property
+    def gross(self):
+        return to_rupees(self.gross_paisa)
+    
+    @property
+    def discount(self):
+        return to_rupees(self.discount_paisa)
+    
+    @property
+    def tax_lines(self):
+        return tax_lines(self.by_rate, self.discount_percent)
+    
+    @property
+    def tax_paisa(self):
+        return sum(tax for _, _, tax in self.tax_lines)
+    
+    @property
+    def tax(self):
+        return to_rupees(self.tax_paisa)
+    
+    @property
+    def net(self):
+        return to_rupees(self.gross_paisa - self.discount_paisa + self.tax_paisa)
+
+
+def render_receipts(sales, settings, max_workers=None):
+    """Render many receipts in a process pool (used for reprints and audits)"""
+    sales = list(sales)
+    if len(sales) < 2:
+        return [render_receipt(sale, settings) for sale in sales]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(render_receipt, sales, [settings] * len(sales),
+                             chunksize=max(1, len(sales) // 64)))
+
+
+# Checkout settings, kept with the receipt settings: quick checkout skips the receipt
+# window and confirmation dialogs; auto-print queues every receipt for the printer.
+DEFAULT_CHECKOUT_SETTINGS = {
+    'quick_checkout': False,
+    'auto_print_receipts': False
+}
+
+
+def app_settings(settings=None):
+    """Receipt settings with missing stock alert, tax and checkout values filled in from the defaults"""
+    return dict(DEFAULT_CHECKOUT_SETTINGS, **tax_settings(stock_settings(settings)))
+
+
+def copy_settings(settings):
+    """Copy settings along with their nested company maps, for use off the Tk thread or in another store"""
+    return {key: dict(value) if isinstance(value, dict) else value for key, value in settings.items()}
+
+
+def send_to_printer(receipt_text):
+    """Spool receipt text to the default printer"""
+    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.txt') as tmp_file:
+        tmp_file.write(receipt_text)
+        tmp_file_path = tmp_file.name
+    
+    if os.name == 'nt':  # Windows
+        os.startfile(tmp_file_path, 'print')
+        # The print verb reads the file after returning, so delete it later
+        threading.Timer(5, os.unlink, [tmp_file_path]).start()
+    else:  # Linux/Mac
+        import subprocess
+        try:
+            subprocess.run(['lpr', tmp_file_path], check=True)
+        finally:
+            os.unlink(tmp_file_path)
+
+
+class ReceiptPrinter:
+    """Prints receipts in order on a background thread, so checkout never waits for the spooler.
+    
+    Failures are collected as (label, error) for the Tk thread to report.
+    """
+    
+    def __init__(self, send=send_to_printer):
+        self.send = send
+        self.jobs = queue.Queue()
+        self.failures = collections.deque()
+        self.worker = None
+    
+    def submit(self, label, receipt_text):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self.run, daemon=True)
+            self.worker.start()
+        self.jobs.put((label, receipt_text))
+    
+    def pending(self):
+        return self.jobs.unfinished_tasks
+    
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                label, receipt_text = job
+                self.send(receipt_text)
+            except Exception as e:
+                self.failures.append((label, str(e)))
+            finally:
+                self.jobs.task_done()
+    
+    def close(self, timeout=None):
+        """Let queued receipts finish printing, then stop the worker"""
+        if self.worker is not None and self.worker.is_alive():
+            self.jobs.put(None)
+            self.worker.join(timeout)
+
+
+def build_inventory_report(medicines, sales_history=None, settings=None):
+    """Build the inventory list report, returning (text, item count)"""
+    report = []
+    report.append("MEDICAL STORE INVENTORY REPORT".center(80))
+    report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
+    report.append("="*80)
+    report.append("{:<25} {:<15} {:<10} {:<10} {:<12} {:<10}".format(
+        "Medicine Name", "Company", "Price", "Quantity", "Expiry Date", "Batch No."))
+    report.append("-"*80)
+    
+    total_value = 0
+    for name, details in sorted(medicines.items()):
+        total_value += to_paisa(details['price']) * details['quantity']
+        report.append("{:<25} {:<15} {:<10.2f} {:<10} {:<12} {:<10}".format(
+            name[:25], details.get('company', 'All')[:15], details['price'], 
+            details['quantity'], details['expiry'], details['batch']))
+    
+    report.append("="*80)
+    report.append("TOTAL INVENTORY VALUE:".ljust(60) + f"PKR {to_rupees(total_value):.2f}".rjust(20))
+    report.append("="*80)
+    
+    return "\n".join(report), len(medicines)
+
+
+def build_low_stock_report(medicines, sales_history=None, settings=None, index=None):
+    """Build the low stock report, returning (text, item count).
+    
+    Items are low when 0 < quantity < their threshold (see low_stock_threshold); a
+    StockIndex over the same medicines supplies them without a scan.
+    """
+    settings = stock_settings(settings)
+    names = sorted(index.low) if index is not None else sorted(
+        name for name, details in medicines.items() if 0 < details['quantity'] < low_stock_threshold(details, settings))
+    report = []
+    report.append(f"LOW STOCK REPORT (Quantity < {settings['low_stock_threshold']} unless set per item or company)".center(80))
+    report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
+    report.append("="*80)
+    report.append("{:<25} {:<15} {:<10} {:<10} {:<12} {:<10}".format(
+        "Medicine Name", "Company", "Price", "Quantity", "Expiry Date", "Batch No."))
+    report.append("-"*80)
+    
+    low_stock_items = len(names)
+    for name in names:
+        details = medicines[name]
+        report.append("{:<25} {:<15} {:<10.2f} {:<10} {:<12} {:<10}".format(
+            name[:25], details.get('company', 'All')[:15], details['price'], 
+            details['quantity'], details['expiry'], details['batch']))
+    
+    if low_stock_items == 0:
+        report.append("No low stock items found (all items are above their thresholds)".center(80))
+    
+    report.append("="*80)
+    report.append(f"Total low stock items: {low_stock_items}".center(80))
+    report.append("="*80)
+    
+    return "\n".join(report), low_stock_items
+
+
+def build_expiring_report(medicines, sales_history=None, settings=None, index=None):
+    """Build the report of medicines expiring within the expiry window, returning (text, item count).
+    
+    A StockIndex over the same medicines supplies them, soonest first, without a scan.
+    """
+    window = stock_settings(settings)['expiry_window_days']
+    report = []
+    report.append(f"EXPIRING SOON REPORT (within {window} days)".center(80))
+    report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
+    report.append("="*80)
+    report.append("{:<25} {:<15} {:<10} {:<10} {:<12} {:<10}".format(
+        "Medicine Name", "Company", "Price", "Quantity", "Expiry Date", "Batch No."))
+    report.append("-"*80)
+    
+    today = datetime.datetime.now().toordinal()
+    if index is not None:
+        names = index.expiring(today, window)
+    else:
+        names = sorted(name for name, details in medicines.items() 
+                       if day_ordinal(details['expiry']) and day_ordinal(details['expiry']) - today <= window)
+    expiring = len(names)
+    
+    for name in names:
+        details = medicines[name]
+        report.append("{:<25} {:<15} {:<10.2f} {:<10} {:<12} {:<10}".format(
+            name[:25], details.get('company', 'All')[:15], details['price'], 
+            details['quantity'], details['expiry'], details['batch']))
+    
+    if expiring == 0:
+        report.append(f"No expiring items found (all items expire after {window} days)".center(80))
+    
+    report.append("="*80)
+    report.append(f"Total expiring items: {expiring}".center(80))
+    report.append("="*80)
+    
+    return "\n".join(report), expiring
+
+
+def build_empty_stock_report(medicines, sales_history=None, settings=None):
+    """Build the report of medicines with empty stock (quantity = 0), returning (text, item count)"""
+    report = []
+    report.append("EMPTY STOCK REPORT (Quantity = 0)".center(80))
+    report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
+    report.append("="*80)
+    report.append("{:<25} {:<15} {:<10} {:<12} {:<10}".format(
+        "Medicine Name", "Company", "Price", "Expiry Date", "Batch No."))
+    report.append("-"*80)
+    
+    empty_stock_items = 0
+    for name, details in sorted(medicines.items()):
+        if details['quantity'] == 0:
+            empty_stock_items += 1
+            report.append("{:<25} {:<15} {:<10.2f} {:<12} {:<10}".format(
+                name[:25], details.get('company', 'All')[:15], details['price'], 
+                details['expiry'], details['batch']))
+    
+    if empty_stock_items == 0:
+        report.append("No empty stock items found (all items have quantity > 0)".center(80))
+    
+    report.append("="*80)
+    report.append(f"Total empty stock items: {empty_stock_items}".center(80))
+    report.append("="*80)
+    
+    return "\n".join(report), empty_stock_items
+
+
+def build_sales_summary_report(medicines, sales_history, settings=None):
+    """Build the sales summary report, returning (text, transaction count).
+    
+    A sales window in settings limits it to the last that many days (0 = all sales).
+    """
+    window = stock_settings(settings)['sales_window_days']
+    first_day = datetime.datetime.now().toordinal() - window + 1 if window else 0
+    report = []
+    report.append(("SALES SUMMARY REPORT" + (f" (last {window} days)" if window else "")).center(80))
+    report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
+    report.append("="*80)
+    report.append("{:<12} {:<13} {:<10} {:<14} {:<12} {:<14}".format(
+        "Date", "Transactions", "Items Sold", "Gross Total", "Tax", "Net Total"))
+    report.append("-"*80)
+    
+    # Daily rollups: a SalesStore keeps them as sales are added, otherwise sum them here
+    daily = getattr(sales_history, 'daily', None)
+    if daily is None:
+        daily = {}
+        for sale in sales_history:
+            SalesStore.accumulate(daily.setdefault(sale['date'], SalesStore.empty_totals()),
+                                  SalesStore.make_row(sale))
+    
+    # Newest first
+    dates = sorted((date for date in daily if not first_day or day_ordinal(date) >= first_day),
+                   key=day_ordinal, reverse=True)
+    totals = SalesStore.empty_totals()
+    for date in dates:
+        data = daily[date]
+        for key, value in data.items():
+            totals[key] += value
+        report.append("{:<12} {:<13} {:<10} {:<14.2f} {:<12.2f} {:<14.2f}".format(
+            date, 
+            data['transactions'], 
+            data['items_sold'], 
+            to_rupees(data['gross_paisa']), 
+            to_rupees(data['tax_paisa']), 
+            to_rupees(data['net_paisa'])
+        ))
+    
+    # Add totals
+    total_transactions = totals['transactions']
+    report.append("="*80)
+    report.append("{:<12} {:<13} {:<10} {:<14.2f} {:<12.2f} {:<14.2f}".format(
+            "TOTAL", 
+            total_transactions, 
+            totals['items_sold'], 
+            to_rupees(totals['gross_paisa']), 
+            to_rupees(totals['tax_paisa']), 
+            to_rupees(totals['net_paisa'])
+        ))
+    report.append("="*80)
+    
+    return "\n".join(report), total_transactions
+
+
+def build_reorder_report(medicines, sales_history, settings=None):
+    """Build purchase-order drafts from sales velocity, returning (text, line count).
+    
+    sales_history may be a SalesStore, whose velocity is already maintained.
+    """
+    velocity = getattr(sales_history, 'velocity', None) or SalesVelocity.from_sales(sales_history)
+    now = datetime.datetime.now()
+    suggestions = plan_reorders(medicines, velocity, now.toordinal())
+    
+    report = []
+    report.append("REORDER SUGGESTIONS / PURCHASE ORDER DRAFTS".center(80))
+    report.append(f"Generated on: {now.strftime('%d-%m-%Y %H:%M:%S')}")
+    report.append(f"Lead time {REORDER_LEAD_DAYS} days, safety stock {REORDER_SAFETY_DAYS} days, "
+                  f"order cover {REORDER_COVER_DAYS} days")
+    report.append("="*80)
+    
+    for company, lines in itertools.groupby(suggestions, key=lambda line: line['company']):
+        lines = list(lines)
+        report.append(f"PURCHASE ORDER DRAFT - Supplier: {company or 'Unknown'}")
+        report.append("{:<25} {:<10} {:<7} {:<9} {:<9} {:<8} {:<10}".format(
+            "Medicine Name", "Batch No.", "Stock", "Per Day", "Days Left", "Order", "Value"))
+        report.append("-"*80)
+        for line in lines:
+            report.append("{:<25} {:<10} {:<7} {:<9.2f} {:<9.1f} {:<8} {:<10.2f}".format(
+                line['name'][:25], line['batch'][:10], line['stock'], line['velocity'], 
+                line['days_left'], line['order_qty'], to_rupees(line['order_qty'] * to_paisa(line['price']))))
+        order_value = sum(line['order_qty'] * to_paisa(line['price']) for line in lines)
+        report.append(f"Order value: Pkr {to_rupees(order_value):.2f}")
+        report.append("")
+    
+    if not suggestions:
+        report.append("No medicines need reordering at current sales velocity".center(80))
+    
+    report.append("="*80)
+    report.append(f"Total lines to order: {len(suggestions)}".center(80))
+    report.append("="*80)
+    
+    return "\n".join(report), len(suggestions)
+
+
+def build_analytics_report(medicines, sales_history, settings=None, analytics=None):
+    """Build the sales analytics report, returning (text, sale line count).
+    
+    analytics is an already synced SalesAnalytics (the app keeps a cached one);
+    without it the sale lines are loaded into memory first. Needs NumPy.
+    """
+    if analytics is None:
+        analytics = SalesAnalytics()
+        analytics.sync(list(sales_history), medicines)
+    
+    report = []
+    report.append("SALES ANALYTICS REPORT".center(80))
+    report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
+    report.append(f"Sale lines analysed: {analytics.rows}")
+    report.append("="*80)
+    
+    report.append("TOP SELLERS (by units)")
+    report.append("{:<40} {:<12} {:<15}".format("Medicine Name", "Units", "Net Revenue"))
+    report.append("-"*80)
+    for name, units, revenue in analytics.top_sellers(10):
+        report.append("{:<40} {:<12} {:<15.2f}".format(name[:40], units, revenue))
+    
+    report.append("")
+    report.append("REVENUE BY COMPANY")
+    report.append("{:<40} {:<12} {:<15}".format("Company", "Units", "Net Revenue"))
+    report.append("-"*80)
+    for company, units, revenue in analytics.revenue_by_company():
+        report.append("{:<40} {:<12} {:<15.2f}".format(company[:40], units, revenue))
+    
+    report.append("")
+    report.append("DISCOUNT IMPACT")
+    report.append("{:<14} {:<9} {:<9} {:<15} {:<15} {:<15}".format(
+        "Band", "Lines", "Units", "Gross", "Discount", "Net"))
+    report.append("-"*80)
+    for label, lines, units, gross, discount, net in analytics.discount_impact():
+        report.append("{:<14} {:<9} {:<9} {:<15.2f} {:<15.2f} {:<15.2f}".format(
+            label, lines, units, gross, discount, net))
+    
+    report.append("")
+    heatmap = analytics.hourly_heatmap()
+    peak = float(heatmap.max()) if heatmap.size else 0.0
+    report.append(f"NET REVENUE BY WEEKDAY AND HOUR (1-9 scaled to the busiest hour, Pkr {peak:.2f})")
+    report.append("    " + "".join(f"{hour:>3}" for hour in range(24)))
+    report.append("-"*80)
+    for weekday, row in zip(("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"), heatmap.tolist()):
+        cells = [" ." if value <= 0 or not peak else f"{max(1, round(9 * value / peak)):>2}" for value in row]
+        report.append(f"{weekday:<4}" + "".join(f"{cell:>3}" for cell in cells))
+    
+    report.append("")
+    classes = analytics.abc_classes()
+    total = sum(revenue for members in classes.values() for _, revenue in members)
+    report.append(f"ABC CLASSIFICATION (A up to {ABC_LIMITS[0]:.0%} of revenue, B up to {ABC_LIMITS[1]:.0%})")
+    report.append("{:<8} {:<12} {:<15} {:<10}".format("Class", "Medicines", "Net Revenue", "Share"))
+    report.append("-"*80)
+    for label, members in classes.items():
+        revenue = sum(value for _, value in members)
+        report.append("{:<8} {:<12} {:<15.2f} {:<10.1%}".format(
+            label, len(members), revenue, revenue / total if total else 0))
+    if classes['A']:
+        report.append("Class A: " + ", ".join(name for name, _ in classes['A']))
+    
+    report.append("="*80)
+    return "\n".join(report), analytics.rows
+
+
+def build_expiry_forecast_report(medicines, sales_history, settings=None):
+    """Build the projected expiry-loss report, returning (text, batch count).
+    
+    sales_history may be a SalesStore, whose velocity is already maintained.
+    """
+    velocity = getattr(sales_history, 'velocity', None) or SalesVelocity.from_sales(sales_history)
+    now = datetime.datetime.now()
+    forecasts = forecast_expiry_losses(medicines, velocity, now.toordinal())
+    
+    report = []
+    report.append("EXPIRY LOSS FORECAST".center(80))
+    report.append(f"Generated on: {now.strftime('%d-%m-%Y %H:%M:%S')}")
+    report.append("Units projected to be unsold at expiry at current sales velocity")
+    report.append("="*80)
+    report.append("{:<22} {:<9} {:<11} {:<6} {:<6} {:<7} {:<10} {}".format(
+        "Medicine Name", "Batch No.", "Expiry", "Days", "Stock", "Unsold", "Loss", "Suggestion"))
+    report.append("-"*80)
+    for line in forecasts:
+        report.append("{:<22} {:<9} {:<11} {:<6} {:<6} {:<7} {:<10.2f} {}".format(
+            line['name'][:22], line['batch'][:9], line['expiry'], line['days_left'], line['stock'],
+            line['unsold'], line['loss'], line['action']))
+    
+    if not forecasts:
+        report.append("All stock is projected to sell before it expires".center(80))
+    
+    report.append("="*80)
+    report.append(f"Projected loss: Pkr {sum(line['loss'] for line in forecasts):.2f} "
+                  f"across {len(forecasts)} batches".center(80))
+    report.append("="*80)
+    
+    return "\n".join(report), len(forecasts)
+
+
+def recall_customers(recall, customers=None):
+    """Customers still holding recalled units, most units first.
+    
+    Registered customers are grouped by id and given their current phone; other
+    sales are grouped by the name typed at the counter, with no phone.
+    """
+    affected = {}
+    for line in recall:
+        outstanding = line['sold'] - line['returned']
+        if outstanding <= 0:
+            continue
+        sale = line['sale']
+        customer_id = sale.get('customer_id')
+        record = customers.get(customer_id) if customers is not None and customer_id is not None else None
+        key = ('id', customer_id) if customer_id is not None else ('name', sale.get('customer', 'Walk-in Customer'))
+        if key not in affected:
+            affected[key] = {'customer_id': customer_id, 
+                             'name': record['name'] if record else sale.get('customer', 'Walk-in Customer'),
+                             'phone': record['phone'] if record else '', 'sales': [], 'units': 0}
+        if not affected[key]['sales'] or affected[key]['sales'][-1] != sale['id']:
+            affected[key]['sales'].append(sale['id'])
+        affected[key]['units'] += outstanding
+    return sorted(affected.values(), key=lambda customer: (-customer['units'], customer['name'].lower()))
+
+
+def build_recall_report(batch, recall, customers=None):
+    """Build the recall report for one batch from SalesStore.recall, returning (text, affected customer count)"""
+    affected = recall_customers(recall, customers)
+    sold = sum(line['sold'] for line in recall)
+    returned = sum(line['returned'] for line in recall)
+    
+    report = []
+    report.append(f"BATCH RECALL REPORT - Batch {batch}".center(80))
+    report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
+    report.append(f"Sales: {len({line['sale']['id'] for line in recall})}   Units sold: {sold}   "
+                  f"Returned: {returned}   Still with customers: {sold - returned}")
+    report.append("="*80)
+    report.append("{:<8} {:<12} {:<22} {:<20} {:<5} {:<5} {:<5}".format(
+        "Sale #", "Date", "Customer", "Medicine", "Sold", "Ret.", "Out"))
+    report.append("-"*80)
+    for line in recall:
+        sale = line['sale']
+        report.append("{:<8} {:<12} {:<22} {:<20} {:<5} {:<5} {:<5}".format(
+            sale['id'], sale['date'], sale.get('customer', 'Walk-in Customer')[:22], line['name'][:20],
+            line['sold'], line['returned'], line['sold'] - line['returned']))
+    if not recall:
+        report.append(f"No sales of batch {batch} found".center(80))
+    
+    report.append("")
+    report.append("AFFECTED CUSTOMERS")
+    report.append("{:<8} {:<28} {:<18} {:<8} {:<14}".format("Cust. #", "Name", "Phone", "Units", "Sales"))
+    report.append("-"*80)
+    for customer in affected:
+        report.append("{:<8} {:<28} {:<18} {:<8} {:<14}".format(
+            customer['customer_id'] if customer['customer_id'] is not None else "-", customer['name'][:28],
+            customer['phone'][:18] or "-", customer['units'], " ".join(map(str, customer['sales']))[:14]))
+    report.append("="*80)
+    registered = sum(1 for customer in affected if customer['customer_id'] is not None)
+    report.append(f"Customers to contact: {registered} registered, {len(affected) - registered} "
+                  f"known only by the name given at the counter".center(80))
+    report.append("="*80)
+    
+    return "\n".join(report), len(affected)
+
+
+def export_recall_customers(path, batch, affected):
+    """Write affected customers from recall_customers to a CSV file"""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Batch", "Customer ID", "Name", "Phone", "Units Outstanding", "Sale IDs"])
+        for customer in affected:
+            writer.writerow([batch, "" if customer['customer_id'] is None else customer['customer_id'],
+                             customer['name'], customer['phone'], customer['units'],
+                             " ".join(map(str, customer['sales']))])
+
+
+# Report builders keyed by the names shown in the Reports tab
+REPORT_BUILDERS = {
+    'Inventory List': build_inventory_report,
+    'Low Stock': build_low_stock_report,
+    'Expiring Soon': build_expiring_report,
+    'Empty Stocks': build_empty_stock_report,
+    'Sales Summary': build_sales_summary_report,
+    'Reorder Suggestions': build_reorder_report,
+    'Sales Analytics': build_analytics_report,
+    'Expiry Loss Forecast': build_expiry_forecast_report,
+}
+
+
+def text_to_pdf(text, title="PharmaCare"):
+    """Lay out monospaced text as a minimal multi-page PDF document and return its bytes"""
+    font_size = 9
+    leading = 11
+    page_width, page_height = 595, 842  # A4 in points
+    margin = 36
+    lines_per_page = (page_height - 2 * margin) // leading
+    
+    lines = text.expandtabs().split("\n")
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[""]]
+    
+    def escape(line):
+        line = line.encode('latin-1', 'replace').decode('latin-1')
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    
+    # Object numbers: 1 catalog, 2 page tree, 3 font, 4 info, then (page, content) pairs
+    objects = {}
+    kids = []
+    for index, page_lines in enumerate(pages):
+        page_num = 5 + index * 2
+        content_num = page_num + 1
+        kids.append(f"{page_num} 0 R")
+        stream = [f"BT /F1 {font_size} Tf {leading} TL {margin} {page_height - margin - font_size} Td"]
+        stream.extend(f"({escape(line)}) Tj T*" for line in page_lines)
+        stream.append("ET")
+        stream = "\n".join(stream).encode('latin-1')
+        objects[page_num] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] "
+                             f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_num} 0 R >>").encode('latin-1')
+        objects[content_num] = f"<< /Length {len(stream)} >>\nstream\n".encode('latin-1') + stream + b"\nendstream"
+    
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode('latin-1')
+    objects[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>"
+    objects[4] = f"<< /Title ({escape(title)}) /Producer (PharmaCare) >>".encode('latin-1')
+    
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for num in sorted(objects):
+        offsets[num] = len(out)
+        out += f"{num} 0 obj\n".encode('latin-1') + objects[num] + b"\nendobj\n"
+    
+    xref_offset = len(out)
+    count = max(objects) + 1
+    out += f"xref\n0 {count}\n0000000000 65535 f \n".encode('latin-1')
+    for num in range(1, count):
+        out += f"{offsets[num]:010d} 00000 n \n".encode('latin-1')
+    out += f"trailer\n<< /Size {count} /Root 1 0 R /Info 4 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode('latin-1')
+    return bytes(out)
+
+
+def render_pdf_job(job):
+    """Render one ('receipt', sale, settings, path) or ('report', name, data, path) job to disk.
+    
+    Report data is (medicines, sales_history, settings).
+    """
+    kind, subject, data, path = job
+    if kind == 'receipt':
+        text = render_receipt(subject, data)
+        title = f"Receipt {subject.get('timestamp', subject['date'])}"
+    else:
+        medicines, sales_history, settings = data
+        text, _ = REPORT_BUILDERS[subject](medicines, sales_history, settings=settings)
+        title = subject
+    with open(path, 'wb') as f:
+        f.write(text_to_pdf(text, title))
+    return path
+
+
+def export_pdfs(jobs, max_workers=None):
+    """Render PDF jobs across a process pool, yielding each file path as it is written"""
+    jobs = list(jobs)
+    if len(jobs) < 2:
+        for job in jobs:
+            yield render_pdf_job(job)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        yield from pool.map(render_pdf_job, jobs, chunksize=max(1, len(jobs) // 256))
+
+
+@functools.lru_cache(maxsize=4096)
+def day_ordinal(date_str):
+    """Convert a DD-MM-YYYY date string to a sortable day number (0 if unparsable)"""
+    try:
+        return datetime.datetime.strptime(date_str, "%d-%m-%Y").toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+
+# GS1 barcodes: GTIN-8/12/13/14 are compared as 14 digits, and GS1-128 / DataMatrix
+# scans carry application identifiers such as (01) GTIN, (17) expiry and (10) batch.
+GS1_SEPARATOR = "\x1d"
+GS1_FIXED_LENGTHS = {'01': 14, '02': 14, '11': 6, '13': 6, '15': 6, '17': 6}
+GS1_SYMBOLOGY_PREFIXES = (']C1', ']d2', ']Q3', ']e0')
+
+
+def gtin_check_digit_valid(digits):
+    """Whether the last digit of a GTIN is its GS1 mod-10 check digit"""
+    total = sum(int(digit) * (3 if index % 2 == 0 else 1) 
+                for index, digit in enumerate(reversed(digits[:-1])))
+    return (10 - total % 10) % 10 == int(digits[-1])
+
+
+def normalize_barcode(code):
+    """Key a barcode for lookup: GTINs padded to 14 digits, other codes as typed (trimmed)"""
+    code = code.strip()
+    if code.isdigit() and len(code) in (8, 12, 13, 14):
+        return code.zfill(14)
+    return code
+
+
+def parse_scan(raw):
+    """Split a scan into (barcode key, batch or None); GS1 element strings are unpacked"""
+    code = raw.strip()
+    for prefix in GS1_SYMBOLOGY_PREFIXES:
+        if code.startswith(prefix):
+            code = code[len(prefix):]
+            break
+    if not (code.startswith('01') and len(code) >= 16 and code[2:16].isdigit()):
+        return normalize_barcode(code), None
+    
+    fields = {}
+    position = 0
+    while position < len(code):
+        ai = code[position:position + 2]
+        position += 2
+        if ai in GS1_FIXED_LENGTHS:
+            fields[ai] = code[position:position + GS1_FIXED_LENGTHS[ai]]
+            position += GS1_FIXED_LENGTHS[ai]
+        else:
+            end = code.find(GS1_SEPARATOR, position)
+            end = len(code) if end < 0 else end
+            fields[ai] = code[position:end]
+            position = end + 1
+        if position < len(code) and code[position] == GS1_SEPARATOR:
+            position += 1
+    return fields['01'], fields.get('10')
+
+
+# Stock alert settings, kept with the receipt settings; company thresholds map a
+# company name to its own low-stock threshold. sales_window_days = 0 means all sales.
+DEFAULT_STOCK_SETTINGS = {
+    'low_stock_threshold': 20,
+    'expiry_window_days': 90,
+    'sales_window_days': 0,
+    'company_thresholds': {}
+}
+
+
+def stock_settings(settings=None):
+    """Settings with any missing stock alert values filled in from the defaults"""
+    merged = dict(DEFAULT_STOCK_SETTINGS, company_thresholds={})
+    merged.update(settings or {})
+    return merged
+
+
+def low_stock_threshold(details, settings):
+    """A medicine's own threshold, else its company's, else the store default"""
+    if details.get('low_stock') is not None:
+        return details['low_stock']
+    return settings['company_thresholds'].get(details.get('company', ''), settings['low_stock_threshold'])
+
+
+# Tax settings, kept with the receipt settings: a store rate, company rates (a company's
+# medicines are its tax category) and a medicine's own 'tax_rate', all in percent.
+# A rate of 0 makes the medicine or company exempt.
+DEFAULT_TAX_SETTINGS = {
+    'tax_label': "GST",
+    'tax_rate': 0.0,
+    'company_tax_rates': {}
+}
+
+
+def tax_settings(settings=None):
+    """Settings with any missing tax values filled in from the defaults"""
+    merged = dict(DEFAULT_TAX_SETTINGS, company_tax_rates={})
+    merged.update(settings or {})
+    return merged
+
+
+def tax_rate(details, settings):
+    """A medicine's own tax rate, else its company's, else the store rate"""
+    if details.get('tax_rate') is not None:
+        return details['tax_rate']
+    return settings['company_tax_rates'].get(details.get('company', ''), settings['tax_rate'])
+
+
+def tax_lines(gross_by_rate, discount_percent=0):
+    """[(rate, taxable paisa, tax paisa)] for {rate: gross paisa}, highest rate first.
+    
+    Tax is charged on each rate's discounted amount and rounded once per rate with
+    percent_of; exempt amounts get no line.
+    """
+    lines = []
+    for rate in sorted(gross_by_rate, reverse=True):
+        if rate:
+            taxable = gross_by_rate[rate] - percent_of(gross_by_rate[rate], discount_percent)
+            lines.append((rate, taxable, percent_of(taxable, rate)))
+    return lines
+
+
+def tax_record(lines):
+    """Tax lines as stored in a sale record, in rupees"""
+    return [{'rate': rate, 'taxable': to_rupees(taxable), 'amount': to_rupees(tax)} for rate, taxable, tax in lines]
+
+
+class StockIndex:
+    """Low-stock, empty-stock and expiry indexes over the medicines, updated per changed medicine.
+    
+    Expiry is a sorted list of (day, name), so any expiry window is counted with a
+    bisect; a threshold change reclassifies only the medicines that threshold governs.
+    Each medicine's tax rate is compiled here too, so pricing a sale line is a lookup.
+    """
+    
+    def __init__(self, medicines, settings):
+        self.medicines = medicines
+        self.settings = settings
+        self.by_company = {}   # company -> names
+        self.companies = {}    # name -> company it is indexed under
+        self.company_version = 0  # bumped whenever a company appears or disappears
+        self.custom = set()    # names with their own threshold
+        self.barcodes = {}     # normalized barcode -> name
+        self.barcode_of = {}   # name -> barcode it is indexed under
+        self.tax_rates = {}    # name -> tax rate (percent) in force for it
+        self.low = set()
+        self.empty = set()
+        self.expiry = []
+        self.expiry_days = {}
+        for name in medicines:
+            self.update(name)
+    
+    def update(self, name):
+        """Re-index one medicine after it was added, edited, sold, restocked or deleted"""
+        self.discard(name)
+        details = self.medicines.get(name)
+        if details is None:
+            return
+        company = details.get('company', '')
+        self.companies[name] = company
+        if company not in self.by_company:
+            self.by_company[company] = set()
+            self.company_version += 1
+        self.by_company[company].add(name)
+        if details.get('low_stock') is not None:
+            self.custom.add(name)
+        if details.get('barcode'):
+            barcode = normalize_barcode(details['barcode'])
+            self.barcodes[barcode] = name
+            self.barcode_of[name] = barcode
+        self.tax_rates[name] = tax_rate(details, tax_settings(self.settings))
+        day = day_ordinal(details['expiry'])
+        if day:
+            self.expiry_days[name] = day
+            bisect.insort(self.expiry, (day, name))
+        self.classify(name)
+    
+    def discard(self, name):
+        company = self.companies.pop(name, None)
+        if company is not None:
+            names = self.by_company[company]
+            names.discard(name)
+            if not names:
+                del self.by_company[company]
+                self.company_version += 1
+        self.custom.discard(name)
+        barcode = self.barcode_of.pop(name, None)
+        if barcode is not None and self.barcodes.get(barcode) == name:
+            del self.barcodes[barcode]
+        self.tax_rates.pop(name, None)
+        self.low.discard(name)
+        self.empty.discard(name)
+        day = self.expiry_days.pop(name, None)
+        if day is not None:
+            del self.expiry[bisect.bisect_left(self.expiry, (day, name))]
+    
+    def resolve_scan(self, raw):
+        """(name, batch) for a scanned code in O(1), or None; the batch is the scan's if it has one"""
+        barcode, batch = parse_scan(raw)
+        name = self.barcodes.get(barcode)
+        if name is None:
+            return None
+        return name, batch or self.medicines[name]['batch']
+    
+    def names_for(self, company):
+        """One company's medicine names, sorted, without touching any other company's"""
+        return sorted(self.by_company.get(company, ()))
+    
+    def classify(self, name):
+        details = self.medicines[name]
+        self.low.discard(name)
+        self.empty.discard(name)
+        if details['quantity'] == 0:
+            self.empty.add(name)
+        elif 0 < details['quantity'] < low_stock_threshold(details, stock_settings(self.settings)):
+            self.low.add(name)
+    
+    def rethreshold(self, company=None):
+        """Reclassify after a company's threshold (or, with None, the default) changed; returns the count"""
+        if company is None:
+            overridden = self.settings.get('company_thresholds', {})
+            companies = [name for name in self.by_company if name not in overridden]
+        else:
+            companies = [company]
+        count = 0
+        for company in companies:
+            for name in self.by_company.get(company, ()):
+                if name not in self.custom:
+                    self.classify(name)
+                    count += 1
+        return count
+    
+    def retax(self, company=None):
+        """Recompile tax rates after a company's rate (or, with None, the store rate) changed; returns the count"""
+        settings = tax_settings(self.settings)
+        if company is None:
+            companies = [name for name in self.by_company if name not in settings['company_tax_rates']]
+        else:
+            companies = [company]
+        count = 0
+        for company in companies:
+            for name in self.by_company.get(company, ()):
+                if self.medicines[name].get('tax_rate') is None:
+                    self.tax_rates[name] = tax_rate(self.medicines[name], settings)
+                    count += 1
+        return count
+    
+    def expiring(self, day, window):
+        """Names expiring within window days of day (already expired included), soonest first"""
+        end = bisect.bisect_right(self.expiry, (day + window, chr(0x10FFFF)))
+        return [name for _, name in self.expiry[:end]]
+    
+    def count_expiring(self, day, window):
+        return bisect.bisect_right(self.expiry, (day + window, chr(0x10FFFF)))
+
+
+class SimulatedScanner:
+    """Scanner device that replays preset codes at a fixed interval, for tests and demos.
+    
+    Scanner devices share one interface: read() blocks until the next scan and
+    returns None once the device is closed or exhausted.
+    """
+    
+    def __init__(self, codes, interval=1.0):
+        self.codes = collections.deque(codes)
+        self.interval = interval
+        self.closed = threading.Event()
+    
+    def read(self):
+        if not self.codes or self.closed.wait(self.interval):
+            return None
+        return self.codes.popleft()
+    
+    def close(self):
+        self.closed.set()
+
+
+class SerialScanner:
+    """Scanner on a serial port, one scan per line (needs pyserial)"""
+    
+    def __init__(self, port, baudrate=9600):
+        try:
+            import serial
+        except ImportError:
+            raise RuntimeError("Serial scanners need pyserial (pip install pyserial)")
+        self.port = serial.Serial(port, baudrate, timeout=0.5)
+        self.closed = threading.Event()
+    
+    def read(self):
+        while not self.closed.is_set():
+            line = self.port.readline().decode('ascii', 'replace').strip('\r\n')
+            if line:
+                return line
+        self.port.close()
+        return None
+    
+    def close(self):
+        self.closed.set()
+
+
+# Reorder engine: sales velocity is an exponentially weighted moving average of
+# units sold per day; stock is reordered when it covers less than the lead time
+# plus a safety margin, up to enough for the lead time plus a review period.
+VELOCITY_ALPHA = 0.2  # weight of the latest day (roughly a 9-day span)
+REORDER_LEAD_DAYS = 7
+REORDER_SAFETY_DAYS = 3
+REORDER_COVER_DAYS = 14
+
+
+class SalesVelocity:
+    """Per-medicine EWMA of units sold per day, updated in O(1) per sale line.
+    
+    Each medicine keeps [rate, day]: the average as of that day. Because the average
+    is linear in the daily units, a sale on any day (even an earlier one, or a refund
+    with negative units) can be folded in exactly without revisiting history.
+    """
+    
+    def __init__(self, alpha=VELOCITY_ALPHA):
+        self.alpha = alpha
+        self.rates = {}
+    
+    @classmethod
+    def from_sales(cls, sales, alpha=VELOCITY_ALPHA):
+        velocity = cls(alpha)
+        for sale in sales:
+            day = day_ordinal(sale['date'])
+            for item in sale['items']:
+                velocity.record(item['name'], item['qty'], day)
+        return velocity
+    
+    def record(self, name, qty, day):
+        if not day:
+            return
+        state = self.rates.get(name)
+        if state is None:
+            self.rates[name] = [self.alpha * qty, day]
+        elif day >= state[1]:
+            state[0] = state[0] * (1 - self.alpha) ** (day - state[1]) + self.alpha * qty
+            state[1] = day
+        else:
+            state[0] += self.alpha * qty * (1 - self.alpha) ** (state[1] - day)
+    
+    def rate(self, name, day):
+        """Units per day for a medicine as of the given day number"""
+        state = self.rates.get(name)
+        if state is None:
+            return 0.0
+        return max(0.0, state[0] * (1 - self.alpha) ** max(0, day - state[1]))
+
+
+def plan_reorders(medicines, velocity, day, lead_days=REORDER_LEAD_DAYS, 
+                  safety_days=REORDER_SAFETY_DAYS, cover_days=REORDER_COVER_DAYS):
+    """Return reorder suggestions for medicines at or below their reorder point, in one pass over SKUs"""
+    suggestions = []
+    for name, details in medicines.items():
+        rate = velocity.rate(name, day)
+        if rate <= 0:
+            continue
+        reorder_point = rate * (lead_days + safety_days)
+        if details['quantity'] > reorder_point:
+            continue
+        order_qty = math.ceil(rate * (lead_days + safety_days + cover_days) - details['quantity'])
+        if order_qty <= 0:
+            continue
+        suggestions.append({
+            'name': name,
+            'company': details.get('company', ''),
+            'batch': details.get('batch', ''),
+            'stock': details['quantity'],
+            'velocity': rate,
+            'days_left': details['quantity'] / rate,
+            'reorder_point': math.ceil(reorder_point),
+            'order_qty': order_qty,
+            'price': details['price']
+        })
+    suggestions.sort(key=lambda line: (line['company'].lower(), line['name']))
+    return suggestions
+
+
+# Markdown suggested for stock that needs to sell this many times faster to clear before expiry
+MARKDOWN_STEPS = ((1.25, 10), (1.5, 20), (2.0, 30))
+
+
+def forecast_expiry_losses(medicines, velocity, day):
+    """Project, per batch, the units still unsold at expiry at the current sales velocity.
+    
+    One pass over the SKUs. Returns the batches with a projected loss, largest value first,
+    each with a suggested action: a markdown when a modest speed-up clears the stock,
+    otherwise a transfer (or removal once expired).
+    """
+    forecasts = []
+    for name, details in medicines.items():
+        expiry_day = day_ordinal(details['expiry'])
+        if not expiry_day or details['quantity'] <= 0:
+            continue
+        days_left = expiry_day - day
+        rate = velocity.rate(name, day)
+        expected_sales = rate * max(0, days_left)
+        unsold = details['quantity'] - expected_sales
+        if unsold <= 0:
+            continue
+        unsold = math.ceil(unsold)
+        
+        if days_left <= 0:
+            action = "Expired: remove from sale"
+        elif rate <= 0:
+            action = "Transfer or return (no recent sales)"
+        else:
+            speedup = details['quantity'] / expected_sales
+            action = "Transfer to a faster-selling branch"
+            for limit, markdown in MARKDOWN_STEPS:
+                if speedup <= limit:
+                    action = f"Markdown {markdown}%"
+                    break
+        forecasts.append({
+            'name': name,
+            'company': details.get('company', ''),
+            'batch': details.get('batch', ''),
+            'expiry': details['expiry'],
+            'days_left': days_left,
+            'stock': details['quantity'],
+            'velocity': rate,
+            'unsold': unsold,
+            'loss': unsold * details['price'],
+            'action': action
+        })
+    forecasts.sort(key=lambda line: (-line['loss'], line['name']))
+    return forecasts
+
+
+class SalesStore:
+    """Sales ledger that gives every sale a stable, increasing id and indexes records by it"""
+    
+    # Sort keys available to query(); 'id' follows the order sales were made
+    SORT_KEYS = {
+        'id': lambda row: row['id'],
+        'date': lambda row: (row['day'], row['id']),
+        'customer': lambda row: (row['customer'].lower(), row['id']),
+        'items': lambda row: (row['items_text'].lower(), row['id']),
+        'qty': lambda row: (row['qty'], row['id']),
+        'gross': lambda row: (row['gross_paisa'], row['id']),
+        'discount': lambda row: (row['discount_paisa'], row['id']),
+        'tax': lambda row: (row['tax_paisa'], row['id']),
+        'total': lambda row: (row['total_paisa'], row['id']),
+    }
+    
+    def __init__(self, sales=None):
+        self.sales = []
+        self.by_id = {}
+        self.next_id = 1
+        
+        # Per-sale display rows, computed once when the sale is added
+        self.rows = {}
+        
+        # Secondary indexes: day number / customer / medicine -> sale ids in id order
+        self.by_day = {}
+        self.days = []
+        self.day_names = {}
+        self.by_customer = {}
+        self.customer_names = {}
+        self.by_customer_id = {}  # registered customer id -> sale ids
+        self.by_batch = {}        # batch -> ids of the sales and refunds with lines of it
+        self.by_medicine = {}
+        
+        # Quantities already returned per original sale: sale id -> {medicine: qty}
+        self.refunded = {}
+        
+        # Rollups per day and for the whole ledger
+        self.daily = {}
+        self.totals = self.empty_totals()
+        
+        # Units sold per day per medicine, for the reorder engine
+        self.velocity = SalesVelocity()
+        
+        for sale in sales or []:
+            self.add(sale)
+    
+    @staticmethod
+    def empty_totals():
+        return {'transactions': 0, 'refunds': 0, 'items_sold': 0,
+                'gross_paisa': 0, 'discount_paisa': 0, 'tax_paisa': 0, 'net_paisa': 0}
+    
+    @staticmethod
+    def accumulate(totals, row, sign=1):
+        """Add (sign=1) or remove (sign=-1) a row's figures from a totals dict"""
+        totals['refunds' if row['refund'] else 'transactions'] += sign
+        totals['items_sold'] += sign * row['qty']
+        totals['gross_paisa'] += sign * row['gross_paisa']
+        totals['discount_paisa'] += sign * row['discount_paisa']
+        totals['tax_paisa'] += sign * row['tax_paisa']
+        totals['net_paisa'] += sign * row['total_paisa']
+    
+    @staticmethod
+    def in_rupees(totals):
+        """Return a totals dict with its paisa sums given as rupee gross_total, discount, tax and net_total"""
+        figures = {key: value for key, value in totals.items() if not key.endswith('_paisa')}
+        figures['gross_total'] = to_rupees(totals['gross_paisa'])
+        figures['discount'] = to_rupees(totals['discount_paisa'])
+        figures['tax'] = to_rupees(totals['tax_paisa'])
+        figures['net_total'] = to_rupees(totals['net_paisa'])
+        return figures
+    
+    def add(self, sale):
+        """Append a sale, assigning a new id unless it already carries an unused one"""
+        sale_id = sale.get('id')
+        if not isinstance(sale_id, int) or sale_id in self.by_id:
+            sale_id = self.next_id
+            sale['id'] = sale_id
+        self.next_id = max(self.next_id, sale_id + 1)
+        self.sales.append(sale)
+        self.by_id[sale_id] = sale
+        
+        row = self.make_row(sale)
+        self.rows[sale_id] = row
+        
+        day = row['day']
+        if day not in self.by_day:
+            self.by_day[day] = []
+            self.day_names[day] = sale['date']
+            bisect.insort(self.days, day)
+        self.by_day[day].append(sale_id)
+        customer_key = row['customer'].lower()
+        self.by_customer.setdefault(customer_key, []).append(sale_id)
+        self.customer_names.setdefault(customer_key, row['customer'])
+        if sale.get('customer_id') is not None:
+            self.by_customer_id.setdefault(sale['customer_id'], []).append(sale_id)
+        for item in sale['items']:
+            ids = self.by_medicine.setdefault(item['name'], [])
+            if not ids or ids[-1] != sale_id:
+                ids.append(sale_id)
+            self.velocity.record(item['name'], item['qty'], day)
+            batch = item.get('batch')
+            if batch:
+                ids = self.by_batch.setdefault(batch, [])
+                if not ids or ids[-1] != sale_id:
+                    ids.append(sale_id)
+        
+        if row['refund']:
+            returned = self.refunded.setdefault(sale['refund_of'], {})
+            for item in sale['items']:
+                returned[item['name']] = returned.get(item['name'], 0) - item['qty']
+        
+        self.apply_to_rollups(row, 1)
+        return sale
+    
+    def returnable(self, sale_id):
+        """Return {medicine: quantity still available to refund} for a sale"""
+        sale = self.by_id.get(sale_id)
+        if not sale or sale.get('type') == 'refund':
+            return {}
+        returned = self.refunded.get(sale_id, {})
+        remaining = {}
+        for item in sale['items']:
+            remaining[item['name']] = remaining.get(item['name'], 0) + item['qty']
+        for name, qty in returned.items():
+            remaining[name] = remaining.get(name, 0) - qty
+        return {name: qty for name, qty in remaining.items() if qty > 0}
+    
+    @staticmethod
+    def make_row(sale):
+        """Summarise a sale into the values shown in history listings (amounts in paisa)"""
+        gross = sum(to_paisa(item['price']) * item['qty'] for item in sale['items'])
+        tax = to_paisa(sale.get('tax_total', 0))
+        total = to_paisa(sale['total'])
+        items_text = ", ".join(item['name'] for item in sale['items'])
+        refund = sale.get('type') == 'refund'
+        if refund:
+            items_text = f"REFUND of #{sale['refund_of']}: {items_text}"
+        return {
+            'id': sale['id'],
+            'refund': refund,
+            'day': day_ordinal(sale['date']),
+            'date': sale['date'],
+            'customer': sale.get('customer', 'Walk-in'),
+            'items_text': items_text,
+            'qty': sum(item['qty'] for item in sale['items']),
+            'gross_paisa': gross,
+            'discount_paisa': gross + tax - total,
+            'tax_paisa': tax,
+            'total_paisa': total,
+        }
+    
+    def apply_to_rollups(self, row, sign):
+        """Add (sign=1) or remove (sign=-1) a row's figures from the daily and ledger rollups"""
+        day_totals = self.daily.setdefault(row['date'], self.empty_totals())
+        self.accumulate(day_totals, row, sign)
+        self.accumulate(self.totals, row, sign)
+    
+    def get(self, sale_id):
+        """Return the sale with the given id, or None"""
+        return self.by_id.get(sale_id)
+    
+    def recall(self, batch):
+        """Sale lines holding a batch: [{'sale', 'name', 'sold', 'returned'}] in sale id order.
+        
+        Refund lines of the batch are netted against the sale they return, so a line
+        whose units all came back has sold == returned.
+        """
+        lines = {}
+        for sale_id in self.by_batch.get(batch, ()):
+            sale = self.by_id[sale_id]
+            original = sale['refund_of'] if sale.get('type') == 'refund' else sale_id
+            for item in sale['items']:
+                if item.get('batch') != batch:
+                    continue
+                key = (original, item['name'])
+                if key not in lines:
+                    lines[key] = {'sale': self.by_id[original], 'name': item['name'], 'sold': 0, 'returned': 0}
+                if item['qty'] > 0:
+                    lines[key]['sold'] += item['qty']
+                else:
+                    lines[key]['returned'] -= item['qty']
+        return sorted(lines.values(), key=lambda line: line['sale']['id'])
+    
+    def customer_sales(self, customer_id):
+        """A registered customer's sales and refunds, newest first"""
+        return [self.by_id[sale_id] for sale_id in reversed(self.by_customer_id.get(customer_id, ()))]
+    
+    def recent(self, count):
+        """Return the newest sales first"""
+        return self.sales[:-count - 1:-1]
+    
+    def day_range(self, date_from=None, date_to=None):
+        """Return the indexed day numbers between two DD-MM-YYYY dates (inclusive)"""
+        low = bisect.bisect_left(self.days, day_ordinal(date_from)) if date_from else 0
+        high = bisect.bisect_right(self.days, day_ordinal(date_to)) if date_to else len(self.days)
+        return self.days[low:high]
+    
+    def query(self, date_from=None, date_to=None, customer=None, medicine=None,
+              sort='id', descending=True, offset=0, limit=100):
+        """Return (page of rows, matching count, totals) for a filtered, sorted history view"""
+        filtered = customer or medicine
+        ranged = date_from or date_to
+        days = self.day_range(date_from, date_to) if ranged else None
+        
+        if filtered:
+            # Start from the smallest applicable index and check the rest per row
+            candidates = []
+            if customer:
+                candidates.append(self.by_customer.get(customer.lower(), []))
+            if medicine:
+                candidates.append(self.by_medicine.get(medicine, []))
+            ids = min(candidates, key=len)
+            wanted = [set(other) for other in candidates if other is not ids]
+            day_set = set(days) if days is not None else None
+            ids = [sale_id for sale_id in ids
+                   if all(sale_id in other for other in wanted)
+                   and (day_set is None or self.rows[sale_id]['day'] in day_set)]
+        elif ranged:
+            ids = [sale_id for day in days for sale_id in self.by_day[day]]
+        else:
+            ids = None  # the whole ledger, already in id order
+        
+        count = len(self.sales) if ids is None else len(ids)
+        
+        # Totals come from the rollups unless a row-level filter is active
+        if filtered:
+            totals = self.empty_totals()
+            for sale_id in ids:
+                self.accumulate(totals, self.rows[sale_id])
+        elif ranged:
+            totals = self.empty_totals()
+            for day in days:
+                for key, value in self.daily[self.day_names[day]].items():
+                    totals[key] += value
+        else:
+            totals = dict(self.totals)
+        
+        # Fetch only the rows on the requested page
+        if sort == 'id':
+            if ids is None:
+                ids = [sale['id'] for sale in self.sales[max(0, count - offset - limit):count - offset]] \
+                    if descending else [sale['id'] for sale in self.sales[offset:offset + limit]]
+                page = ids[::-1] if descending else ids
+            else:
+                page = ids[::-1][offset:offset + limit] if descending else ids[offset:offset + limit]
+            rows = [self.rows[sale_id] for sale_id in page]
+        else:
+            key = self.SORT_KEYS[sort]
+            candidates = self.rows.values() if ids is None else (self.rows[sale_id] for sale_id in ids)
+            pick = heapq.nlargest if descending else heapq.nsmallest
+            rows = pick(offset + limit, candidates, key=key)[offset:]
+        
+        return rows, count, self.in_rupees(totals)
+    
+    def __iter__(self):
+        return iter(self.sales)
+    
+    def __len__(self):
+        return len(self.sales)
+
+
+def normalize_phone(phone):
+    """The digits of a phone number, so '0300-1234567' and '0300 1234567' match"""
+    return "".join(ch for ch in phone if ch.isdigit())
+
+
+class CustomerRegistry:
+    """Registered customers ({'id', 'name', 'phone'}) with phone and name indexes.
+    
+    Phones and lower-cased names are kept in sorted lists, so autocomplete on a
+    typed prefix is a bisect rather than a scan of every customer.
+    """
+    
+    def __init__(self, records=None):
+        self.by_id = {}
+        self.by_phone = {}  # normalized phone -> id
+        self.phones = []    # sorted normalized phones
+        self.names = []     # sorted (lower-cased name, id)
+        self.next_id = 1
+        for record in records or []:
+            self.index(dict(record))
+    
+    def __len__(self):
+        return len(self.by_id)
+    
+    def index(self, record):
+        self.by_id[record['id']] = record
+        self.next_id = max(self.next_id, record['id'] + 1)
+        phone = normalize_phone(record['phone'])
+        if phone:
+            self.by_phone[phone] = record['id']
+            bisect.insort(self.phones, phone)
+        bisect.insort(self.names, (record['name'].lower(), record['id']))
+    
+    def unindex(self, record):
+        phone = normalize_phone(record['phone'])
+        if phone and self.by_phone.get(phone) == record['id']:
+            del self.by_phone[phone]
+            del self.phones[bisect.bisect_left(self.phones, phone)]
+        del self.names[bisect.bisect_left(self.names, (record['name'].lower(), record['id']))]
+    
+    def check(self, name, phone, customer_id=None):
+        if not name:
+            raise ValueError("Customer name cannot be empty")
+        owner = self.by_phone.get(normalize_phone(phone))
+        if owner is not None and owner != customer_id:
+            raise ValueError(f"Phone {phone} is already registered to {self.by_id[owner]['name']}")
+    
+    def add(self, name, phone=''):
+        """Register a customer and return the record (ValueError for a blank name or a phone in use)"""
+        name, phone = name.strip(), phone.strip()
+        self.check(name, phone)
+        record = {'id': self.next_id, 'name': name, 'phone': phone}
+        self.index(record)
+        return record
+    
+    def update(self, customer_id, name, phone=''):
+        """Change a customer's name and phone; their sales stay linked by id"""
+        name, phone = name.strip(), phone.strip()
+        self.check(name, phone, customer_id)
+        record = self.by_id[customer_id]
+        self.unindex(record)
+        record.update(name=name, phone=phone)
+        self.index(record)
+        return record
+    
+    def get(self, customer_id):
+        return self.by_id.get(customer_id)
+    
+    def search(self, text, limit=10):
+        """Customers whose phone (for numeric text) or name starts with text, up to limit"""
+        text = text.strip()
+        if not text:
+            return []
+        digits = normalize_phone(text)
+        if digits and not any(ch.isalpha() for ch in text):
+            start = bisect.bisect_left(self.phones, digits)
+            ids = [self.by_phone[phone] for phone in itertools.islice(self.phones, start, start + limit)
+                   if phone.startswith(digits)]
+        else:
+            key = text.lower()
+            start = bisect.bisect_left(self.names, (key,))
+            ids = [customer_id for name, customer_id in itertools.islice(self.names, start, start + limit)
+                   if name.startswith(key)]
+        return [self.by_id[customer_id] for customer_id in ids]
+    
+    @staticmethod
+    def label(record):
+        """How a customer is shown in counter suggestions; match() reads it back"""
+        return f"{record['name']} ({record['phone'] or '#' + str(record['id'])})"
+    
+    def match(self, text):
+        """The customer a counter entry names: a label from search(), or a registered phone"""
+        text = text.strip()
+        if text.endswith(')') and ' (' in text:
+            name, key = text[:-1].rsplit(' (', 1)
+            if key.startswith('#') and key[1:].isdigit():
+                record = self.by_id.get(int(key[1:]))
+            else:
+                record = self.by_id.get(self.by_phone.get(normalize_phone(key)))
+            return record if record and record['name'] == name else None
+        if text and not any(ch.isalpha() for ch in text):
+            return self.by_id.get(self.by_phone.get(normalize_phone(text)))
+        return None
+    
+    def records(self):
+        """Copies of the records, in id order, as saved"""
+        return [dict(self.by_id[customer_id]) for customer_id in sorted(self.by_id)]
+
+
+# Sales analytics: sale lines as NumPy columns (NumPy is imported only when used)
+ANALYTICS_COLUMNS = (
+    ('sale', 'i8'),
+    ('day', 'i4'),
+    ('hour', 'i1'),  # -1 when the sale has no timestamp
+    ('medicine', 'i4'),
+    ('company', 'i4'),
+    ('qty', 'i4'),
+    ('gross', 'f8'),
+    ('discount', 'f8'),
+    ('net', 'f8'),
+    ('discount_percent', 'f4'),
+)
+DISCOUNT_BANDS = (0, 5, 10, 20)  # upper bounds (%) of the discount bands; the last band is open
+ABC_LIMITS = (0.80, 0.95)  # cumulative revenue share closing classes A and B
+
+
+class SalesAnalytics:
+    """Sale lines held as NumPy columns for vectorized reports.
+    
+    With a directory the columns are cached as memory-mapped files, and each sync
+    appends only the sales added since the last one. Without a directory they are
+    kept in memory. Medicine and company names are stored as integer codes.
+    """
+    
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "analytics.json") if directory else None
+        self.columns = {}
+        self.reset()
+        if directory:
+            self.load_meta()
+    
+    def reset(self):
+        self.rows = 0
+        self.sales = 0
+        self.last_id = None
+        self.medicines = []
+        self.medicine_codes = {}
+        self.companies = []
+        self.company_codes = {}
+        self.columns = {}
+    
+    def column_path(self, name):
+        return os.path.join(self.directory, name + ".col")
+    
+    def load_meta(self):
+        """Open the cached columns, trimming lines written after the last metadata update"""
+        import numpy as np
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.rows = meta['rows']
+            self.sales = meta['sales']
+            self.last_id = meta['last_id']
+            self.medicines = meta['medicines']
+            self.companies = meta['companies']
+            for name, dtype in ANALYTICS_COLUMNS:
+                path = self.column_path(name)
+                size = self.rows * np.dtype(dtype).itemsize
+                if os.path.getsize(path) < size:
+                    raise ValueError(f"{path} is shorter than its metadata")
+                if os.path.getsize(path) > size:
+                    with open(path, 'r+b') as f:
+                        f.truncate(size)
+        except (OSError, ValueError, KeyError):
+            self.reset()
+            return
+        self.medicine_codes = {name: code for code, name in enumerate(self.medicines)}
+        self.company_codes = {name: code for code, name in enumerate(self.companies)}
+        self.map_columns()
+    
+    def map_columns(self):
+        import numpy as np
+        self.columns = {}
+        for name, dtype in ANALYTICS_COLUMNS:
+            if self.rows == 0:
+                self.columns[name] = np.zeros(0, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(self.column_path(name), dtype=dtype, mode='r', shape=(self.rows,))
+    
+    def code(self, codes, names, name):
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(names)
+            names.append(name)
+        return code
+    
+    def sync(self, sales, medicines):
+        """Bring the columns up to date with the ledger, appending only new sales.
+        
+        A ledger that no longer matches what was cached (e.g. after loading another
+        file) is rebuilt from scratch. Companies are taken from medicines as of the sync.
+        """
+        import numpy as np
+        if self.sales > len(sales) or (self.sales and sales[self.sales - 1].get('id') != self.last_id):
+            self.reset()
+        new_sales = sales[self.sales:]
+        if not new_sales:
+            return
+        
+        lines = {name: [] for name, _ in ANALYTICS_COLUMNS}
+        for sale in new_sales:
+            day = day_ordinal(sale['date'])
+            try:
+                hour = int(sale.get('timestamp', '')[11:13])
+            except ValueError:
+                hour = -1
+            gross_total = sum(item['price'] * item['qty'] for item in sale['items'])
+            share = sale.get('discount', gross_total - sale['total']) / gross_total if gross_total else 0.0
+            percent = sale.get('discount_percent', share * 100)
+            for item in sale['items']:
+                gross = item['price'] * item['qty']
+                company = medicines.get(item['name'], {}).get('company', '')
+                lines['sale'].append(sale.get('id', 0))
+                lines['day'].append(day)
+                lines['hour'].append(hour)
+                lines['medicine'].append(self.code(self.medicine_codes, self.medicines, item['name']))
+                lines['company'].append(self.code(self.company_codes, self.companies, company))
+                lines['qty'].append(item['qty'])
+                lines['gross'].append(gross)
+                lines['discount'].append(gross * share)
+                lines['net'].append(gross - gross * share)
+                lines['discount_percent'].append(percent)
+        arrays = {name: np.asarray(lines[name], dtype=dtype) for name, dtype in ANALYTICS_COLUMNS}
+        
+        self.rows += len(lines['sale'])
+        self.sales = len(sales)
+        self.last_id = sales[-1].get('id')
+        if not self.directory:
+            self.columns = {name: np.concatenate([self.columns[name], arrays[name]]) if name in self.columns 
+                            else arrays[name] for name, _ in ANALYTICS_COLUMNS}
+            return
+        
+        # Append to the column files, then record the new length; drop the maps while writing
+        os.makedirs(self.directory, exist_ok=True)
+        rebuild = self.rows == len(lines['sale'])
+        self.columns = {}
+        for name, _ in ANALYTICS_COLUMNS:
+            with open(self.column_path(name), 'wb' if rebuild else 'ab') as f:
+                arrays[name].tofile(f)
+        meta = {'rows': self.rows, 'sales': self.sales, 'last_id': self.last_id,
+                'medicines': self.medicines, 'companies': self.companies}
+        write_file_atomic(self.meta_path, json.dumps(meta).encode('utf-8'))
+        self.map_columns()
+    
+    def top_sellers(self, count=10):
+        """[(medicine, units, net revenue)] for the best sellers by units"""
+        import numpy as np
+        size = len(self.medicines)
+        units = np.bincount(self.columns['medicine'], weights=self.columns['qty'], minlength=size)
+        revenue = np.bincount(self.columns['medicine'], weights=self.columns['net'], minlength=size)
+        best = np.argsort(-units, kind='stable')[:count]
+        return [(self.medicines[code], int(units[code]), float(revenue[code])) for code in best if units[code] > 0]
+    
+    def revenue_by_company(self):
+        """[(company, units, net revenue)], highest revenue first"""
+        import numpy as np
+        size = len(self.companies)
+        units = np.bincount(self.columns['company'], weights=self.columns['qty'], minlength=size)
+        revenue = np.bincount(self.columns['company'], weights=self.columns['net'], minlength=size)
+        order = np.argsort(-revenue, kind='stable')
+        return [(self.companies[code] or "Unknown", int(units[code]), float(revenue[code])) for code in order]
+    
+    def discount_impact(self):
+        """Per discount band: (label, lines, units, gross, discount, net)"""
+        import numpy as np
+        bands = np.searchsorted(np.asarray(DISCOUNT_BANDS, dtype='f4'), self.columns['discount_percent'])
+        size = len(DISCOUNT_BANDS) + 1
+        counts = np.bincount(bands, minlength=size)
+        sums = {name: np.bincount(bands, weights=self.columns[name], minlength=size) 
+                for name in ('qty', 'gross', 'discount', 'net')}
+        labels = ["No discount"] + [f"{low}-{high}%" for low, high in zip(DISCOUNT_BANDS, DISCOUNT_BANDS[1:])]
+        labels.append(f"Over {DISCOUNT_BANDS[-1]}%")
+        return [(labels[band], int(counts[band]), int(sums['qty'][band]), float(sums['gross'][band]),
+                 float(sums['discount'][band]), float(sums['net'][band])) for band in range(size)]
+    
+    def hourly_heatmap(self):
+        """7 x 24 array of net revenue by weekday (Monday first) and hour of day"""
+        import numpy as np
+        timed = (self.columns['hour'] >= 0) & (self.columns['day'] > 0)
+        weekday = (self.columns['day'][timed] - 1) % 7
+        cells = weekday * 24 + self.columns['hour'][timed]
+        return np.bincount(cells, weights=self.columns['net'][timed], minlength=7 * 24).reshape(7, 24)
+    
+    def abc_classes(self):
+        """{'A'|'B'|'C': [(medicine, net revenue)]} by cumulative share of net revenue"""
+        import numpy as np
+        revenue = np.bincount(self.columns['medicine'], weights=self.columns['net'], minlength=len(self.medicines))
+        order = np.argsort(-revenue, kind='stable')
+        order = order[revenue[order] > 0]
+        total = revenue[order].sum()
+        classes = {'A': [], 'B': [], 'C': []}
+        if not total:
+            return classes
+        # A share is judged by the revenue before the item, so the top seller is always class A
+        before = (np.cumsum(revenue[order]) - revenue[order]) / total
+        labels = np.where(before < ABC_LIMITS[0], 'A', np.where(before < ABC_LIMITS[1], 'B', 'C'))
+        for code, label in zip(order.tolist(), labels.tolist()):
+            classes[label].append((self.medicines[code], float(revenue[code])))
+        return classes
+
+
+# Snapshot file format: magic, version, a section table, then one length-prefixed
+# payload per section. Record lists are stored column by column so numbers load
+# straight from typed arrays and repeated strings share one table.
+SNAPSHOT_MAGIC = b"PHCSNAP\0"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXTENSION = ".phc"
+AUTOSAVE_GENERATIONS = 3
+
+# Older autosave locations in the temp folder, migrated into the first profile that opens empty
+AUTOSAVE_PATH = os.path.join(tempfile.gettempdir(), "pharmacare_autosave" + SNAPSHOT_EXTENSION)
+LEGACY_AUTOSAVE_PATH = os.path.join(tempfile.gettempdir(), "pharmacare_autosave.pkl")
+AUTOSAVE_DIR = os.path.join(tempfile.gettempdir(), "pharmacare_autosave")
+
+# Data directory holding one autosave store per named profile (e.g. per branch)
+DEFAULT_DATA_DIR = os.environ.get("PHARMACARE_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".pharmacare")
+DEFAULT_PROFILE = "main"
+PROFILE_CACHE_SIZE = 4
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot file is damaged, too new, or fails its schema check"""
+
+
+def _int_typecode(values):
+    """Return the narrowest signed array typecode that holds all values, or None"""
+    low, high = min(values, default=0), max(values, default=0)
+    for code in ('b', 'h', 'i', 'q'):
+        limit = 1 << (array(code).itemsize * 8 - 1)
+        if -limit <= low and high < limit:
+            return code
+    return None
+
+
+def _pack_array(code, values, blob):
+    """Append values to blob as a little-endian array and return (offset, length)"""
+    packed = array(code, values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    offset = len(blob)
+    blob += packed.tobytes()
+    return offset, len(blob) - offset
+
+
+def _unpack_array(code, buffer):
+    packed = array(code)
+    packed.frombytes(buffer)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tolist()
+
+
+def _encode_table(rows, blob, strings):
+    """Encode a list of dicts column by column, returning the table's header"""
+    names = {}
+    for row in rows:
+        for name in row:
+            names.setdefault(name, None)
+    
+    columns = []
+    for name in names:
+        missing = [index for index, row in enumerate(rows) if name not in row]
+        present = [row[name] for row in rows if name in row]
+        values = [row.get(name) for row in rows]
+        kinds = {type(value) for value in present}
+        column = {'name': name}
+        if missing:
+            column['missing'] = missing
+        
+        if kinds == {bool}:
+            column.update(kind='bool', code='b')
+            column['at'] = _pack_array('b', [bool(value) for value in values], blob)
+        elif kinds == {int} and _int_typecode(present):
+            code = _int_typecode(present)
+            column.update(kind='int', code=code)
+            column['at'] = _pack_array(code, [value or 0 for value in values], blob)
+        elif kinds == {float}:
+            column.update(kind='float', code='d')
+            column['at'] = _pack_array('d', [value or 0.0 for value in values], blob)
+        elif kinds == {str}:
+            indexes = [strings.setdefault(value, len(strings)) if value is not None else 0 for value in values]
+            code = _int_typecode(indexes)
+            column.update(kind='str', code=code)
+            column['at'] = _pack_array(code, indexes, blob)
+        elif kinds == {list} and all(isinstance(item, dict) for value in present for item in value):
+            counts = [len(value) if value is not None else 0 for value in values]
+            code = _int_typecode(counts)
+            column.update(kind='table', code=code)
+            column['at'] = _pack_array(code, counts, blob)
+            column['table'] = _encode_table([item for value in present for item in value], blob, strings)
+        else:
+            offset = len(blob)
+            blob += json.dumps(values, separators=(',', ':')).encode('utf-8')
+            column.update(kind='json', at=(offset, len(blob) - offset))
+        columns.append(column)
+    
+    return {'rows': len(rows), 'columns': columns}
+
+
+def _decode_table(header, blob, strings):
+    """Rebuild the list of dicts described by a table header"""
+    names = []
+    columns = []
+    for column in header['columns']:
+        offset, length = column['at']
+        buffer = blob[offset:offset + length]
+        kind = column['kind']
+        if kind == 'json':
+            values = json.loads(bytes(buffer))
+        else:
+            values = _unpack_array(column['code'], buffer)
+            if kind == 'bool':
+                values = list(map(bool, values))
+            elif kind == 'str':
+                values = list(map(strings.__getitem__, values))
+            elif kind == 'table':
+                items = iter(_decode_table(column['table'], blob, strings))
+                values = [list(itertools.islice(items, count)) for count in values]
+        names.append(column['name'])
+        columns.append(values)
+    
+    if not columns:
+        return [{} for _ in range(header['rows'])]
+    rows = [dict(zip(names, values)) for values in zip(*columns)]
+    
+    # Drop keys that were absent from the original records
+    for name, column in zip(names, header['columns']):
+        for index in column.get('missing', ()):
+            del rows[index][name]
+    return rows
+
+
+def _encode_section(value):
+    """Encode one top-level value, choosing a columnar layout for record collections"""
+    blob = bytearray()
+    strings = {}
+    if isinstance(value, list) and value and all(isinstance(row, dict) for row in value):
+        header = {'layout': 'records', 'table': _encode_table(value, blob, strings)}
+    elif isinstance(value, dict) and value and all(isinstance(key, str) and isinstance(row, dict)
+                                                   for key, row in value.items()):
+        keys = [strings.setdefault(key, len(strings)) for key in value]
+        header = {'layout': 'keyed', 'keys': keys, 'table': _encode_table(list(value.values()), blob, strings)}
+    else:
+        return _encode_plain(value)
+    header['strings'] = list(strings)
+    header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    return struct.pack('<I', len(header)) + header + bytes(blob)
+
+
+def _encode_plain(value):
+    header = json.dumps({'layout': 'plain', 'value': value}, separators=(',', ':')).encode('utf-8')
+    return struct.pack('<I', len(header)) + header
+
+
+def _decode_section(payload):
+    (header_length,) = struct.unpack_from('<I', payload, 0)
+    header = json.loads(bytes(payload[4:4 + header_length]))
+    layout = header['layout']
+    if layout == 'plain':
+        return header['value']
+    blob = payload[4 + header_length:]
+    rows = _decode_table(header['table'], blob, header['strings'])
+    if layout == 'records':
+        return rows
+    return dict(zip(map(header['strings'].__getitem__, header['keys']), rows))
+
+
+def encode_snapshot(data):
+    """Encode a dict of JSON-compatible top-level values in the snapshot format"""
+    payloads = [(name.encode('utf-8'), _encode_section(value)) for name, value in data.items()]
+    
+    # Header: magic, version, section count, then (name, offset, length, crc32) per section
+    table_size = sum(2 + len(name) + 8 + 8 + 4 for name, _ in payloads)
+    offset = len(SNAPSHOT_MAGIC) + 4 + table_size
+    out = bytearray(SNAPSHOT_MAGIC + struct.pack('<HH', SNAPSHOT_VERSION, len(payloads)))
+    for name, payload in payloads:
+        out += struct.pack('<H', len(name)) + name
+        out += struct.pack('<QQI', offset, len(payload), zlib.crc32(payload))
+        offset += len(payload)
+    for _, payload in payloads:
+        out += payload
+    return bytes(out)
+
+
+def save_snapshot(path, data, generations=0):
+    """Atomically write data to path as a snapshot, keeping that many older generations"""
+    write_file_atomic(path, encode_snapshot(data), generations)
+
+
+def generation_paths(path, generations):
+    """Return path followed by its rotated older copies (path.1 is the newest of those)"""
+    return [path] + [f"{path}.{index}" for index in range(1, generations + 1)]
+
+
+def write_file_atomic(path, payload, generations=0):
+    """Write payload to a temp file, fsync it and rename it over path so readers never see a partial file"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    
+    # Shift older generations down before the new file takes the main name
+    if generations:
+        paths = generation_paths(path, generations)
+        for older, newer in reversed(list(zip(paths[1:], paths[:-1]))):
+            if os.path.exists(newer):
+                os.replace(newer, older)
+    os.replace(temp_path, path)
+    
+    # Persist the rename itself
+    if os.name == 'posix':
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class SnapshotReader:
+    """Memory-mapped, read-only view of a snapshot that decodes sections on demand"""
+    
+    def __init__(self, source):
+        """Open a snapshot file by path, or read one already held in memory as bytes"""
+        self.file = None
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.map = source
+            label = "Snapshot data"
+        else:
+            label = source
+            self.file = open(source, 'rb')
+            try:
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self.file.close()
+                raise SnapshotError(f"{source} is empty")
+        try:
+            self.sections = self._read_table()
+        except (struct.error, UnicodeDecodeError):
+            self.close()
+            raise SnapshotError(f"{label} has a damaged header")
+        except SnapshotError:
+            self.close()
+            raise
+    
+    def _read_table(self):
+        if self.map[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise SnapshotError("Not a PharmaCare snapshot file")
+        position = len(SNAPSHOT_MAGIC)
+        self.version, count = struct.unpack_from('<HH', self.map, position)
+        if self.version > SNAPSHOT_VERSION:
+            raise SnapshotError(f"Snapshot version {self.version} is newer than this program supports")
+        position += 4
+        sections = {}
+        for _ in range(count):
+            (name_length,) = struct.unpack_from('<H', self.map, position)
+            name = self.map[position + 2:position + 2 + name_length].decode('utf-8')
+            position += 2 + name_length
+            sections[name] = struct.unpack_from('<QQI', self.map, position)
+            position += 20
+        return sections
+    
+    def read(self, name):
+        """Decode a single section, verifying its checksum"""
+        if name not in self.sections:
+            raise SnapshotError(f"Snapshot has no '{name}' section")
+        offset, length, crc = self.sections[name]
+        payload = memoryview(self.map)[offset:offset + length]
+        # Decoding only allocates acyclic containers, so skip the cyclic collector meanwhile
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                raise SnapshotError(f"Section '{name}' is damaged")
+            return _decode_section(payload)
+        except (struct.error, KeyError, IndexError, TypeError, ValueError) as e:
+            if isinstance(e, SnapshotError):
+                raise
+            raise SnapshotError(f"Section '{name}' could not be decoded: {e}")
+        finally:
+            payload.release()
+            if collecting:
+                gc.enable()
+    
+    def read_all(self):
+        return {name: self.read(name) for name in self.sections}
+    
+    def close(self):
+        if self.file is not None:
+            self.map.close()
+            self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameLog:
+    """Append-only file of checksummed frames, each a snapshot holding one batch of records"""
+    
+    FRAME_HEADER = struct.Struct('<II')  # payload length, crc32
+    
+    def __init__(self, path, magic, section, generations=0):
+        self.path = path
+        self.magic = magic
+        self.section = section
+        self.generations = generations  # older copies kept by rewrite
+        self.size = 0  # bytes of the log known to be intact
+        self.frames = 0
+    
+    def exists(self):
+        return os.path.exists(self.path)
+    
+    def frame(self, records):
+        payload = encode_snapshot({self.section: records})
+        return self.FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+    
+    def rewrite(self, records):
+        """Replace the whole log with a single frame, rotating the old log into its generations"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        payload = self.magic + self.frame(records)
+        write_file_atomic(self.path, payload, self.generations)
+        self.size = len(payload)
+        self.frames = 1
+    
+    def append(self, records):
+        """Append records as one frame, first dropping any torn write after the last good frame"""
+        if not self.exists() or self.size == 0:
+            return self.rewrite(records)
+        frame = self.frame(records)
+        with open(self.path, 'r+b') as f:
+            f.seek(self.size)
+            f.truncate()
+            f.write(frame)
+            f.flush()
+            os.fsync(f.fileno())
+        self.size += len(frame)
+        self.frames += 1
+    
+    def scan(self, offset=0, decode=True):
+        """Yield (start, end, records) for each intact frame from a frame boundary onward.
+        
+        Stops at a torn or damaged final frame. A scan that runs to the end also
+        records where the intact part of the log ends, so the next append goes there.
+        """
+        if not self.exists():
+            return
+        with open(self.path, 'rb') as f:
+            if f.read(len(self.magic)) != self.magic:
+                raise SnapshotError(f"{self.path} is not a {self.section} log")
+            position = max(offset, len(self.magic))
+            f.seek(position)
+            log = f.read()
+        
+        base = position
+        frames = 0
+        cursor = 0
+        while cursor + self.FRAME_HEADER.size <= len(log):
+            length, crc = self.FRAME_HEADER.unpack_from(log, cursor)
+            start = cursor + self.FRAME_HEADER.size
+            payload = log[start:start + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                break
+            records = SnapshotReader(payload).read(self.section) if decode else None
+            yield base + cursor, base + start + length, records
+            cursor = start + length
+            frames += 1
+        self.size = base + cursor
+        if offset == 0:
+            self.frames = frames
+    
+    def read(self):
+        """Read every intact record in the log"""
+        records = []
+        for _, _, batch in self.scan():
+            records.extend(batch)
+        return records
+    
+    def last(self):
+        """Records of the last intact frame (only that frame is decoded)"""
+        last = None
+        for start, _, _ in self.scan(decode=False):
+            last = start
+        if last is None:
+            return []
+        return next(self.scan(last))[2]
+
+
+class SegmentedStore:
+    """Autosave directory holding each data partition in its own segment.
+    
+    Medicines, customers and settings are snapshot files replaced atomically when they change.
+    Sales are an append-only log of checksummed frames, so saving new sales costs
+    only the new records; the log is compacted into one frame now and then. The
+    outbox log records numbered changes for replication to a central store.
+    """
+    
+    COMPACT_AFTER_FRAMES = 64
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.sales_log = FrameLog(os.path.join(directory, "sales.log"), b"PHCSLOG\0", 'sales_history',
+                                  AUTOSAVE_GENERATIONS)
+        self.outbox = FrameLog(os.path.join(directory, "outbox.log"), b"PHCOBOX\0", 'changes')
+        self.last_seq = None
+        self.sales_count = None  # sales known to be in the log, once loaded or written
+        self.read_only = False   # set for a store that failed to load and could not be moved aside
+    
+    def segment_path(self, name):
+        return os.path.join(self.directory, name + SNAPSHOT_EXTENSION)
+    
+    def exists(self):
+        return os.path.exists(self.segment_path('medicines'))
+    
+    def write_segment(self, name, value):
+        """Atomically replace one snapshot segment"""
+        os.makedirs(self.directory, exist_ok=True)
+        save_snapshot(self.segment_path(name), {name: value}, AUTOSAVE_GENERATIONS)
+    
+    def has_segment(self, name):
+        return any(os.path.exists(path) for path in generation_paths(self.segment_path(name), AUTOSAVE_GENERATIONS))
+    
+    def read_segment(self, name):
+        """Read a snapshot segment, falling back to older generations if it is damaged"""
+        error = None
+        for path in generation_paths(self.segment_path(name), AUTOSAVE_GENERATIONS):
+            if os.path.exists(path):
+                try:
+                    with SnapshotReader(path) as reader:
+                        return reader.read(name)
+                except SnapshotError as e:
+                    error = e
+        raise error or SnapshotError(f"No '{name}' segment in {self.directory}")
+    
+    def load(self):
+        """Load all partitions into the same shape as a full snapshot"""
+        settings = self.read_segment('settings')
+        sales = self.sales_log.read()
+        data = validate_snapshot({
+            'medicines': self.read_segment('medicines'),
+            'customers': self.read_segment('customers') if self.has_segment('customers') else [],
+            'sales_history': sales,
+            'receipt_settings': settings.get('receipt_settings', {}),
+            'today_sales': settings.get('today_sales', "Pkr 0.00")
+        })
+        self.sales_count = len(sales)
+        return data
+    
+    def set_aside(self):
+        """Move the store's files into a dated subfolder, kept for recovery, and return its path"""
+        aside = os.path.join(self.directory, f"unreadable-{datetime.datetime.now():%Y%m%d-%H%M%S}")
+        os.makedirs(aside)
+        for entry in os.listdir(self.directory):
+            path = os.path.join(self.directory, entry)
+            if os.path.isfile(path):
+                os.replace(path, os.path.join(aside, entry))
+        return aside
+    
+    def record_changes(self, entries):
+        """Number outbox entries after the last recorded sequence and append them"""
+        if self.last_seq is None:
+            last = self.outbox.last()
+            self.last_seq = last[-1]['seq'] if last else 0
+        for seq, entry in enumerate(entries, self.last_seq + 1):
+            entry['seq'] = seq
+        self.outbox.append(entries)
+        self.last_seq += len(entries)
+    
+    def save(self, changes):
+        """Write only the partitions present in changes (see ModernMedicalStore.autosave_changes)"""
+        if self.read_only:
+            raise SnapshotError(f"{self.directory} could not be loaded, so it is not written over")
+        
+        # Sales first: a crash before the stock segment lands leaves stock high, never sales missing
+        if 'sales_rewrite' in changes:
+            self.sales_log.rewrite(changes['sales_rewrite'])
+            self.sales_count = len(changes['sales_rewrite'])
+        elif changes.get('sales_append'):
+            # A round retried after a later segment failed carries sales already appended; skip those
+            records = changes['sales_append']
+            if self.sales_count is not None:
+                records = records[max(0, self.sales_count - changes['sales_start']):]
+            if records:
+                self.sales_log.append(records)
+                self.sales_count = changes['sales_start'] + len(changes['sales_append'])
+        if 'medicines' in changes:
+            self.write_segment('medicines', changes['medicines'])
+        if 'customers' in changes:
+            self.write_segment('customers', changes['customers'])
+        if 'settings' in changes:
+            self.write_segment('settings', changes['settings'])
+        if changes.get('outbox'):
+            self.record_changes(changes['outbox'])
+
+
+class ProfileManager:
+    """Named store profiles under a data directory, each with its own autosave store"""
+    
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.profiles_dir = os.path.join(data_dir, "profiles")
+        self.config_path = os.path.join(data_dir, "pharmacare.json")
+    
+    def path(self, name):
+        return os.path.join(self.profiles_dir, name)
+    
+    def names(self):
+        """Existing profile names, sorted"""
+        if not os.path.isdir(self.profiles_dir):
+            return []
+        return sorted(entry for entry in os.listdir(self.profiles_dir) 
+                      if os.path.isdir(self.path(entry)))
+    
+    @staticmethod
+    def valid_name(name):
+        """A profile name must be usable as a single folder name"""
+        return bool(name) and name.strip() == name and name not in ('.', '..') and not any(
+            ch in name for ch in '/\\:*?"<>|')
+    
+    def create(self, name):
+        if not self.valid_name(name):
+            raise ValueError(f"'{name}' is not a valid store name")
+        os.makedirs(self.path(name), exist_ok=True)
+    
+    def read_config(self):
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            return config if isinstance(config, dict) else {}
+        except (OSError, ValueError):
+            return {}
+    
+    def active(self):
+        """The profile that was open last, or the default one"""
+        name = self.read_config().get('active_profile')
+        return name if isinstance(name, str) and self.valid_name(name) else DEFAULT_PROFILE
+    
+    def set_active(self, name):
+        config = self.read_config()
+        config['active_profile'] = name
+        os.makedirs(self.data_dir, exist_ok=True)
+        write_file_atomic(self.config_path, json.dumps(config, indent=2).encode('utf-8'))
+
+
+def validate_snapshot(data):
+    """Check loaded data has the shapes the application relies on, rounding its money to paisa"""
+    def require(condition, message):
+        if not condition:
+            raise SnapshotError(f"Invalid snapshot: {message}")
+    
+    number = (int, float)
+    medicines = data.get('medicines', {})
+    require(isinstance(medicines, dict), "medicines must be a mapping")
+    for name, med in medicines.items():
+        require(isinstance(name, str) and isinstance(med, dict), f"bad medicine entry {name!r}")
+        require(isinstance(med.get('price'), number) and isinstance(med.get('quantity'), int),
+                f"medicine {name!r} needs a numeric price and integer quantity")
+        require(isinstance(med.get('expiry'), str) and isinstance(med.get('batch'), str),
+                f"medicine {name!r} needs expiry and batch text")
+    
+    customers = data.get('customers', [])
+    require(isinstance(customers, list), "customers must be a list")
+    for customer in customers:
+        require(isinstance(customer, dict) and isinstance(customer.get('id'), int)
+                and isinstance(customer.get('name'), str) and isinstance(customer.get('phone'), str),
+                "every customer needs an id, name and phone")
+    
+    sales = data.get('sales_history', [])
+    require(isinstance(sales, list), "sales_history must be a list")
+    for sale in sales:
+        require(isinstance(sale, dict) and isinstance(sale.get('date'), str), "every sale needs a date")
+        require(isinstance(sale.get('total'), number) and isinstance(sale.get('gross_total'), number),
+                f"sale on {sale.get('date')} needs numeric totals")
+        require(isinstance(sale.get('items'), list), f"sale on {sale['date']} needs an item list")
+        for item in sale['items']:
+            require(isinstance(item, dict) and isinstance(item.get('name'), str)
+                    and isinstance(item.get('qty'), int) and isinstance(item.get('price'), number),
+                    f"bad item in sale on {sale['date']}")
+    
+    require(isinstance(data.get('receipt_settings', {}), dict), "receipt_settings must be a mapping")
+    return migrate_money(data)
+
+
+def load_snapshot(path):
+    """Load and schema-check every section of a snapshot file"""
+    with SnapshotReader(path) as reader:
+        return validate_snapshot(reader.read_all())
+
+
+class _PlainDataUnpickler(pickle.Unpickler):
+    """Unpickler for legacy .pkl saves that refuses to import or call anything"""
+    
+    def find_class(self, module, name):
+        raise SnapshotError(f"Legacy data file references {module}.{name}; refusing to load it")
+
+
+def load_legacy_pickle(path):
+    """Read an old pickle save containing only plain containers and schema-check it"""
+    with open(path, 'rb') as f:
+        try:
+            data = _PlainDataUnpickler(f).load()
+        except (pickle.UnpicklingError, EOFError) as e:
+            raise SnapshotError(f"Could not read legacy data file: {e}")
+    if not isinstance(data, dict):
+        raise SnapshotError("Legacy data file does not contain store data")
+    return validate_snapshot(data)
+
+
+def load_store_file(path):
+    """Load a snapshot, falling back to the safe legacy pickle reader for old saves"""
+    with open(path, 'rb') as f:
+        magic = f.read(len(SNAPSHOT_MAGIC))
+    if magic == SNAPSHOT_MAGIC:
+        return load_snapshot(path)
+    return load_legacy_pickle(path)
+
+
+def benchmark_snapshot(sale_count=100000, repeat=3):
+    """Compare snapshot and pickle file size and load time on a synthetic store"""
+    import random
+    import time
+    
+    rng = random.Random(0)
+    names = [f"Medicine {i}" for i in range(500)]
+    medicines = {name: {'price': round(rng.uniform(10, 900), 2), 'quantity': rng.randint(0, 300),
+                        'expiry': "13-03-2028", 'company': f"Company {i % 40}", 'batch': f"B{i:05d}"}
+                 for i, name in enumerate(names)}
+    sales = []
+    for sale_id in range(1, sale_count + 1):
+        items = [{'name': rng.choice(names), 'qty': rng.randint(1, 5), 'price': 150.25, 'batch': "B00001"}
+                 for _ in range(rng.randint(1, 4))]
+        gross = sum(item['price'] * item['qty'] for item in items)
+        sales.append({'id': sale_id, 'date': "12-03-2025", 'timestamp': f"12-03-2025 10:{sale_id % 60:02d}:00",
+                      'customer': "Walk-in Customer", 'cashier': "System Admin", 'items': items,
+                      'gross_total': gross, 'discount_percent': 0.0, 'discount': 0.0, 'total': gross})
+    data = {'medicines': medicines, 'sales_history': sales, 'receipt_settings': {'receipt_width': 50}}
+    
+    folder = tempfile.mkdtemp(prefix="pharmacare_bench_")
+    snapshot_path = os.path.join(folder, "bench" + SNAPSHOT_EXTENSION)
+    pickle_path = os.path.join(folder, "bench.pkl")
+    
+    def best(func):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+    
+    def pickle_save():
+        with open(pickle_path, 'wb') as f:
+            pickle.dump(data, f)
+    
+    def pickle_load():
+        with open(pickle_path, 'rb') as f:
+            pickle.load(f)
+    
+    def report_only():
+        with SnapshotReader(snapshot_path) as reader:
+            reader.read('medicines')
+    
+    results = [
+        ("pickle save", best(pickle_save)),
+        ("snapshot save", best(lambda: save_snapshot(snapshot_path, data))),
+        ("pickle load", best(pickle_load)),
+        ("snapshot load", best(lambda: load_snapshot(snapshot_path))),
+        ("snapshot mmap medicines only", best(report_only)),
+    ]
+    
+    print(f"Synthetic store: {len(medicines)} medicines, {sale_count} sales")
+    print(f"{'pickle size':<30} {os.path.getsize(pickle_path) / 1e6:8.2f} MB")
+    print(f"{'snapshot size':<30} {os.path.getsize(snapshot_path) / 1e6:8.2f} MB")
+    for label, seconds in results:
+        print(f"{label:<30} {seconds * 1000:8.1f} ms")
+    
+    for path in (snapshot_path, pickle_path):
+        os.unlink(path)
+    os.rmdir(folder)
+    return results
+
+
+def benchmark_analytics(line_count=2000000, repeat=3):
+    """Time analytics queries over a synthetic ledger cached as memory-mapped columns"""
+    import random
+    import time
+    
+    rng = random.Random(0)
+    names = [f"Medicine {i}" for i in range(2000)]
+    medicines = {name: {'company': f"Company {i % 60}"} for i, name in enumerate(names)}
+    sales = []
+    lines = 0
+    sale_id = 0
+    while lines < line_count:
+        sale_id += 1
+        items = [{'name': rng.choice(names), 'qty': rng.randint(1, 5), 'price': 150.25}
+                 for _ in range(rng.randint(1, 4))]
+        gross = sum(item['price'] * item['qty'] for item in items)
+        percent = rng.choice((0, 0, 0, 5, 10, 15, 25))
+        day = 1 + sale_id % 28
+        sales.append({'id': sale_id, 'date': f"{day:02d}-03-2025", 
+                      'timestamp': f"{day:02d}-03-2025 {8 + sale_id % 14:02d}:00:00", 'items': items,
+                      'discount_percent': percent, 'total': gross * (1 - percent / 100)})
+        lines += len(items)
+    
+    folder = tempfile.mkdtemp(prefix="pharmacare_bench_")
+    analytics = SalesAnalytics(folder)
+    start = time.perf_counter()
+    analytics.sync(sales, medicines)
+    ingest = time.perf_counter() - start
+    analytics = SalesAnalytics(folder)  # reopen, as a new session would
+    
+    def best(func):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+    
+    results = [
+        ("top sellers", best(analytics.top_sellers)),
+        ("revenue by company", best(analytics.revenue_by_company)),
+        ("discount impact", best(analytics.discount_impact)),
+        ("hour-of-day heatmap", best(analytics.hourly_heatmap)),
+        ("ABC classification", best(analytics.abc_classes)),
+        ("full report", best(lambda: build_analytics_report(medicines, sales, analytics=analytics))),
+    ]
+    
+    print(f"Synthetic ledger: {len(sales)} sales, {analytics.rows} sale lines")
+    print(f"{'initial column build':<30} {ingest * 1000:8.1f} ms")
+    for label, seconds in results:
+        print(f"{label:<30} {seconds * 1000:8.1f} ms")
+    
+    analytics.columns = {}
+    for name, _ in ANALYTICS_COLUMNS:
+        os.unlink(analytics.column_path(name))
+    os.unlink(analytics.meta_path)
+    os.rmdir(folder)
+    return results
+
+
+# Seconds from launch until a restarted counter can take a sale
+STARTUP_BUDGET = 1.0
+
+
+def benchmark_startup(medicine_count=20000, sale_count=50000):
+    """Time a cold start on a synthetic store: import, window with the profile loaded, first sales tab.
+    
+    The window timings need a display; without one only the import is timed.
+    """
+    import random
+    import shutil
+    import subprocess
+    
+    # Import in a fresh interpreter, as a restarted counter would
+    module = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)), 
+                            capture_output=True, text=True, check=True)
+    results = [("import", float(result.stdout.split()[-1]))]
+    
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"No display ({e}); only the import was timed")
+        root = None
+    
+    folder = tempfile.mkdtemp(prefix="pharmacare_bench_")
+    try:
+        if root is not None:
+            # Seed a profile through the app itself so it has the real settings
+            rng = random.Random(0)
+            names = [f"Medicine {i}" for i in range(medicine_count)]
+            medicines = {name: {'price': round(rng.uniform(10, 900), 2), 'quantity': rng.randint(0, 300),
+                                'expiry': "13-03-2028", 'company': f"Company {i % 200}", 'batch': f"B{i:05d}"}
+                         for i, name in enumerate(names)}
+            sales = []
+            for sale_id in range(1, sale_count + 1):
+                items = [{'name': rng.choice(names), 'qty': rng.randint(1, 5), 'price': 150.25, 'batch': "B00001"}
+                         for _ in range(rng.randint(1, 4))]
+                gross = sum(item['price'] * item['qty'] for item in items)
+                sales.append({'id': sale_id, 'date': "12-03-2025", 'timestamp': "12-03-2025 10:00:00",
+                              'customer': "Walk-in Customer", 'cashier': "System Admin", 'items': items,
+                              'gross_total': gross, 'discount_percent': 0.0, 'discount': 0.0, 'total': gross})
+            app = ModernMedicalStore(root, data_dir=folder, profile="bench")
+            app.apply_data({'medicines': medicines, 'sales_history': sales, 
+                            'receipt_settings': dict(app.receipt_settings)})
+            app.flush_autosave()
+            root.destroy()
+            
+            start = time.perf_counter()
+            root = tk.Tk()
+            app = ModernMedicalStore(root, data_dir=folder, profile="bench")
+            root.update()
+            results.append(("window with store loaded", time.perf_counter() - start))
+            
+            start = time.perf_counter()
+            app.show_sales()
+            root.update()
+            results.append(("first visit to sales tab", time.perf_counter() - start))
+            
+            start = time.perf_counter()
+            for name in app.tab_builders:
+                app.tab(name)
+            root.update()
+            results.append(("building the other tabs", time.perf_counter() - start))
+            root.destroy()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    
+    if root is not None:
+        print(f"Synthetic store: {medicine_count} medicines, {sale_count} sales")
+    for label, seconds in results:
+        print(f"{label:<30} {seconds * 1000:8.1f} ms")
+    if root is not None:
+        # Building the other tabs is what lazy construction keeps off the startup path
+        ready = sum(seconds for label, seconds in results[:3])
+        print(f"{'ready to sell':<30} {ready * 1000:8.1f} ms "
+              f"({'within' if ready <= STARTUP_BUDGET else 'over'} the {STARTUP_BUDGET * 1000:.0f} ms budget)")
+    return results
+
+
+def load_branch(path):
+    """Load a branch from a snapshot or pickle file, or from a profile's autosave store folder"""
+    if os.path.isdir(path):
+        return SegmentedStore(path).load()
+    return load_store_file(path)
+
+
+def find_branch_sources(paths):
+    """Expand folders into the branch stores and data files directly inside them"""
+    sources = []
+    for path in paths:
+        if os.path.isdir(path) and not SegmentedStore(path).exists():
+            for entry in sorted(os.listdir(path)):
+                full = os.path.join(path, entry)
+                if os.path.isdir(full):
+                    if SegmentedStore(full).exists():
+                        sources.append(full)
+                elif entry.endswith((SNAPSHOT_EXTENSION, '.pkl')):
+                    sources.append(full)
+        else:
+            sources.append(path)
+    return sources
+
+
+def summarize_branch(job):
+    """Reduce one branch to stock lines, sales totals, units sold and (optionally) its tagged ledger.
+    
+    Runs in a worker process, so only the reduced figures travel back to the parent.
+    """
+    path, branch, include_sales = job
+    data = load_branch(path)
+    stock = [{
+        'name': name,
+        'batch': med.get('batch', ''),
+        'company': med.get('company', ''),
+        'price': med['price'],
+        'expiry': med.get('expiry', ''),
+        'quantity': med['quantity']
+    } for name, med in data['medicines'].items()]
+    
+    sales = SalesStore(data['sales_history'])
+    sold = {}
+    for sale in sales:
+        for item in sale['items']:  # refund lines carry negative quantities
+            sold[item['name']] = sold.get(item['name'], 0) + item['qty']
+    return {
+        'branch': branch,
+        'path': path,
+        'stock': stock,
+        'totals': sales.totals,  # in paisa, so the chain sums stay exact
+        'sold': sold,
+        'sales_history': [dict(sale, branch=branch) for sale in sales] if include_sales else []
+    }
+
+
+def consolidate_branches(paths, include_sales=False, max_workers=None):
+    """Load many branch stores in a process pool and merge them into chain-wide figures.
+    
+    Inventory is merged by (medicine, batch); with include_sales the ledgers are merged
+    by date with every sale tagged with its branch. Branches that fail to load are
+    listed under 'failed' instead of stopping the job.
+    """
+    sources = find_branch_sources(paths)
+    jobs = []
+    seen = {}
+    for path in sources:
+        name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+        seen[name] = seen.get(name, 0) + 1
+        jobs.append((path, name if seen[name] == 1 else f"{name}#{seen[name]}", include_sales))
+    
+    results = [None] * len(jobs)
+    failed = []
+    if len(jobs) < 2:
+        for index, job in enumerate(jobs):
+            try:
+                results[index] = summarize_branch(job)
+            except Exception as e:
+                failed.append((job[0], str(e)))
+    else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(summarize_branch, job): index for index, job in enumerate(jobs)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    failed.append((jobs[index][0], str(e)))
+    branches = [result for result in results if result is not None]
+    
+    inventory = {}
+    totals = SalesStore.empty_totals()
+    sold = {}
+    summaries = []
+    for result in branches:
+        branch = result['branch']
+        stock_value = 0
+        for line in result['stock']:
+            key = (line['name'], line['batch'])
+            merged = inventory.get(key)
+            if merged is None:
+                merged = inventory[key] = dict(line, quantity=0, value=0, stock={})
+            value = line['quantity'] * to_paisa(line['price'])
+            merged['quantity'] += line['quantity']
+            merged['value'] += value
+            merged['stock'][branch] = merged['stock'].get(branch, 0) + line['quantity']
+            stock_value += value
+        for key, value in result['totals'].items():
+            totals[key] += value
+        for name, qty in result['sold'].items():
+            sold[name] = sold.get(name, 0) + qty
+        summaries.append({
+            'branch': branch,
+            'path': result['path'],
+            'medicines': len(result['stock']),
+            'stock_units': sum(line['quantity'] for line in result['stock']),
+            'stock_value': to_rupees(stock_value),
+            'totals': SalesStore.in_rupees(result['totals'])
+        })
+    for merged in inventory.values():
+        merged['value'] = to_rupees(merged['value'])
+    
+    return {
+        'branches': summaries,
+        'inventory': [inventory[key] for key in sorted(inventory)],
+        'totals': SalesStore.in_rupees(totals),
+        'sold': sold,
+        'sales_history': list(heapq.merge(*(result['sales_history'] for result in branches),
+                                          key=lambda sale: day_ordinal(sale['date']))),
+        'failed': sorted(failed)
+    }
+
+
+def build_chain_report(chain, top=20):
+    """Build the chain-wide summary report, returning (text, branch count)"""
+    report = []
+    report.append("CHAIN CONSOLIDATION REPORT".center(80))
+    report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
+    report.append(f"Branches: {len(chain['branches'])}")
+    report.append("="*80)
+    
+    report.append("BRANCH SALES AND STOCK")
+    report.append("{:<18} {:<8} {:<8} {:<10} {:<12} {:<12} {:<12}".format(
+        "Branch", "Sales", "Refunds", "Items Sold", "Net Total", "Stock Units", "Stock Value"))
+    report.append("-"*80)
+    for summary in chain['branches']:
+        totals = summary['totals']
+        report.append("{:<18} {:<8} {:<8} {:<10} {:<12.2f} {:<12} {:<12.2f}".format(
+            summary['branch'][:18], totals['transactions'], totals['refunds'], totals['items_sold'],
+            totals['net_total'], summary['stock_units'], summary['stock_value']))
+    totals = chain['totals']
+    report.append("-"*80)
+    report.append("{:<18} {:<8} {:<8} {:<10} {:<12.2f} {:<12} {:<12.2f}".format(
+        "CHAIN TOTAL", totals['transactions'], totals['refunds'], totals['items_sold'], totals['net_total'],
+        sum(summary['stock_units'] for summary in chain['branches']),
+        sum(summary['stock_value'] for summary in chain['branches'])))
+    report.append(f"Gross Total: Pkr {totals['gross_total']:.2f}   Discounts: Pkr {totals['discount']:.2f}   "
+                  f"Tax: Pkr {totals['tax']:.2f}")
+    
+    report.append("")
+    report.append("CHAIN INVENTORY BY MEDICINE AND BATCH")
+    report.append("{:<25} {:<10} {:<15} {:<9} {:<8} {:<12}".format(
+        "Medicine", "Batch", "Company", "Branches", "Qty", "Value"))
+    report.append("-"*80)
+    for line in chain['inventory']:
+        report.append("{:<25} {:<10} {:<15} {:<9} {:<8} {:<12.2f}".format(
+            line['name'][:25], line['batch'][:10], line['company'][:15], len(line['stock']),
+            line['quantity'], line['value']))
+    
+    report.append("")
+    report.append(f"TOP {top} MEDICINES BY UNITS SOLD")
+    report.append("-"*80)
+    best = heapq.nlargest(top, chain['sold'].items(), key=lambda entry: (entry[1], entry[0]))
+    for name, qty in best:
+        report.append(f"{name:<40} {qty}")
+    
+    if chain['failed']:
+        report.append("")
+        report.append("SKIPPED BRANCH FILES")
+        report.append("-"*80)
+        for path, error in chain['failed']:
+            report.append(f"{path}: {error}")
+    return "\n".join(report), len(chain['branches'])
+
+
+def export_changes(store_dir, out_dir, branch, batch_size=5000):
+    """Write outbox entries not exported yet as numbered batch files, returning their paths.
+    
+    The position reached is kept in the store folder, so each run carries on where the
+    last one stopped; a batch sent twice after a crash is ignored by the central store.
+    """
+    outbox = SegmentedStore(store_dir).outbox
+    cursor_path = os.path.join(store_dir, "exported.json")
+    try:
+        with open(cursor_path, 'r', encoding='utf-8') as f:
+            cursor = json.load(f)
+    except (OSError, ValueError):
+        cursor = {'seq': 0, 'offset': 0}
+    
+    written = []
+    
+    def write_batch(batch, resume_offset):
+        path = os.path.join(out_dir, f"{branch}-{batch[0]['seq']:012d}-{batch[-1]['seq']:012d}{SNAPSHOT_EXTENSION}")
+        save_snapshot(path, {'branch': branch, 'changes': batch})
+        written.append(path)
+        position = {'seq': batch[-1]['seq'], 'offset': resume_offset}
+        write_file_atomic(cursor_path, json.dumps(position).encode('utf-8'))
+        return position
+    
+    os.makedirs(out_dir, exist_ok=True)
+    batch = []
+    end = cursor['offset']
+    for start, end, entries in outbox.scan(cursor['offset']):
+        for entry in entries:
+            if entry['seq'] <= cursor['seq']:
+                continue
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                # Resume from this frame next time; entries already sent are skipped by sequence
+                cursor = write_batch(batch, start)
+                batch = []
+    if batch:
+        write_batch(batch, end)
+    return written
+
+
+class CentralStore:
+    """Head-office store that merges replicated branch changes; re-applying a batch has no effect.
+    
+    Per branch it keeps the medicines as last reported and the sequence number applied
+    so far. Sales go to an append-only ledger tagged with branch and sequence, and
+    the state snapshot notes how much of the ledger it covers, so loading only reads
+    ledger frames appended after the last state save. A 'reset' entry (a branch that
+    loaded a different data file) clears the branch's medicines and supersedes its
+    earlier sales in the ledger; the branch then resends everything.
+    """
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.state_path = os.path.join(directory, "central" + SNAPSHOT_EXTENSION)
+        self.sales_log = FrameLog(os.path.join(directory, "sales.log"), b"PHCSLOG\0", 'sales_history')
+        self.inventory = {}  # branch -> {medicine name -> record}
+        self.cursors = {}    # branch -> last applied sequence number
+        self.sale_seqs = {}  # branch -> sequence number of its newest sale in the ledger
+        self.resets = {}     # branch -> sequence number of its last reset; older sales are superseded
+        self.new_sales = []
+        
+        log_size = 0
+        if os.path.exists(self.state_path):
+            with SnapshotReader(self.state_path) as reader:
+                for line in reader.read('inventory'):
+                    branch = line.pop('branch')
+                    self.inventory.setdefault(branch, {})[line.pop('name')] = line
+                self.cursors = reader.read('cursors')
+                self.sale_seqs = reader.read('sale_seqs')
+                if 'resets' in reader.sections:
+                    self.resets = reader.read('resets')
+                log_size = reader.read('log_size')
+        
+        # Sales appended after the last state save (the run stopped before saving state)
+        for _, _, sales in self.sales_log.scan(log_size):
+            for sale in sales:
+                self.sale_seqs[sale['branch']] = max(self.sale_seqs.get(sale['branch'], 0), sale['seq'])
+    
+    def apply(self, branch, entries):
+        """Apply one batch of a branch's outbox entries in sequence order, returning how many were new"""
+        cursor = self.cursors.get(branch, 0)
+        sale_seq = self.sale_seqs.get(branch, 0)
+        stock = self.inventory.setdefault(branch, {})
+        applied = 0
+        for entry in entries:
+            seq = entry['seq']
+            if seq <= cursor:
+                continue
+            if entry['op'] == 'sale':
+                if seq > sale_seq:
+                    self.new_sales.append(dict(entry['sale'], branch=branch, seq=seq))
+                    sale_seq = seq
+            elif entry['op'] == 'upsert':
+                stock[entry['name']] = entry['medicine']
+            elif entry['op'] == 'reset':
+                stock.clear()
+                self.new_sales = [sale for sale in self.new_sales if sale['branch'] != branch]
+                self.resets[branch] = seq
+            else:
+                stock.pop(entry['name'], None)
+            applied += 1
+        if entries:
+            self.cursors[branch] = max(cursor, entries[-1]['seq'])
+        self.sale_seqs[branch] = sale_seq
+        return applied
+    
+    def save(self):
+        """Append new sales to the ledger, then atomically replace the state snapshot"""
+        if self.new_sales:
+            self.sales_log.append(self.new_sales)
+            self.new_sales = []
+        os.makedirs(self.directory, exist_ok=True)
+        save_snapshot(self.state_path, {
+            'inventory': [dict(record, branch=branch, name=name) 
+                          for branch, stock in self.inventory.items() for name, record in stock.items()],
+            'cursors': self.cursors,
+            'sale_seqs': self.sale_seqs,
+            'resets': self.resets,
+            'log_size': self.sales_log.size
+        })
+    
+    def sales(self):
+        """Every sale in the ledger that no later reset of its branch has superseded"""
+        return [sale for sale in self.sales_log.read() 
+                if sale['seq'] > self.resets.get(sale['branch'], 0)]
+
+
+def apply_change_files(central_dir, paths):
+    """Apply branch batch files (or folders of them) to a central store, saving once at the end.
+    
+    Batches are applied per branch in sequence order. A batch that would skip over
+    missing sequence numbers is left pending, with that branch's later batches, until
+    the gap is filled by a later run.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, entry) for entry in sorted(os.listdir(path)) 
+                         if entry.endswith(SNAPSHOT_EXTENSION))
+        else:
+            files.append(path)
+    
+    result = {'applied': 0, 'batches': 0, 'pending': [], 'failed': []}
+    batches = []
+    for path in files:
+        try:
+            with SnapshotReader(path) as reader:
+                branch = reader.read('branch')
+                changes = reader.read('changes')
+            if changes:
+                batches.append((branch, changes[0]['seq'], path, changes))
+        except (SnapshotError, KeyError, OSError) as e:
+            result['failed'].append((path, str(e)))
+    
+    central = CentralStore(central_dir)
+    stalled = set()
+    for branch, first_seq, path, changes in sorted(batches, key=lambda batch: batch[:2]):
+        if branch in stalled or first_seq > central.cursors.get(branch, 0) + 1:
+            stalled.add(branch)
+            result['pending'].append(path)
+            continue
+        result['applied'] += central.apply(branch, changes)
+        result['batches'] += 1
+    central.save()
+    return result
+
 
 class ModernMedicalStore:
-    def __init__(self, root):
+    def __init__(self, root, data_dir=None, profile=None):
+        started = time.perf_counter()
         self.root = root
         self.root.title("PharmaCare - Medical Store Management")
         self.root.geometry("1200x800")
@@ -32,8 +3026,44 @@ class ModernMedicalStore:
         
         # Initialize medicine database
         self.medicines = {}
-        self.current_transaction = {}
-        self.sales_history = []
+        self.cart = Cart()
+        self.sales_store = SalesStore()
+        self.customers = CustomerRegistry()
+        self.autosave_thread = None
+        
+        # Store profiles: the active one is kept in the attributes below, recently
+        # used ones are parked in profile_cache with their indexes already built
+        self.profiles = ProfileManager(data_dir or DEFAULT_DATA_DIR)
+        self.profile = profile or self.profiles.active()
+        self.profile_cache = collections.OrderedDict()
+        self.profile_var = tk.StringVar(value=self.profile)
+        
+        # Autosave dirty tracking: each partition's version is bumped on change and
+        # compared with the version last written, so unchanged partitions are skipped
+        self.autosave_store = SegmentedStore(self.profiles.path(self.profile))
+        self.versions = {'medicines': 0, 'customers': 0, 'settings': 0, 'sales': 0}
+        self.saved_versions = {'medicines': -1, 'customers': -1, 'settings': -1, 'sales': -1,
+                               'today_sales': None, 'sales_count': 0, 'outbox_sales': 0}
+        
+        # Medicines changed since the last autosave (name -> medicines version), for the outbox
+        self.changed_medicines = {}
+        
+        # Sales analytics columns per profile folder, opened on first use
+        self.analytics_cache = {}
+        
+        # Attached scanner device, if any (see start_scanner)
+        self.scanner = None
+        
+        # Receipts print on a background queue; checkout wall times feed the status bar
+        self.receipt_printer = ReceiptPrinter()
+        self.printer_watched = False
+        self.checkout_started = None
+        self.checkout_times = collections.deque(maxlen=200)
+        
+        # Change events (topic -> changed keys), delivered to subscribed views once per idle cycle
+        self.subscribers = {}
+        self.pending_changes = {}
+        self.changes_scheduled = False
         
         # Receipt settings
         self.receipt_settings = {
@@ -47,10 +3077,14 @@ class ModernMedicalStore:
             "show_discount": True,
             "default_discount": 0
         }
+        self.receipt_settings.update(app_settings())
         
         # Load sample data
         self.load_sample_data()
         
+        # Low/empty/expiring stock indexes, kept current by mark_dirty
+        self.stock_index = StockIndex(self.medicines, self.receipt_settings)
+        
         # Configure styles
         self.configure_styles()
         
@@ -66,14 +3100,19 @@ class ModernMedicalStore:
         # Create status bar
         self.create_status_bar()
         
+        
         # Show dashboard by default
         self.show_dashboard()
         
+        # Try to auto-load data (before the first auto-save, which would replace it)
+        self.try_auto_load()
+        
         # Start auto-save
         self.auto_save_data()
         
-        # Try to auto-load data
-        self.try_auto_load()
+        self.startup_seconds = time.perf_counter() - started
+        if self.startup_seconds > STARTUP_BUDGET:
+            print(f"Startup took {self.startup_seconds:.2f} s (budget {STARTUP_BUDGET:.1f} s)")
     
     def configure_styles(self):
         """Configure custom styles for widgets"""
@@ -169,6 +3208,18 @@ class ModernMedicalStore:
         # Add some spacing
         ttk.Frame(self.sidebar, height=20, style='Sidebar.TFrame').pack(fill=tk.X)
         
+        # Store profile switcher
+        ttk.Label(self.sidebar, text="Store:", style='Sidebar.TLabel', 
+                 foreground=self.text_color).pack(anchor='w', padx=10)
+        self.profile_combo = ttk.Combobox(self.sidebar, textvariable=self.profile_var, state='readonly',
+                                          postcommand=lambda: self.profile_combo.configure(
+                                              values=self.profile_names()))
+        self.profile_combo.pack(fill=tk.X, padx=10, pady=5)
+        self.profile_combo.bind("<<ComboboxSelected>>", 
+                                lambda e: self.switch_profile(self.profile_var.get()))
+        ttk.Button(self.sidebar, text="New Store", style='Sidebar.TButton', 
+                  command=self.new_profile).pack(fill=tk.X, padx=10, pady=5)
+        
         # Footer with version info
         footer_frame = ttk.Frame(self.sidebar, style='Sidebar.TFrame')
         footer_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=20)
@@ -181,12 +3232,25 @@ class ModernMedicalStore:
         self.content = ttk.Frame(self.main_container)
         self.content.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        # Create all content frames but don't show them yet
-        self.create_dashboard()
-        self.create_inventory_tab()
-        self.create_sales_tab()
-        self.create_reports_tab()
-        self.create_settings_tab()
+        # Tabs are built and populated on their first visit (see tab); only the
+        # dashboard, which is shown first and holds today's sales, is built now
+        self.tabs = {}
+        self.tab_builders = {
+            'dashboard': (self.create_dashboard, 'dashboard_frame'),
+            'inventory': (self.create_inventory_tab, 'inventory_frame'),
+            'sales': (self.create_sales_tab, 'sales_frame'),
+            'reports': (self.create_reports_tab, 'reports_frame'),
+            'settings': (self.create_settings_tab, 'settings_frame')
+        }
+        self.tab('dashboard')
+    
+    def tab(self, name):
+        """A tab's frame, building it on first use"""
+        if name not in self.tabs:
+            create, frame = self.tab_builders[name]
+            create()
+            self.tabs[name] = getattr(self, frame)
+        return self.tabs[name]
     
     def create_status_bar(self):
         """Create the status bar at the bottom"""
@@ -218,23 +3282,31 @@ class ModernMedicalStore:
         self.today_sales_var = tk.StringVar()
         self.today_sales_var.set("Pkr 0.00")  # Initialize today's sales to zero
     
+    @property
+    def sales_history(self):
+        """All sales in the order they were made"""
+        return self.sales_store.sales
+    
+    @sales_history.setter
+    def sales_history(self, sales):
+        # Re-index whenever a whole history is loaded; older files get ids assigned here
+        self.sales_store = SalesStore(sales)
+    
     def show_dashboard(self):
         """Show the dashboard tab"""
         self.hide_all_tabs()
-        self.dashboard_frame.pack(fill=tk.BOTH, expand=True)
+        self.tab('dashboard').pack(fill=tk.BOTH, expand=True)
         self.update_dashboard()
     
     def show_inventory(self):
-        """Show the inventory tab"""
+        """Show the inventory tab (change events keep it current once built)"""
         self.hide_all_tabs()
-        self.inventory_frame.pack(fill=tk.BOTH, expand=True)
-        self.refresh_inventory()
+        self.tab('inventory').pack(fill=tk.BOTH, expand=True)
     
     def show_sales(self):
-        """Show the sales tab"""
+        """Show the sales tab (change events keep it current once built)"""
         self.hide_all_tabs()
-        self.sales_frame.pack(fill=tk.BOTH, expand=True)
-        self.refresh_sales_list()
+        self.tab('sales').pack(fill=tk.BOTH, expand=True)
     
     def show_sales_history_window(self):
         """Show the sales history in a separate window"""
@@ -243,6 +3315,19 @@ class ModernMedicalStore:
         history_window.geometry("1000x600")
         self.center_window(history_window)
         
+        # Paging, sorting and filter state for this window
+        view = {
+            'page': 0,
+            'page_size': 100,
+            'sort': 'id',
+            'descending': True,
+            'from': tk.StringVar(),
+            'to': tk.StringVar(),
+            'customer': tk.StringVar(),
+            'medicine': tk.StringVar(),
+            'page_var': tk.StringVar(),
+        }
+        
         # Header
         header = ttk.Frame(history_window)
         header.pack(fill=tk.X, pady=(10, 5))
@@ -254,30 +3339,93 @@ class ModernMedicalStore:
         btn_frame.pack(side=tk.RIGHT)
         
         ttk.Button(btn_frame, text="Refresh", style='TButton', 
-                  command=lambda: self.refresh_sales_history_tree(sales_tree)).pack(side=tk.LEFT, padx=5)
+                  command=lambda: self.refresh_sales_history_tree(sales_tree, view)).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="Export", style='TButton', 
                   command=self.export_sales_history).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Receipts PDF", style='TButton', 
+                  command=self.export_receipts_pdf).pack(side=tk.LEFT, padx=5)
+        
+        # Filter frame (choices come from the sales store indexes)
+        filter_frame = ttk.Frame(history_window)
+        filter_frame.pack(fill=tk.X, pady=(0, 5))
+        
+        store = self.sales_store
+        filters = [
+            ("From:", 'from', 12, lambda: [store.day_names[day] for day in reversed(store.days)]),
+            ("To:", 'to', 12, lambda: [store.day_names[day] for day in reversed(store.days)]),
+            ("Customer:", 'customer', 18, lambda: sorted(store.customer_names.values())),
+            ("Medicine:", 'medicine', 22, lambda: sorted(store.by_medicine)),
+        ]
+        for label, key, width, choices in filters:
+            ttk.Label(filter_frame, text=label).pack(side=tk.LEFT, padx=(5, 0))
+            combo = ttk.Combobox(filter_frame, textvariable=view[key], width=width)
+            combo.configure(postcommand=lambda c=combo, f=choices: c.configure(values=f()))
+            combo.pack(side=tk.LEFT, padx=5)
+        
+        def apply_filters():
+            view['page'] = 0
+            self.refresh_sales_history_tree(sales_tree, view)
+        
+        def clear_filters():
+            for key in ('from', 'to', 'customer', 'medicine'):
+                view[key].set("")
+            apply_filters()
+        
+        ttk.Button(filter_frame, text="Apply", style='Primary.TButton', 
+                  command=apply_filters).pack(side=tk.LEFT, padx=5)
+        ttk.Button(filter_frame, text="Clear", style='TButton', 
+                  command=clear_filters).pack(side=tk.LEFT, padx=5)
+        
+        # Pager
+        pager = ttk.Frame(history_window)
+        pager.pack(side=tk.BOTTOM, fill=tk.X, pady=5)
+        
+        def turn_page(step):
+            view['page'] = max(0, view['page'] + step)
+            self.refresh_sales_history_tree(sales_tree, view)
+        
+        ttk.Button(pager, text="< Prev", style='TButton', 
+                  command=lambda: turn_page(-1)).pack(side=tk.LEFT, padx=5)
+        ttk.Label(pager, textvariable=view['page_var']).pack(side=tk.LEFT, padx=5)
+        ttk.Button(pager, text="Next >", style='TButton', 
+                  command=lambda: turn_page(1)).pack(side=tk.LEFT, padx=5)
         
         # Sales history treeview with more columns
         sales_tree = ttk.Treeview(history_window, 
-                                 columns=('Date', 'Customer', 'Items', 'Quantity', 'Amount', 'Discount', 'Total'), 
+                                 columns=('ID', 'Date', 'Customer', 'Items', 'Quantity', 'Amount', 'Discount', 'Tax', 
+                                          'Total'), 
                                  show='headings')
         
-        # Configure columns
-        sales_tree.heading('Date', text='Date')
-        sales_tree.heading('Customer', text='Customer')
-        sales_tree.heading('Items', text='Items Sold')
-        sales_tree.heading('Quantity', text='Total Qty')
-        sales_tree.heading('Amount', text='Amount (Pkr)')
-        sales_tree.heading('Discount', text='Discount (Pkr)')
-        sales_tree.heading('Total', text='Net Total (Pkr)')
+        # Configure columns (clicking a heading sorts by it, clicking again reverses)
+        headings = [
+            ('ID', 'Sale #', 'id'),
+            ('Date', 'Date', 'date'),
+            ('Customer', 'Customer', 'customer'),
+            ('Items', 'Items Sold', 'items'),
+            ('Quantity', 'Total Qty', 'qty'),
+            ('Amount', 'Amount (Pkr)', 'gross'),
+            ('Discount', 'Discount (Pkr)', 'discount'),
+            ('Tax', 'Tax (Pkr)', 'tax'),
+            ('Total', 'Net Total (Pkr)', 'total'),
+        ]
+        
+        def sort_by(key):
+            view['descending'] = not view['descending'] if view['sort'] == key else True
+            view['sort'] = key
+            view['page'] = 0
+            self.refresh_sales_history_tree(sales_tree, view)
+        
+        for column, text, key in headings:
+            sales_tree.heading(column, text=text, command=lambda k=key: sort_by(k))
         
+        sales_tree.column('ID', width=60, anchor='e')
         sales_tree.column('Date', width=100, anchor='center')
         sales_tree.column('Customer', width=120, anchor='w')
-        sales_tree.column('Items', width=250, anchor='w')
+        sales_tree.column('Items', width=200, anchor='w')
         sales_tree.column('Quantity', width=80, anchor='e')
         sales_tree.column('Amount', width=100, anchor='e')
         sales_tree.column('Discount', width=100, anchor='e')
+        sales_tree.column('Tax', width=80, anchor='e')
         sales_tree.column('Total', width=100, anchor='e')
         
         scrollbar = ttk.Scrollbar(history_window, 
@@ -292,70 +3440,83 @@ class ModernMedicalStore:
         sales_tree.bind('<Double-1>', lambda e: self.view_sale_details(sales_tree))
         
         # Populate initial data
-        self.refresh_sales_history_tree(sales_tree)
+        self.refresh_sales_history_tree(sales_tree, view)
     
-    def refresh_sales_history_tree(self, tree):
-        """Refresh the sales history treeview with all data"""
+    def refresh_sales_history_tree(self, tree, view):
+        """Show one page of the sales history for the window's current filters and sort order"""
         tree.delete(*tree.get_children())
         
-        total_sales = 0.0
-        sale_count = 0
-        total_qty = 0
-        total_discount = 0.0
+        page_size = view['page_size']
+        rows, count, totals = self.sales_store.query(
+            date_from=view['from'].get().strip() or None,
+            date_to=view['to'].get().strip() or None,
+            customer=view['customer'].get().strip() or None,
+            medicine=view['medicine'].get().strip() or None,
+            sort=view['sort'],
+            descending=view['descending'],
+            offset=view['page'] * page_size,
+            limit=page_size
+        )
         
-        for sale in sorted(self.sales_history, key=lambda x: x['date'], reverse=True):
-            items = ", ".join(f"{item['name']}" for item in sale['items'])
-            total_items_qty = sum(item['qty'] for item in sale['items'])
-            gross_total = sum(item['price'] * item['qty'] for item in sale['items'])
-            discount = gross_total - sale['total']
-            
-            tree.insert('', 'end', 
+        # Step back if the filters left fewer pages than the current one
+        pages = max(1, -(-count // page_size))
+        if view['page'] >= pages:
+            view['page'] = pages - 1
+            return self.refresh_sales_history_tree(tree, view)
+        
+        for row in rows:
+            items = row['items_text']
+            tree.insert('', 'end', iid=str(row['id']),
                       values=(
-                          sale['date'],
-                          sale.get('customer', 'Walk-in'),
+                          row['id'],
+                          row['date'],
+                          row['customer'],
                           items[:50] + "..." if len(items) > 50 else items,
-                          total_items_qty,
-                          f"{gross_total:.2f}",
-                          f"{discount:.2f}",
-                          f"{sale['total']:.2f}"
+                          row['qty'],
+                          f"{to_rupees(row['gross_paisa']):.2f}",
+                          f"{to_rupees(row['discount_paisa']):.2f}",
+                          f"{to_rupees(row['tax_paisa']):.2f}",
+                          f"{to_rupees(row['total_paisa']):.2f}"
                       ))
-            
-            total_sales += sale['total']
-            sale_count += 1
-            total_qty += total_items_qty
-            total_discount += discount
-        
-        # Add summary row
-        if sale_count > 0:
-            tree.insert('', 'end', values=(
+        
+        # Add summary row for everything matching the filters, not just this page
+        if count > 0:
+            tree.insert('', 'end', iid='TOTAL', values=(
+                "",
                 "TOTAL",
-                f"{sale_count} sales",
+                f"{count} sales",
                 "",
-                total_qty,
-                f"{total_sales + total_discount:.2f}",
-                f"{total_discount:.2f}",
-                f"{total_sales:.2f}"
+                totals['items_sold'],
+                f"{totals['gross_total']:.2f}",
+                f"{totals['discount']:.2f}",
+                f"{totals['tax']:.2f}",
+                f"{totals['net_total']:.2f}"
             ), tags=('total',))
             tree.tag_configure('total', background='#f0f0f0', font=('Segoe UI', 9, 'bold'))
         
+        view['page_var'].set(f"Page {view['page'] + 1} of {pages}")
+        
         # Update status bar
-        self.status_var.set(f"Showing {sale_count} sales - Total: Pkr {total_sales:.2f}")
+        first = view['page'] * page_size
+        self.status_var.set(f"Showing {first + 1 if rows else 0}-{first + len(rows)} of {count} sales - "
+                            f"Total: Pkr {totals['net_total']:.2f}")
     
     def show_reports(self):
         """Show the reports tab"""
         self.hide_all_tabs()
-        self.reports_frame.pack(fill=tk.BOTH, expand=True)
-        self.generate_report()
+        self.tab('reports').pack(fill=tk.BOTH, expand=True)
+        # A recall needs a batch number and asks about exporting, so it only runs when asked for
+        if self.report_type.get() != "Batch Recall":
+            self.generate_report()
     
     def show_settings(self):
         """Show the settings tab"""
         self.hide_all_tabs()
-        self.settings_frame.pack(fill=tk.BOTH, expand=True)
+        self.tab('settings').pack(fill=tk.BOTH, expand=True)
     
     def hide_all_tabs(self):
-        """Hide all content tabs"""
-        for frame in [self.dashboard_frame, self.inventory_frame, 
-                     self.sales_frame, self.reports_frame, self.settings_frame]:
+        """Hide all content tabs that have been built"""
+        for frame in self.tabs.values():
             frame.pack_forget()
     
     def create_dashboard(self):
@@ -412,7 +3573,8 @@ class ModernMedicalStore:
         self.expiring_var.set("0")
         ttk.Label(card3, textvariable=self.expiring_var, font=('Segoe UI', 24, 'bold'), 
                  style='White.TLabel', foreground=self.accent_color).pack(pady=5)
-        ttk.Label(card3, text="items expiring in 3 months", style='White.TLabel').pack(pady=(0, 10))
+        self.expiring_caption = ttk.Label(card3, text="items expiring in 90 days", style='White.TLabel')
+        self.expiring_caption.pack(pady=(0, 10))
         
         # Card 4: Today's Sales
         card4 = ttk.Frame(cards_frame, style='Card.TFrame')
@@ -455,42 +3617,42 @@ class ModernMedicalStore:
         
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.sales_table.pack(fill=tk.BOTH, expand=True)
+        self.sales_table.bind('<Double-1>', lambda e: self.view_sale_details(self.sales_table))
+        
+        for topic in ('medicines', 'sales', 'settings'):
+            self.subscribe(topic, self.on_dashboard_change)
     
     def update_dashboard(self):
         """Update dashboard statistics"""
         # Update total medicines
         self.total_meds_var.set(str(len(self.medicines)))
         
-        # Update low stock items (quantity < 20)
-        low_stock = sum(1 for med in self.medicines.values() if 0 < med['quantity'] < 20)
-        self.low_stock_var.set(str(low_stock))
+        # Update low stock items (below each item's threshold), from the stock index
+        self.low_stock_var.set(str(len(self.stock_index.low)))
         
-        # Update expiring soon items (within 3 months)
-        today = datetime.datetime.now().date()
-        expiring = 0
-        for med in self.medicines.values():
-            try:
-                expiry_date = datetime.datetime.strptime(med['expiry'], "%d-%m-%Y").date()
-                if (expiry_date - today).days <= 90:
-                    expiring += 1
-            except:
-                continue
+        # Update expiring soon items (within the expiry window)
+        window = self.receipt_settings['expiry_window_days']
+        expiring = self.stock_index.count_expiring(datetime.datetime.now().toordinal(), window)
         self.expiring_var.set(str(expiring))
+        self.expiring_caption.configure(text=f"items expiring in {window} days")
         
-        # Update today's sales - now properly filtering by today's date
+        # Update today's sales from the daily rollup (refunds are already netted off)
         today_str = datetime.datetime.now().strftime("%d-%m-%Y")
-        today_sales = sum(sale['total'] for sale in self.sales_history if sale['date'] == today_str)
+        today_sales = to_rupees(self.sales_store.daily.get(today_str, {}).get('net_paisa', 0))
         self.today_sales_var.set(f"Pkr {today_sales:.2f}")
         
         # Update empty stock items
-        empty_stock = sum(1 for med in self.medicines.values() if med['quantity'] == 0)
-        self.empty_stock_var.set(str(empty_stock))
+        self.empty_stock_var.set(str(len(self.stock_index.empty)))
         
         # Update recent sales table
         self.sales_table.delete(*self.sales_table.get_children())
-        for sale in sorted(self.sales_history, key=lambda x: x['date'], reverse=True)[:10]:
+        for sale in self.sales_store.recent(10):
             items = ", ".join(f"{item['name']} ({item['qty']})" for item in sale['items'])
-            self.sales_table.insert('', 'end', values=(sale['date'], items, f"{sale['total']:.2f}"))
+            self.sales_table.insert('', 'end', iid=str(sale['id']), values=(sale['date'], items, f"{sale['total']:.2f}"))
+    
+    def on_dashboard_change(self, keys):
+        """Dashboard cards and the recent sales table are small, so any change redraws them"""
+        self.update_dashboard()
     
     def create_inventory_tab(self):
         """Create the inventory management tab"""
@@ -520,13 +3682,11 @@ class ModernMedicalStore:
         self.company_filter = tk.StringVar()
         self.company_filter.set("All")  # Default to show all companies
         
-        # Get unique companies from medicines
-        all_companies = sorted(set(med.get('company', 'All') for med in self.medicines.values()))
-        if "All" not in all_companies:
-            all_companies.insert(0, "All")
-        
-        company_menu = ttk.OptionMenu(filter_frame, self.company_filter, *all_companies, command=self.filter_by_company)
-        company_menu.pack(side=tk.LEFT, padx=5)
+        # Choices come from the stock index's company keys and are rebuilt when they change
+        self.company_menu = ttk.OptionMenu(filter_frame, self.company_filter, "All", command=self.filter_by_company)
+        self.company_menu.pack(side=tk.LEFT, padx=5)
+        self.company_menu_key = None
+        self.refresh_company_menu()
         
         # Search frame
         search_frame = ttk.Frame(self.inventory_frame)
@@ -555,6 +3715,7 @@ class ModernMedicalStore:
         self.tree.column('Quantity', width=60, anchor='e')
         self.tree.column('Expiry', width=100, anchor='center')
         self.tree.column('Batch', width=100, anchor='center')
+        self.inventory_rows = []  # names shown, in tree order
         
         scrollbar = ttk.Scrollbar(self.inventory_frame, orient=tk.VERTICAL, command=self.tree.yview)
         self.tree.configure(yscroll=scrollbar.set)
@@ -571,44 +3732,83 @@ class ModernMedicalStore:
         self.context_menu.add_command(label="Delete Medicine", command=self.delete_medicine)
         self.context_menu.add_command(label="Generate Receipt", command=self.generate_receipt_for_selected)
         self.tree.bind('<Button-3>', self.show_context_menu)
+        
+        self.refresh_inventory()
+        self.subscribe('medicines', self.patch_inventory)
     
     def filter_by_company(self, event=None):
         """Filter medicines by company"""
         self.refresh_inventory()
     
+    def refresh_company_menu(self):
+        """Rebuild the company filter choices if a company was added or removed"""
+        key = (self.stock_index, self.stock_index.company_version)
+        if key == self.company_menu_key:
+            return
+        self.company_menu_key = key
+        companies = sorted(self.stock_index.by_company)
+        selected = self.company_filter.get()
+        if selected not in companies:
+            selected = "All"
+        self.company_menu.set_menu(selected, "All", *companies)
+    
+    def filtered_medicines(self):
+        """Sorted names for the company filter; one company reads only its own index entry"""
+        company_filter = self.company_filter.get()
+        if company_filter == "All":
+            return sorted(self.medicines)
+        return self.stock_index.names_for(company_filter)
+    
+    def inventory_visible(self, name):
+        """Whether a medicine passes the inventory company filter and search"""
+        company_filter = self.company_filter.get()
+        return ((company_filter == "All" or self.medicines[name].get('company', '') == company_filter) 
+                and self.search_entry.get().lower() in name.lower())
+    
+    def inventory_values(self, name):
+        details = self.medicines[name]
+        return (name, details.get('company', 'All'), f"{details['price']:.2f}", 
+                details['quantity'], details['expiry'], details['batch'])
+    
+    def fill_inventory(self):
+        """Redraw the inventory treeview; rows are keyed by medicine name so events can patch them"""
+        search_term = self.search_entry.get().lower()
+        self.tree.delete(*self.tree.get_children())
+        self.inventory_rows = [name for name in self.filtered_medicines() if search_term in name.lower()]
+        for name in self.inventory_rows:
+            self.tree.insert('', 'end', iid=name, values=self.inventory_values(name))
+    
     def refresh_inventory(self):
         """Refresh the inventory treeview"""
-        self.tree.delete(*self.tree.get_children())
-        company_filter = self.company_filter.get()
-        
-        for name, details in sorted(self.medicines.items()):
-            if company_filter == "All" or details.get('company', 'All') == company_filter:
-                self.tree.insert('', 'end', values=(
-                    name, 
-                    details.get('company', 'All'),
-                    f"{details['price']:.2f}", 
-                    details['quantity'], 
-                    details['expiry'], 
-                    details['batch']
-                ))
+        self.refresh_company_menu()
+        self.fill_inventory()
         self.status_var.set("Inventory refreshed")
     
+    def patch_inventory(self, names):
+        """Apply medicine change events to the inventory rows they touch"""
+        self.refresh_company_menu()
+        self.patch_rows(self.tree, self.inventory_rows, names, self.inventory_visible, self.inventory_values)
+    
+    def patch_rows(self, tree, rows, names, visible, values):
+        """Insert, update or delete the rows for names in a treeview sorted by name.
+        
+        rows mirrors the tree's order, so an insert finds its position with a bisect.
+        """
+        for name in names:
+            if name in self.medicines and visible(name):
+                if tree.exists(name):
+                    tree.item(name, values=values(name))
+                else:
+                    index = bisect.bisect_left(rows, name)
+                    rows.insert(index, name)
+                    tree.insert('', index, iid=name, values=values(name))
+            elif tree.exists(name):
+                tree.delete(name)
+                del rows[bisect.bisect_left(rows, name)]
+    
     def search_medicine(self, event=None):
         """Search medicine in inventory"""
-        search_term = self.search_entry.get().lower()
-        company_filter = self.company_filter.get()
-        self.tree.delete(*self.tree.get_children())
-        
-        for name, details in sorted(self.medicines.items()):
-            if (company_filter == "All" or details.get('company', 'All') == company_filter) and search_term in name.lower():
-                self.tree.insert('', 'end', values=(
-                    name, 
-                    details.get('company', 'All'),
-                    f"{details['price']:.2f}", 
-                    details['quantity'], 
-                    details['expiry'], 
-                    details['batch']
-                ))
+        self.fill_inventory()
     
     def clear_search(self):
         """Clear inventory search"""
@@ -633,7 +3833,7 @@ class ModernMedicalStore:
         """Open add medicine window"""
         self.add_window = tk.Toplevel(self.root)
         self.add_window.title("Add New Medicine")
-        self.add_window.geometry("500x500")
+        self.add_window.geometry("500x670")
         self.add_window.resizable(False, False)
         
         # Center the window
@@ -673,7 +3873,22 @@ class ModernMedicalStore:
         # Batch Number
         ttk.Label(form_frame, text="Batch Number:").pack(anchor='w', padx=20)
         self.batch_entry_add = ttk.Entry(form_frame, width=40)
-        self.batch_entry_add.pack(padx=20, pady=(0, 20))
+        self.batch_entry_add.pack(padx=20, pady=(0, 10))
+        
+        # Barcode
+        ttk.Label(form_frame, text="Barcode / GTIN (optional):").pack(anchor='w', padx=20)
+        self.barcode_entry_add = ttk.Entry(form_frame, width=40)
+        self.barcode_entry_add.pack(padx=20, pady=(0, 10))
+        
+        # Low-stock threshold override
+        ttk.Label(form_frame, text="Low-Stock Alert (blank = store default):").pack(anchor='w', padx=20)
+        self.low_stock_entry_add = ttk.Entry(form_frame, width=40)
+        self.low_stock_entry_add.pack(padx=20, pady=(0, 10))
+        
+        # Tax rate override
+        ttk.Label(form_frame, text="Tax Rate % (blank = company/store rate, 0 = exempt):").pack(anchor='w', padx=20)
+        self.tax_entry_add = ttk.Entry(form_frame, width=40)
+        self.tax_entry_add.pack(padx=20, pady=(0, 20))
         
         # Buttons
         button_frame = ttk.Frame(form_frame)
@@ -693,18 +3908,31 @@ class ModernMedicalStore:
                 return
                 
             company = self.company_entry_add.get().strip()
-            price = float(self.price_entry_add.get())
+            price = money(float(self.price_entry_add.get()))
             quantity = int(self.qty_entry_add.get())
             expiry = self.expiry_entry_add.get().strip()
             batch = self.batch_entry_add.get().strip()
+            low_stock = self.low_stock_entry_add.get().strip()
+            low_stock = int(low_stock) if low_stock else None
+            own_rate = self.tax_entry_add.get().strip()
+            own_rate = float(own_rate) if own_rate else None
+            barcode = self.barcode_entry_add.get().strip()
             
             if not expiry or not batch:
                 messagebox.showerror("Error", "Expiry date and batch number cannot be empty", parent=self.add_window)
                 return
             
+            if own_rate is not None and own_rate < 0:
+                messagebox.showerror("Error", "Please enter a tax rate of 0% or more", parent=self.add_window)
+                return
+            
             if name in self.medicines:
                 messagebox.showerror("Error", "Medicine already exists", parent=self.add_window)
                 return
+            
+            if barcode and self.stock_index.barcodes.get(normalize_barcode(barcode)) is not None:
+                messagebox.showerror("Error", "Another medicine already has this barcode", parent=self.add_window)
+                return
                 
             self.medicines[name] = {
                 'company': company,
@@ -713,14 +3941,20 @@ class ModernMedicalStore:
                 'expiry': expiry,
                 'batch': batch
             }
+            if low_stock is not None:
+                self.medicines[name]['low_stock'] = low_stock
+            if own_rate is not None:
+                self.medicines[name]['tax_rate'] = own_rate
+            if barcode:
+                self.medicines[name]['barcode'] = barcode
+            self.mark_dirty('medicines', names=[name])
             
             messagebox.showinfo("Success", f"Medicine '{name}' added successfully", parent=self.add_window)
             self.add_window.destroy()
-            self.refresh_inventory()
-            self.refresh_sales_list()
             self.status_var.set(f"Medicine '{name}' added successfully")
         except ValueError:
-            messagebox.showerror("Error", "Please enter valid numbers for price and quantity", parent=self.add_window)
+            messagebox.showerror("Error", "Please enter valid numbers for price, quantity, low-stock alert and tax rate", 
+                                 parent=self.add_window)
     
     def edit_medicine(self, event):
         """Edit selected medicine"""
@@ -734,7 +3968,7 @@ class ModernMedicalStore:
         
         self.edit_window = tk.Toplevel(self.root)
         self.edit_window.title("Edit Medicine")
-        self.edit_window.geometry("500x550")
+        self.edit_window.geometry("500x720")
         self.edit_window.resizable(False, False)
         
         # Center the window
@@ -780,7 +4014,27 @@ class ModernMedicalStore:
         ttk.Label(form_frame, text="Batch Number:").pack(anchor='w', padx=20)
         self.batch_entry_edit = ttk.Entry(form_frame, width=40)
         self.batch_entry_edit.insert(0, medicine['batch'])
-        self.batch_entry_edit.pack(padx=20, pady=(0, 20))
+        self.batch_entry_edit.pack(padx=20, pady=(0, 10))
+        
+        # Barcode
+        ttk.Label(form_frame, text="Barcode / GTIN (optional):").pack(anchor='w', padx=20)
+        self.barcode_entry_edit = ttk.Entry(form_frame, width=40)
+        self.barcode_entry_edit.insert(0, medicine.get('barcode', ''))
+        self.barcode_entry_edit.pack(padx=20, pady=(0, 10))
+        
+        # Low-stock threshold override
+        ttk.Label(form_frame, text="Low-Stock Alert (blank = store default):").pack(anchor='w', padx=20)
+        self.low_stock_entry_edit = ttk.Entry(form_frame, width=40)
+        if medicine.get('low_stock') is not None:
+            self.low_stock_entry_edit.insert(0, medicine['low_stock'])
+        self.low_stock_entry_edit.pack(padx=20, pady=(0, 10))
+        
+        # Tax rate override
+        ttk.Label(form_frame, text="Tax Rate % (blank = company/store rate, 0 = exempt):").pack(anchor='w', padx=20)
+        self.tax_entry_edit = ttk.Entry(form_frame, width=40)
+        if medicine.get('tax_rate') is not None:
+            self.tax_entry_edit.insert(0, f"{medicine['tax_rate']:g}")
+        self.tax_entry_edit.pack(padx=20, pady=(0, 20))
         
         # Buttons
         button_frame = ttk.Frame(form_frame)
@@ -800,15 +4054,28 @@ class ModernMedicalStore:
                 return
                 
             company = self.company_entry_edit.get().strip()
-            price = float(self.price_entry_edit.get())
+            price = money(float(self.price_entry_edit.get()))
             quantity = int(self.qty_entry_edit.get())
             expiry = self.expiry_entry_edit.get().strip()
             batch = self.batch_entry_edit.get().strip()
+            low_stock = self.low_stock_entry_edit.get().strip()
+            low_stock = int(low_stock) if low_stock else None
+            own_rate = self.tax_entry_edit.get().strip()
+            own_rate = float(own_rate) if own_rate else None
+            barcode = self.barcode_entry_edit.get().strip()
+            
+            if barcode and self.stock_index.barcodes.get(normalize_barcode(barcode), old_name) != old_name:
+                messagebox.showerror("Error", "Another medicine already has this barcode", parent=self.edit_window)
+                return
             
             if not expiry or not batch:
                 messagebox.showerror("Error", "Expiry date and batch number cannot be empty", parent=self.edit_window)
                 return
             
+            if own_rate is not None and own_rate < 0:
+                messagebox.showerror("Error", "Please enter a tax rate of 0% or more", parent=self.edit_window)
+                return
+            
             # If name changed, remove old entry and add new one
             if old_name != new_name:
                 if new_name in self.medicines:
@@ -834,14 +4101,26 @@ class ModernMedicalStore:
                     'expiry': expiry,
                     'batch': batch
                 })
+            if low_stock is None:
+                self.medicines[new_name].pop('low_stock', None)
+            else:
+                self.medicines[new_name]['low_stock'] = low_stock
+            if own_rate is None:
+                self.medicines[new_name].pop('tax_rate', None)
+            else:
+                self.medicines[new_name]['tax_rate'] = own_rate
+            if barcode:
+                self.medicines[new_name]['barcode'] = barcode
+            else:
+                self.medicines[new_name].pop('barcode', None)
+            self.mark_dirty('medicines', names=[old_name, new_name])
             
             messagebox.showinfo("Success", "Medicine updated successfully", parent=self.edit_window)
             self.edit_window.destroy()
-            self.refresh_inventory()
-            self.refresh_sales_list()
             self.status_var.set("Medicine updated successfully")
         except ValueError:
-            messagebox.showerror("Error", "Please enter valid numbers for price and quantity", parent=self.edit_window)
+            messagebox.showerror("Error", "Please enter valid numbers for price, quantity, low-stock alert and tax rate", 
+                                 parent=self.edit_window)
     
     def delete_medicine(self):
         """Delete selected medicine"""
@@ -853,8 +4132,7 @@ class ModernMedicalStore:
         name = self.tree.item(selected, 'values')[0]
         if messagebox.askyesno("Confirm", f"Are you sure you want to delete '{name}'?", icon='warning'):
             del self.medicines[name]
-            self.refresh_inventory()
-            self.refresh_sales_list()
+            self.mark_dirty('medicines', names=[name])
             self.status_var.set(f"Medicine '{name}' deleted successfully")
     
     def create_sales_tab(self):
@@ -874,6 +4152,15 @@ class ModernMedicalStore:
         ttk.Label(left_frame, text="Available Medicines", style='Header.TLabel', 
                  font=('Segoe UI', 11)).pack(anchor='w')
         
+        # Scan frame: keyboard-wedge scanners type the code and press Enter here
+        scan_frame = ttk.Frame(left_frame)
+        scan_frame.pack(fill=tk.X, pady=(5, 5))
+        
+        ttk.Label(scan_frame, text="Scan:").pack(side=tk.LEFT)
+        self.scan_entry = ttk.Entry(scan_frame, width=30)
+        self.scan_entry.pack(side=tk.LEFT, padx=5)
+        self.scan_entry.bind('<Return>', self.on_scan_entry)
+        
         # Search frame
         search_frame = ttk.Frame(left_frame)
         search_frame.pack(fill=tk.X, pady=(0, 10))
@@ -897,6 +4184,7 @@ class ModernMedicalStore:
         self.sales_tree.column('Company', width=120, anchor='w')
         self.sales_tree.column('Price', width=80, anchor='e')
         self.sales_tree.column('Stock', width=80, anchor='e')
+        self.sales_rows = []  # names shown, in tree order
         
         scrollbar = ttk.Scrollbar(left_frame, orient=tk.VERTICAL, command=self.sales_tree.yview)
         self.sales_tree.configure(yscroll=scrollbar.set)
@@ -955,15 +4243,22 @@ class ModernMedicalStore:
         self.discount_entry = ttk.Entry(discount_frame, width=5)
         self.discount_entry.pack(side=tk.LEFT, padx=5)
         self.discount_entry.insert(0, str(self.receipt_settings["default_discount"]))
+        self.discount_entry.bind('<KeyRelease>', self.update_cart_totals)
         
         # Customer name frame
         customer_frame = ttk.Frame(right_frame)
         customer_frame.pack(fill=tk.X, pady=5)
         
+        # Typing a name or phone offers registered customers in the dropdown
         ttk.Label(customer_frame, text="Customer:").pack(side=tk.LEFT)
-        self.customer_entry = ttk.Entry(customer_frame)
+        self.customer_entry = ttk.Combobox(customer_frame)
         self.customer_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         self.customer_entry.insert(0, "Walk-in Customer")
+        self.customer_entry.bind('<KeyRelease>', self.suggest_customers)
+        ttk.Button(customer_frame, text="New", style='TButton', width=5,
+                  command=self.register_customer).pack(side=tk.LEFT, padx=2)
+        ttk.Button(customer_frame, text="History", style='TButton', width=7,
+                  command=self.show_customer_history).pack(side=tk.LEFT, padx=2)
         
         # Total frame
         total_frame = ttk.Frame(right_frame)
@@ -974,6 +4269,11 @@ class ModernMedicalStore:
         self.gross_total_var.set("Pkr 0.00")
         ttk.Label(total_frame, textvariable=self.gross_total_var, font=('Segoe UI', 10, 'bold')).pack(side=tk.LEFT, padx=5)
         
+        ttk.Label(total_frame, text="Tax:", font=('Segoe UI', 10, 'bold')).pack(side=tk.LEFT, padx=(20, 0))
+        self.tax_total_var = tk.StringVar()
+        self.tax_total_var.set("Pkr 0.00")
+        ttk.Label(total_frame, textvariable=self.tax_total_var, font=('Segoe UI', 10, 'bold')).pack(side=tk.LEFT, padx=5)
+        
         ttk.Label(total_frame, text="Net Total:", font=('Segoe UI', 10, 'bold')).pack(side=tk.LEFT, padx=(20, 0))
         self.net_total_var = tk.StringVar()
         self.net_total_var.set("Pkr 0.00")
@@ -989,36 +4289,83 @@ class ModernMedicalStore:
                   command=self.clear_cart).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Complete Sale", style='Accent.TButton', 
                   command=self.complete_sale).pack(side=tk.RIGHT)
+        
+        ttk.Label(right_frame, text="F2 scan  F3 search  Enter add  +/- qty  F4 edit qty  Del remove  F12 complete", 
+                 font=('Segoe UI', 8)).pack(anchor='w', pady=(5, 0))
+        
+        # Keyboard checkout: hotkeys work anywhere while the sales tab is showing
+        self.sales_tree.bind('<Return>', lambda e: self.add_to_cart())
+        self.cart_tree.bind('<Delete>', self.remove_from_cart)
+        self.cart_tree.bind('<Return>', self.edit_cart_quantity)
+        for sequence, step in (('<plus>', 1), ('<KP_Add>', 1), ('<minus>', -1), ('<KP_Subtract>', -1)):
+            self.cart_tree.bind(sequence, lambda e, step=step: self.adjust_cart_quantity(step))
+        hotkeys = {
+            '<F2>': self.scan_entry.focus_set,
+            '<F3>': self.sales_search_entry.focus_set,
+            '<F4>': self.edit_cart_quantity,
+            '<F12>': self.complete_sale
+        }
+        for sequence, action in hotkeys.items():
+            self.root.bind(sequence, lambda e, action=action: self.on_checkout_key(action))
+        
+        self.refresh_sales_list()
+        self.refresh_cart()
+        self.subscribe('medicines', self.patch_sales_list)
+        self.subscribe('cart', self.patch_cart)
+    
+    def sales_list_visible(self, name):
+        return self.sales_search_entry.get().lower() in name.lower()
+    
+    def sales_list_values(self, name):
+        details = self.medicines[name]
+        return (name, details.get('company', 'All'), f"{details['price']:.2f}", details['quantity'])
     
     def refresh_sales_list(self):
         """Refresh the sales treeview"""
+        search_term = self.sales_search_entry.get().lower()
         self.sales_tree.delete(*self.sales_tree.get_children())
-        for name, details in sorted(self.medicines.items()):
-            self.sales_tree.insert('', 'end', values=(
-                name, 
-                details.get('company', 'All'),
-                f"{details['price']:.2f}", 
-                details['quantity']
-            ))
+        self.sales_rows = [name for name in sorted(self.medicines) if search_term in name.lower()]
+        for name in self.sales_rows:
+            self.sales_tree.insert('', 'end', iid=name, values=self.sales_list_values(name))
+    
+    def patch_sales_list(self, names):
+        """Apply medicine change events (stock moving into or out of the cart) to their rows"""
+        self.patch_rows(self.sales_tree, self.sales_rows, names, self.sales_list_visible, self.sales_list_values)
     
     def search_sales_medicine(self, event=None):
         """Search medicine in sales list"""
-        search_term = self.sales_search_entry.get().lower()
-        self.sales_tree.delete(*self.sales_tree.get_children())
-        for name, details in sorted(self.medicines.items()):
-            if search_term in name.lower():
-                self.sales_tree.insert('', 'end', values=(
-                    name, 
-                    details.get('company', 'All'),
-                    f"{details['price']:.2f}", 
-                    details['quantity']
-                ))
+        self.refresh_sales_list()
     
     def clear_sales_search(self):
         """Clear sales search"""
         self.sales_search_entry.delete(0, tk.END)
         self.refresh_sales_list()
     
+    def add_item_to_cart(self, name, qty, batch=None):
+        """Move qty units of a medicine (of its stock batch unless one is given) into the cart.
+        
+        Returns an error message, or None.
+        """
+        medicine = self.medicines[name]
+        batch = batch or medicine['batch']
+        if qty <= 0:
+            return "Quantity must be positive"
+        if qty > medicine['quantity']:
+            return "Not enough stock available"
+        # A cart line records one batch, so another batch would be sold under the wrong one
+        if name in self.cart and self.cart[name]['batch'] != batch:
+            return f"Batch {batch} cannot join the cart line of batch {self.cart[name]['batch']}"
+            
+        if not self.cart:
+            self.checkout_started = time.perf_counter()
+        self.cart.add(name, medicine['price'], qty, self.stock_index.tax_rates.get(name, 0.0), batch)
+        
+        # Update stock (temporarily until sale is completed)
+        medicine['quantity'] -= qty
+        self.mark_dirty('medicines', names=[name])
+        self.publish('cart', [name])
+        return None
+    
     def add_to_cart(self):
         """Add selected medicine to cart with specified quantity"""
         selected = self.sales_tree.focus()
@@ -1027,30 +4374,13 @@ class ModernMedicalStore:
             return
             
         name = self.sales_tree.item(selected, 'values')[0]
-        medicine = self.medicines[name]
         
         try:
             qty = int(self.qty_entry.get())
-            if qty <= 0:
-                messagebox.showerror("Error", "Quantity must be positive")
-                return
-                
-            if qty > medicine['quantity']:
-                messagebox.showerror("Error", "Not enough stock available")
+            error = self.add_item_to_cart(name, qty)
+            if error:
+                messagebox.showerror("Error", error)
                 return
-                
-            if name in self.current_transaction:
-                self.current_transaction[name]['quantity'] += qty
-            else:
-                self.current_transaction[name] = {
-                    'price': medicine['price'],
-                    'quantity': qty
-                }
-            
-            # Update stock (temporarily until sale is completed)
-            self.medicines[name]['quantity'] -= qty
-            self.refresh_sales_list()
-            self.refresh_cart()
             self.status_var.set(f"{qty} units of {name} added to cart")
             
             # Reset quantity entry
@@ -1059,35 +4389,167 @@ class ModernMedicalStore:
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid quantity")
     
+    def scan_barcode(self, raw):
+        """Add one unit of a scanned item to the cart; problems beep and show in the status bar.
+        
+        No dialogs, so a scanner can keep going at full rate.
+        """
+        resolved = self.stock_index.resolve_scan(raw)
+        if resolved is None:
+            barcode, _ = parse_scan(raw)
+            misread = barcode.isdigit() and len(barcode) == 14 and not gtin_check_digit_valid(barcode)
+            self.root.bell()
+            self.status_var.set(f"{'Misread' if misread else 'Unknown'} barcode: {raw.strip()}")
+            return False
+        name, batch = resolved
+        error = self.add_item_to_cart(name, 1, batch)
+        if error:
+            self.root.bell()
+            self.status_var.set(f"{name}: {error}")
+            return False
+        stock_batch = self.medicines[name]['batch']
+        note = f" (batch {batch}, stock batch {stock_batch})" if batch and batch != stock_batch else ""
+        self.status_var.set(f"Scanned {name}{note}")
+        return True
+    
+    def on_scan_entry(self, event=None):
+        code = self.scan_entry.get()
+        self.scan_entry.delete(0, tk.END)
+        if code.strip():
+            self.scan_barcode(code)
+    
+    def start_scanner(self, device, poll_ms=50):
+        """Read scans from a scanner device on a worker thread and add them on the Tk thread"""
+        self.scanner = device
+        scans = collections.deque()
+        
+        def target():
+            while True:
+                code = device.read()
+                if code is None:
+                    break
+                scans.append(code)
+        
+        worker = threading.Thread(target=target, daemon=True)
+        worker.start()
+        
+        def poll():
+            while scans:
+                self.scan_barcode(scans.popleft())
+            if worker.is_alive():
+                self.root.after(poll_ms, poll)
+        
+        self.root.after(poll_ms, poll)
+    
+    def stop_scanner(self):
+        if self.scanner is not None:
+            self.scanner.close()
+            self.scanner = None
+    
+    def on_checkout_key(self, action):
+        if 'sales' in self.tabs and self.sales_frame.winfo_ismapped():
+            action()
+            return 'break'
+    
+    def set_cart_quantity(self, name, qty):
+        """Change a cart line's quantity, moving the difference from or back to stock; 0 removes it"""
+        if name not in self.cart:
+            return
+        medicine = self.medicines[name]
+        in_cart = self.cart.quantity(name)
+        qty = max(qty, 0)
+        if qty - in_cart > medicine['quantity']:
+            self.root.bell()
+            self.status_var.set(f"Only {medicine['quantity'] + in_cart} units of {name} available")
+            return
+        medicine['quantity'] -= qty - in_cart
+        self.cart.set(name, medicine['price'], qty, self.stock_index.tax_rates.get(name, 0.0))
+        self.mark_dirty('medicines', names=[name])
+        self.publish('cart', [name])
+        self.status_var.set(f"{name}: {qty} in cart")
+    
+    def adjust_cart_quantity(self, step):
+        name = self.cart_tree.focus()
+        if name in self.cart:
+            self.set_cart_quantity(name, self.cart.quantity(name) + step)
+    
+    def edit_cart_quantity(self, event=None):
+        """Edit the focused cart line's quantity in place: Enter saves, Escape cancels"""
+        name = self.cart_tree.focus()
+        bbox = self.cart_tree.bbox(name, 'Qty') if name in self.cart else None
+        if not bbox:
+            return
+        x, y, width, height = bbox
+        editor = ttk.Entry(self.cart_tree, justify='right')
+        editor.insert(0, str(self.cart.quantity(name)))
+        editor.select_range(0, tk.END)
+        editor.place(x=x, y=y, width=width, height=height)
+        editor.focus_set()
+        
+        def commit(event=None):
+            text = editor.get()
+            editor.destroy()
+            self.cart_tree.focus_set()
+            try:
+                self.set_cart_quantity(name, int(text))
+            except ValueError:
+                self.root.bell()
+                self.status_var.set("Quantity must be a whole number")
+            return 'break'
+        
+        def cancel(event=None):
+            editor.destroy()
+            self.cart_tree.focus_set()
+            return 'break'
+        
+        editor.bind('<Return>', commit)
+        editor.bind('<KP_Enter>', commit)
+        editor.bind('<Escape>', cancel)
+        editor.bind('<FocusOut>', lambda e: editor.destroy())
+    
     def add_to_cart_from_tree(self, event):
         """Add medicine to cart when double-clicked in treeview"""
         self.add_to_cart()
     
+    def cart_values(self, name):
+        details = self.cart[name]
+        return (name, f"{details['price']:.2f}", details['quantity'], 
+                f"{details['price'] * details['quantity']:.2f}")
+    
     def refresh_cart(self):
         """Refresh the cart and calculate total"""
         self.cart_tree.delete(*self.cart_tree.get_children())
-        gross_total = 0.0
-        
-        for name, details in self.current_transaction.items():
-            item_total = details['price'] * details['quantity']
-            gross_total += item_total
-            self.cart_tree.insert('', 'end', values=(
-                name,
-                f"{details['price']:.2f}",
-                details['quantity'],
-                f"{item_total:.2f}"
-            ))
-        
-        # Calculate discount and net total
+        for name in self.cart:
+            self.cart_tree.insert('', 'end', iid=name, values=self.cart_values(name))
+        self.update_cart_totals()
+    
+    def patch_cart(self, names):
+        """Apply cart change events: new lines go to the end, like the cart's own order"""
+        for name in names:
+            if name in self.cart:
+                if self.cart_tree.exists(name):
+                    self.cart_tree.item(name, values=self.cart_values(name))
+                else:
+                    self.cart_tree.insert('', 'end', iid=name, values=self.cart_values(name))
+            elif self.cart_tree.exists(name):
+                self.cart_tree.delete(name)
+        self.update_cart_totals()
+    
+    def entry_discount(self):
+        """The discount percent typed in the sales tab (0 if it is not a number)"""
         try:
-            discount_percent = float(self.discount_entry.get())
+            return float(self.discount_entry.get())
         except ValueError:
-            discount_percent = 0
-        
-        discount_amount = gross_total * (discount_percent / 100)
-        net_total = gross_total - discount_amount
+            return 0
+    
+    def update_cart_totals(self, event=None):
+        """Show the cart's running gross, tax and net totals"""
+        self.cart.discount_percent = self.entry_discount()
+        gross_total = self.cart.gross
+        net_total = self.cart.net
         
         self.gross_total_var.set(f"Pkr {gross_total:.2f}")
+        self.tax_total_var.set(f"Pkr {self.cart.tax:.2f}")
         self.net_total_var.set(f"Pkr {net_total:.2f}")
     
     def remove_from_cart(self, event=None):
@@ -1098,80 +4560,184 @@ class ModernMedicalStore:
             return
             
         name = self.cart_tree.item(selected, 'values')[0]
-        qty = self.current_transaction[name]['quantity']
         
         # Return stock
-        self.medicines[name]['quantity'] += qty
-        del self.current_transaction[name]
-        
-        self.refresh_sales_list()
-        self.refresh_cart()
+        self.medicines[name]['quantity'] += self.cart.quantity(name)
+        self.cart.remove(name)
+        self.mark_dirty('medicines', names=[name])
+        self.publish('cart', [name])
         self.status_var.set(f"{name} removed from cart")
     
     def clear_cart(self):
         """Clear all items from cart"""
-        if not self.current_transaction:
+        if not self.cart:
             return
             
         if messagebox.askyesno("Confirm", "Are you sure you want to clear the cart?", icon='warning'):
             # Return all items to stock
-            for name, details in self.current_transaction.items():
-                self.medicines[name]['quantity'] += details['quantity']
+            for name in self.cart:
+                self.medicines[name]['quantity'] += self.cart.quantity(name)
             
-            self.current_transaction.clear()
-            self.refresh_sales_list()
-            self.refresh_cart()
+            names = list(self.cart)
+            self.mark_dirty('medicines', names=names)
+            self.cart.clear()
+            self.publish('cart', names)
+            self.checkout_started = None
             self.status_var.set("Cart cleared")
     
     def complete_sale(self):
         """Complete the sale and generate receipt"""
-        if not self.current_transaction:
-            messagebox.showwarning("Warning", "Cart is empty")
+        quick = self.receipt_settings['quick_checkout']
+        if not self.cart:
+            if quick:
+                self.root.bell()
+                self.status_var.set("Cart is empty")
+            else:
+                messagebox.showwarning("Warning", "Cart is empty")
+            return
+        
+        # Create sale record
+        sale_record = self.snapshot_sale(self.cart)
+        
+        # Add to history (assigns the sale id)
+        self.sales_store.add(sale_record)
+        self.publish('sales', [sale_record['id']])
+        
+        # Generate receipt; quick checkout skips the window and goes straight to the next customer
+        receipt = self.generate_receipt(sale_record)
+        if self.receipt_settings['auto_print_receipts']:
+            self.queue_receipt(f"sale #{sale_record['id']}", receipt)
+        if not quick:
+            self.show_receipt_window(receipt)
+        
+        # Clear cart after sale (the sales event updates the dashboard's total)
+        names = list(self.cart)
+        self.cart.clear()
+        self.publish('cart', names)
+        
+        # Wall time from the first item to the completed sale
+        if self.checkout_started is not None:
+            self.checkout_times.append(time.perf_counter() - self.checkout_started)
+            self.checkout_started = None
+            median = sorted(self.checkout_times)[len(self.checkout_times) // 2]
+            self.status_var.set(f"Sale #{sale_record['id']} completed in {self.checkout_times[-1]:.1f} s "
+                                f"(median {median:.1f} s over the last {len(self.checkout_times)} sales)")
+        else:
+            self.status_var.set("Sale completed successfully")
+        if quick:
+            self.scan_entry.focus_set()
+    
+    def suggest_customers(self, event=None):
+        """Offer the registered customers matching what has been typed so far"""
+        if event is not None and event.keysym in ('Up', 'Down', 'Return', 'Escape'):
+            return
+        matches = self.customers.search(self.customer_entry.get())
+        self.customer_entry['values'] = [CustomerRegistry.label(record) for record in matches]
+    
+    def register_customer(self):
+        """Register a customer, starting from the name or phone typed at the counter"""
+        typed = self.customer_entry.get().strip()
+        if typed == "Walk-in Customer" or self.customers.match(typed):
+            typed = ""
+        numeric = typed and not any(ch.isalpha() for ch in typed)
+        name = simpledialog.askstring("New Customer", "Customer name:", parent=self.root,
+                                      initialvalue="" if numeric else typed)
+        if name is None:
+            return
+        phone = simpledialog.askstring("New Customer", "Phone (optional):", parent=self.root,
+                                       initialvalue=typed if numeric else "")
+        if phone is None:
             return
-            
         try:
-            discount_percent = float(self.discount_entry.get())
-        except ValueError:
-            discount_percent = 0
+            record = self.customers.add(name, phone)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.mark_dirty('customers')
+        self.customer_entry.delete(0, tk.END)
+        self.customer_entry.insert(0, CustomerRegistry.label(record))
+        self.status_var.set(f"Customer '{record['name']}' registered as #{record['id']}")
+    
+    def show_customer_history(self):
+        """List the purchases of the registered customer chosen at the counter"""
+        customer = self.customers.match(self.customer_entry.get())
+        if customer is None:
+            messagebox.showinfo("Customer History", "Choose a registered customer from the suggestions first")
+            return
+        sales = self.sales_store.customer_sales(customer['id'])
         
-        # Calculate totals
-        gross_total = sum(details['price'] * details['quantity'] for details in self.current_transaction.values())
-        discount_amount = gross_total * (discount_percent / 100)
-        net_total = gross_total - discount_amount
+        history_window = tk.Toplevel(self.root)
+        history_window.title(f"Purchase History - {CustomerRegistry.label(customer)}")
+        history_window.geometry("600x400")
+        self.center_window(history_window)
         
-        # Create sale record
-        today = datetime.datetime.now().strftime("%d-%m-%Y")
-        sale_record = {
-            'date': today,
-            'customer': self.customer_entry.get(),
+        def edit_customer():
+            name = simpledialog.askstring("Edit Customer", "Customer name:", parent=history_window,
+                                          initialvalue=customer['name'])
+            if name is None:
+                return
+            phone = simpledialog.askstring("Edit Customer", "Phone (optional):", parent=history_window,
+                                           initialvalue=customer['phone'])
+            if phone is None:
+                return
+            try:
+                self.customers.update(customer['id'], name, phone)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e), parent=history_window)
+                return
+            self.mark_dirty('customers')
+            label = CustomerRegistry.label(customer)
+            history_window.title(f"Purchase History - {label}")
+            self.customer_entry.delete(0, tk.END)
+            self.customer_entry.insert(0, label)
+        
+        header = ttk.Frame(history_window)
+        header.pack(fill=tk.X, padx=10, pady=5)
+        spent = sum(to_paisa(sale['total']) for sale in sales)
+        ttk.Label(header, text=f"{len(sales)} sales, Pkr {to_rupees(spent):.2f} in total "
+                               f"(double-click a sale for details)").pack(side=tk.LEFT)
+        ttk.Button(header, text="Edit Customer", style='TButton', command=edit_customer).pack(side=tk.RIGHT)
+        
+        tree = ttk.Treeview(history_window, columns=('ID', 'Date', 'Items', 'Total'), show='headings')
+        for column, text, width in (('ID', "Sale #", 60), ('Date', "Date", 140), 
+                                    ('Items', "Items", 280), ('Total', "Total (Pkr)", 90)):
+            tree.heading(column, text=text)
+            tree.column(column, width=width, anchor='e' if column in ('ID', 'Total') else 'w')
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        for sale in sales:
+            items = ", ".join(f"{item['name']} x{item['qty']}" for item in sale['items'])
+            tree.insert('', 'end', iid=str(sale['id']), values=(
+                sale['id'], sale.get('timestamp', sale['date']), items, f"{sale['total']:.2f}"))
+        tree.bind('<Double-1>', lambda e: self.view_sale_details(tree))
+    
+    def snapshot_sale(self, cart):
+        """Build a self-contained sale record from a cart, its running totals and the current sale inputs"""
+        cart.discount_percent = self.entry_discount()
+        customer = self.customers.match(self.customer_entry.get())
+        
+        now = datetime.datetime.now()
+        sale = {
+            'date': now.strftime("%d-%m-%Y"),
+            'timestamp': now.strftime("%d-%m-%Y %H:%M:%S"),
+            'customer': customer['name'] if customer else self.customer_entry.get(),
+            'cashier': self.receipt_settings["generator_name"],
             'items': [{
                 'name': name,
                 'qty': details['quantity'],
-                'price': details['price']
-            } for name, details in self.current_transaction.items()],
-            'gross_total': gross_total,
-            'discount': discount_amount,
-            'total': net_total
+                'price': details['price'],
+                'tax_rate': details['tax_rate'],
+                'batch': details['batch']
+            } for name, details in cart.lines.items()],
+            'gross_total': cart.gross,
+            'discount_percent': cart.discount_percent,
+            'discount': cart.discount,
+            'tax': tax_record(cart.tax_lines),
+            'tax_total': cart.tax,
+            'total': cart.net
         }
-        
-        # Add to history
-        self.sales_history.append(sale_record)
-        
-        # Generate receipt
-        receipt = self.generate_receipt()
-        
-        # Show receipt window
-        self.show_receipt_window(receipt)
-        
-        # Clear cart after sale
-        self.current_transaction.clear()
-        self.refresh_sales_list()
-        self.refresh_cart()
-        
-        # Update dashboard to show new sales total
-        self.update_dashboard()
-        
-        self.status_var.set("Sale completed successfully")
+        if customer:
+            sale['customer_id'] = customer['id']
+        return sale
     
     def generate_receipt_for_selected(self):
         """Generate receipt for selected medicine in inventory"""
@@ -1182,95 +4748,25 @@ class ModernMedicalStore:
             
         name = self.tree.item(selected, 'values')[0]
         
-        # Create temporary transaction with quantity 1
-        temp_transaction = {
-            name: {
-                'price': self.medicines[name]['price'],
-                'quantity': 1
-            }
-        }
+        # The receipt takes its discount and customer from the sales tab's inputs
+        self.tab('sales')
+        
+        # Create a temporary cart with quantity 1
+        cart = Cart()
+        cart.add(name, self.medicines[name]['price'], 1, self.stock_index.tax_rates.get(name, 0.0),
+                 self.medicines[name]['batch'])
         
         # Generate receipt
-        receipt = self.generate_receipt(temp_transaction)
+        receipt = self.generate_receipt(self.snapshot_sale(cart))
         
         # Show receipt window
         self.show_receipt_window(receipt)
     
-    def generate_receipt(self, transaction=None):
-        """Generate receipt text"""
-        if transaction is None:
-            transaction = self.current_transaction
-        
-        receipt = []
-        width = self.receipt_settings["receipt_width"]
-        
-        # Header
-        receipt.append("="*width)
-        receipt.append(self.receipt_settings["header_text"].center(width))
-        receipt.append(self.receipt_settings["address"].center(width))
-        receipt.append(self.receipt_settings["phone"].center(width))
-        receipt.append("="*width)
-        
-        # Date and customer info
-        receipt.append(f"Date: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
-        
-        if self.receipt_settings["show_customer_name"]:
-            customer_name = self.customer_entry.get()
-            receipt.append(f"Customer: {customer_name}")
-        
-        receipt.append("-"*width)
-        
-        # Items header
-        receipt.append("{:<25} {:<6} {:<8} {:<10}".format("ITEM", "QTY", "PRICE", "TOTAL"))
-        receipt.append("-"*width)
-        
-        # Items
-        gross_total = 0.0
-        for name, details in transaction.items():
-            amount = details['price'] * details['quantity']
-            gross_total += amount
-            receipt.append("{:<25} {:<6} {:<8.2f} {:<10.2f}".format(
-                name[:25], details['quantity'], details['price'], amount))
-        
-        receipt.append("-"*width)
-        
-        # Totals
-        receipt.append("GROSS TOTAL:".ljust(40) + f"PKR {gross_total:.2f}".rjust(10))
-        
-        if self.receipt_settings["show_discount"]:
-            try:
-                discount_percent = float(self.discount_entry.get())
-            except ValueError:
-                discount_percent = 0
-            
-            if discount_percent > 0:
-                discount_amount = gross_total * (discount_percent / 100)
-                net_total = gross_total - discount_amount
-                
-                receipt.append(f"DISCOUNT ({discount_percent}%):".ljust(40) + f"-PKR {discount_amount:.2f}".rjust(10))
-                receipt.append("NET TOTAL:".ljust(40) + f"PKR {net_total:.2f}".rjust(10))
-            else:
-                net_total = gross_total
-        else:
-            net_total = gross_total
-        
-        receipt.append("-"*width)
-        
-        # Generator name in a box
-        generator_line = f" Generated by: {self.receipt_settings['generator_name']} "
-        box_width = width - 4
-        if len(generator_line) > box_width:
-            generator_line = generator_line[:box_width]
-        
-        receipt.append("+" + "-"*(width-2) + "+")
-        receipt.append("|" + generator_line.center(width-2) + "|")
-        receipt.append("+" + "-"*(width-2) + "+")
-        
-        # Footer
-        receipt.append(self.receipt_settings["footer_text"].center(width))
-        receipt.append("="*width)
-        
-        return "\n".join(receipt)
+    def generate_receipt(self, sale=None):
+        """Generate receipt text for a sale record (defaults to the current cart)"""
+        if sale is None:
+            sale = self.snapshot_sale(self.cart)
+        return render_receipt(sale, self.receipt_settings)
     
     def show_receipt_window(self, receipt_text):
         """Display receipt in a new window with print button"""
@@ -1295,49 +4791,61 @@ class ModernMedicalStore:
     
     def print_receipt(self, receipt_text):
         """Print the receipt to default printer"""
-        try:
-            # Create a temporary file
-            with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.txt') as tmp_file:
-                tmp_file.write(receipt_text)
-                tmp_file_path = tmp_file.name
-            
-            # Print using system command
-            if os.name == 'nt':  # Windows
-                os.startfile(tmp_file_path, 'print')
-            elif os.name == 'posix':  # Linux/Mac
-                os.system(f'lpr {tmp_file_path}')
-            
-            # Schedule the file to be deleted after printing
-            self.root.after(5000, lambda: os.unlink(tmp_file_path))
-            
-            self.status_var.set("Receipt sent to printer")
-        except Exception as e:
-            messagebox.showerror("Print Error", f"Failed to print receipt: {str(e)}")
-            self.status_var.set("Printing failed")
+        self.queue_receipt("receipt", receipt_text)
+        self.status_var.set("Receipt sent to printer")
+    
+    def queue_receipt(self, label, receipt_text):
+        """Hand a receipt to the background printer and watch for failures until the queue drains"""
+        self.receipt_printer.submit(label, receipt_text)
+        if not self.printer_watched:
+            self.printer_watched = True
+            self.root.after(500, self.watch_printer)
+    
+    def watch_printer(self):
+        busy = self.receipt_printer.pending()
+        while self.receipt_printer.failures:
+            label, error = self.receipt_printer.failures.popleft()
+            self.root.bell()
+            self.status_var.set(f"Printing {label} failed: {error}")
+        if busy:
+            self.root.after(500, self.watch_printer)
+        else:
+            self.printer_watched = False
     
     def view_sale_details(self, tree):
         """View details of a selected sale"""
         selected = tree.focus()
-        if not selected:
-            return
-            
-        sale_date = tree.item(selected, 'values')[0]
         
-        # Skip if this is the summary row
-        if sale_date == "TOTAL":
+        # Skip if nothing or the summary row is selected
+        if not selected.isdigit():
             return
         
-        # Find the sale in history
-        sale = next((s for s in self.sales_history if s['date'] == sale_date), None)
+        # Look the sale up by the id stored in the row's iid
+        sale = self.sales_store.get(int(selected))
         if not sale:
             return
+        sale_date = sale['date']
             
         # Create details window
         details_window = tk.Toplevel(self.root)
-        details_window.title(f"Sale Details - {sale_date}")
+        details_window.title(f"Sale #{sale['id']} - {sale_date}")
         details_window.geometry("500x400")
         self.center_window(details_window)
         
+        # Reprint from the stored record, not the current sale inputs
+        button_frame = ttk.Frame(details_window)
+        button_frame.pack(side=tk.BOTTOM, pady=10)
+        
+        ttk.Button(button_frame, text="Reprint Receipt", style='Primary.TButton', 
+                  command=lambda: self.show_receipt_window(self.generate_receipt(sale))).pack(side=tk.LEFT, padx=10)
+        if self.sales_store.returnable(sale['id']):
+            def start_refund():
+                details_window.destroy()
+                self.refund_sale_window(sale)
+            
+            ttk.Button(button_frame, text="Refund / Return", style='Accent.TButton', 
+                      command=start_refund).pack(side=tk.LEFT, padx=10)
+        
         # Create text widget
         text = scrolledtext.ScrolledText(details_window, wrap=tk.WORD, 
                                        font=('Consolas', 10), padx=10, pady=10)
@@ -1345,7 +4853,12 @@ class ModernMedicalStore:
         
         # Format sale details
         details = []
-        details.append(f"Sale Date: {sale_date}")
+        details.append(f"Sale #: {sale['id']}")
+        if sale.get('type') == 'refund':
+            details.append(f"Refund of Sale #: {sale['refund_of']}")
+        details.append(f"Sale Date: {sale.get('timestamp', sale_date)}")
+        if 'cashier' in sale:
+            details.append(f"Cashier: {sale['cashier']}")
         if 'customer' in sale:
             details.append(f"Customer: {sale['customer']}")
         details.append("-"*50)
@@ -1359,13 +4872,151 @@ class ModernMedicalStore:
         
         details.append("-"*50)
         details.append(f"Gross Total: Pkr {sale['gross_total']:.2f}")
-        if 'discount' in sale and sale['discount'] > 0:
+        if sale.get('discount'):
             details.append(f"Discount: Pkr {sale['discount']:.2f}")
+        for line in sale.get('tax', ()):
+            details.append(f"{self.receipt_settings['tax_label']} {line['rate']:g}% on Pkr {line['taxable']:.2f}: "
+                           f"Pkr {line['amount']:.2f}")
         details.append(f"Net Total: Pkr {sale['total']:.2f}")
         
+        returned = self.sales_store.refunded.get(sale['id'])
+        if returned:
+            details.append("-"*50)
+            details.append("Returned: " + ", ".join(f"{name} ({qty})" for name, qty in returned.items()))
+        
         text.insert(tk.END, "\n".join(details))
         text.config(state='disabled')
     
+    def refund_sale_window(self, sale):
+        """Open a window to return some or all items of a stored sale"""
+        returnable = self.sales_store.returnable(sale['id'])
+        if not returnable:
+            messagebox.showwarning("Warning", "Nothing left to refund on this sale")
+            return
+        
+        refund_window = tk.Toplevel(self.root)
+        refund_window.title(f"Refund Sale #{sale['id']}")
+        refund_window.geometry("500x400")
+        self.center_window(refund_window)
+        
+        form_frame = ttk.Frame(refund_window, style='Card.TFrame')
+        form_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=20)
+        
+        ttk.Label(form_frame, text=f"Return items from Sale #{sale['id']} ({sale['date']})", 
+                 style='CardHeader.TLabel').pack(pady=(10, 20))
+        
+        # One quantity entry per returnable medicine
+        entries = {}
+        for name, qty in returnable.items():
+            row = ttk.Frame(form_frame)
+            row.pack(fill=tk.X, padx=20, pady=2)
+            ttk.Label(row, text=f"{name} (max {qty}):").pack(side=tk.LEFT)
+            entry = ttk.Entry(row, width=8)
+            entry.insert(0, "0")
+            entry.pack(side=tk.RIGHT)
+            entries[name] = entry
+        
+        def fill_all():
+            for name, entry in entries.items():
+                entry.delete(0, tk.END)
+                entry.insert(0, str(returnable[name]))
+        
+        def process():
+            try:
+                quantities = {name: int(entry.get() or 0) for name, entry in entries.items()}
+            except ValueError:
+                messagebox.showerror("Error", "Please enter valid quantities", parent=refund_window)
+                return
+            try:
+                refund = self.refund_sale(sale['id'], quantities)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e), parent=refund_window)
+                return
+            refund_window.destroy()
+            self.show_receipt_window(self.generate_receipt(refund))
+        
+        button_frame = ttk.Frame(form_frame)
+        button_frame.pack(pady=(20, 0))
+        
+        ttk.Button(button_frame, text="Return All", style='TButton', 
+                  command=fill_all).pack(side=tk.LEFT, padx=10)
+        ttk.Button(button_frame, text="Process Refund", style='Accent.TButton', 
+                  command=process).pack(side=tk.LEFT, padx=10)
+        ttk.Button(button_frame, text="Cancel", style='TButton', 
+                  command=refund_window.destroy).pack(side=tk.LEFT, padx=10)
+    
+    def refund_sale(self, sale_id, quantities):
+        """Return {medicine: qty} from a stored sale, restocking it and appending a negative ledger entry"""
+        sale = self.sales_store.get(sale_id)
+        if sale is None:
+            raise ValueError(f"Sale #{sale_id} not found")
+        
+        # Validate every line before touching stock so the refund is all-or-nothing
+        returnable = self.sales_store.returnable(sale_id)
+        quantities = {name: qty for name, qty in quantities.items() if qty}
+        if not quantities:
+            raise ValueError("Please enter a quantity to return")
+        for name, qty in quantities.items():
+            if qty < 0 or qty > returnable.get(name, 0):
+                raise ValueError(f"Cannot return {qty} of '{name}' (at most {returnable.get(name, 0)})")
+            if name not in self.medicines:
+                raise ValueError(f"'{name}' is no longer in inventory, so it cannot be restocked")
+        
+        # Price the returned lines as they were sold, with the same discount percent
+        items = []
+        for item in sale['items']:
+            qty = min(quantities.get(item['name'], 0), item['qty'])
+            if qty:
+                quantities[item['name']] -= qty
+                items.append({'name': item['name'], 'qty': -qty, 'price': item['price'],
+                              'tax_rate': item.get('tax_rate', 0.0),
+                              'batch': item.get('batch', self.medicines[item['name']]['batch'])})
+        
+        # Tax comes back at the rates charged on the sale (none for sales recorded before tax)
+        discount_percent = sale_discount_percent(sale)
+        by_rate = {}
+        for item in items:
+            by_rate[item['tax_rate']] = by_rate.get(item['tax_rate'], 0) + to_paisa(item['price']) * item['qty']
+        gross = sum(by_rate.values())
+        discount = percent_of(gross, discount_percent)
+        taxes = tax_lines(by_rate, discount_percent)
+        tax = sum(amount for _, _, amount in taxes)
+        now = datetime.datetime.now()
+        refund = {
+            'type': 'refund',
+            'refund_of': sale_id,
+            'date': now.strftime("%d-%m-%Y"),
+            'timestamp': now.strftime("%d-%m-%Y %H:%M:%S"),
+            'customer': sale.get('customer', 'Walk-in Customer'),
+            'cashier': self.receipt_settings["generator_name"],
+            'items': items,
+            'gross_total': to_rupees(gross),
+            'discount_percent': discount_percent,
+            'discount': to_rupees(discount),
+            'tax': tax_record(taxes),
+            'tax_total': to_rupees(tax),
+            'total': to_rupees(gross - discount + tax)
+        }
+        if sale.get('customer_id') is not None:
+            refund['customer_id'] = sale['customer_id']
+        
+        # Restock and record together; undo the restock if the ledger entry fails
+        restocked = []
+        try:
+            for item in items:
+                self.medicines[item['name']]['quantity'] -= item['qty']
+                restocked.append(item)
+            self.sales_store.add(refund)
+        except Exception:
+            for item in restocked:
+                self.medicines[item['name']]['quantity'] += item['qty']
+            raise
+        self.mark_dirty('medicines', names=[item['name'] for item in items])
+        self.publish('sales', [refund['id']])
+        
+        self.status_var.set(f"Refund of Pkr {-refund['total']:.2f} recorded for sale #{sale_id}")
+        return refund
+    
     def export_sales_history(self):
         """Export sales history to a file"""
         file_path = filedialog.asksaveasfilename(
@@ -1378,12 +5029,12 @@ class ModernMedicalStore:
             try:
                 with open(file_path, 'w') as f:
                     # Write header
-                    f.write("Date,Customer,Item,Quantity,Price,Gross Total,Discount,Net Total\n")
+                    f.write("Sale ID,Date,Customer,Item,Quantity,Price,Gross Total,Discount,Tax,Net Total\n")
                     
                     # Write data
                     for sale in self.sales_history:
                         for item in sale['items']:
-                            f.write(f"{sale['date']},{sale.get('customer', 'Walk-in')},{item['name']},{item['qty']},{item['price']},{sale['gross_total']},{sale.get('discount', 0)},{sale['total']}\n")
+                            f.write(f"{sale['id']},{sale['date']},{sale.get('customer', 'Walk-in')},{item['name']},{item['qty']},{item['price']},{sale['gross_total']},{sale.get('discount', 0)},{sale.get('tax_total', 0)},{sale['total']}\n")
                 
                 messagebox.showinfo("Success", f"Sales history exported to {file_path}")
                 self.status_var.set(f"Sales history exported to {file_path}")
@@ -1407,7 +5058,8 @@ class ModernMedicalStore:
         
         ttk.Label(report_frame, text="Report Type:").pack(side=tk.LEFT)
         self.report_type = tk.StringVar()
-        report_options = ['Inventory List', 'Low Stock', 'Expiring Soon', 'Empty Stocks', 'Sales Summary']
+        report_options = ['Inventory List', 'Low Stock', 'Expiring Soon', 'Empty Stocks', 'Sales Summary', 
+                          'Reorder Suggestions', 'Sales Analytics', 'Expiry Loss Forecast', 'Batch Recall']
         self.report_type.set(report_options[0])
         
         report_menu = ttk.OptionMenu(report_frame, self.report_type, *report_options)
@@ -1416,6 +5068,14 @@ class ModernMedicalStore:
         ttk.Button(report_frame, text="Generate", style='Primary.TButton', 
                   command=self.generate_report).pack(side=tk.LEFT, padx=5)
         
+        # Batch recall takes its batch number from here
+        ttk.Label(report_frame, text="Batch:").pack(side=tk.LEFT, padx=(15, 0))
+        self.recall_batch_entry = ttk.Entry(report_frame, width=15)
+        self.recall_batch_entry.pack(side=tk.LEFT, padx=5)
+        self.recall_batch_entry.bind('<Return>', lambda e: self.recall_batch())
+        ttk.Button(report_frame, text="Recall", style='TButton', 
+                  command=self.recall_batch).pack(side=tk.LEFT, padx=5)
+        
         # Button frame
         btn_frame = ttk.Frame(report_frame)
         btn_frame.pack(side=tk.RIGHT)
@@ -1424,6 +5084,10 @@ class ModernMedicalStore:
                   command=self.print_report).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="Export", style='TButton', 
                   command=self.export_report).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Export PDF", style='TButton', 
+                  command=self.export_report_pdf).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="All Reports PDF", style='TButton', 
+                  command=self.export_all_reports_pdf).pack(side=tk.LEFT, padx=5)
         
         # Report display area
         self.report_text = scrolledtext.ScrolledText(self.reports_frame, wrap=tk.WORD, 
@@ -1445,181 +5109,112 @@ class ModernMedicalStore:
             self.generate_empty_stock_report()
         elif report_type == "Sales Summary":
             self.generate_sales_summary_report()
+        elif report_type == "Reorder Suggestions":
+            self.generate_reorder_report()
+        elif report_type == "Sales Analytics":
+            self.generate_analytics_report()
+        elif report_type == "Expiry Loss Forecast":
+            self.generate_expiry_forecast_report()
+        elif report_type == "Batch Recall":
+            self.generate_recall_report()
     
     def generate_inventory_report(self):
         """Generate inventory list report"""
-        report = []
-        report.append("MEDICAL STORE INVENTORY REPORT".center(80))
-        report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
-        report.append("="*80)
-        report.append("{:<25} {:<15} {:<10} {:<10} {:<12} {:<10}".format(
-            "Medicine Name", "Company", "Price", "Quantity", "Expiry Date", "Batch No."))
-        report.append("-"*80)
-        
-        total_value = 0.0
-        for name, details in sorted(self.medicines.items()):
-            item_value = details['price'] * details['quantity']
-            total_value += item_value
-            report.append("{:<25} {:<15} {:<10.2f} {:<10} {:<12} {:<10}".format(
-                name[:25], details.get('company', 'All')[:15], details['price'], 
-                details['quantity'], details['expiry'], details['batch']))
-        
-        report.append("="*80)
-        report.append("TOTAL INVENTORY VALUE:".ljust(60) + f"PKR {total_value:.2f}".rjust(20))
-        report.append("="*80)
-        
-        self.report_text.insert(tk.END, "\n".join(report))
+        report, _ = build_inventory_report(self.medicines)
+        self.report_text.insert(tk.END, report)
         self.status_var.set("Inventory report generated")
     
     def generate_low_stock_report(self):
-        """Generate low stock report (quantity < 20)"""
-        report = []
-        report.append("LOW STOCK REPORT (Quantity < 20)".center(80))
-        report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
-        report.append("="*80)
-        report.append("{:<25} {:<15} {:<10} {:<10} {:<12} {:<10}".format(
-            "Medicine Name", "Company", "Price", "Quantity", "Expiry Date", "Batch No."))
-        report.append("-"*80)
-        
-        low_stock_items = 0
-        for name, details in sorted(self.medicines.items()):
-            if 0 < details['quantity'] < 20:
-                low_stock_items += 1
-                report.append("{:<25} {:<15} {:<10.2f} {:<10} {:<12} {:<10}".format(
-                    name[:25], details.get('company', 'All')[:15], details['price'], 
-                    details['quantity'], details['expiry'], details['batch']))
-        
-        if low_stock_items == 0:
-            report.append("No low stock items found (all items have quantity >= 20)".center(80))
-        
-        report.append("="*80)
-        report.append(f"Total low stock items: {low_stock_items}".center(80))
-        report.append("="*80)
-        
-        self.report_text.insert(tk.END, "\n".join(report))
+        """Generate low stock report (quantity below each item's threshold)"""
+        report, low_stock_items = build_low_stock_report(self.medicines, settings=self.receipt_settings, 
+                                                         index=self.stock_index)
+        self.report_text.insert(tk.END, report)
         self.status_var.set(f"Low stock report generated ({low_stock_items} items)")
     
     def generate_expiring_report(self):
-        """Generate report for medicines expiring soon (within 3 months)"""
-        report = []
-        report.append("EXPIRING SOON REPORT (within 3 months)".center(80))
-        report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
-        report.append("="*80)
-        report.append("{:<25} {:<15} {:<10} {:<10} {:<12} {:<10}".format(
-            "Medicine Name", "Company", "Price", "Quantity", "Expiry Date", "Batch No."))
-        report.append("-"*80)
-        
-        today = datetime.datetime.now().date()
-        expiring = 0
-        
-        for name, details in sorted(self.medicines.items()):
-            try:
-                expiry_date = datetime.datetime.strptime(details['expiry'], "%d-%m-%Y").date()
-                if (expiry_date - today).days <= 90:  # Within 3 months
-                    expiring += 1
-                    report.append("{:<25} {:<15} {:<10.2f} {:<10} {:<12} {:<10}".format(
-                        name[:25], details.get('company', 'All')[:15], details['price'], 
-                        details['quantity'], details['expiry'], details['batch']))
-            except ValueError:
-                continue
-        
-        if expiring == 0:
-            report.append("No expiring items found (all items expire after 3 months)".center(80))
-        
-        report.append("="*80)
-        report.append(f"Total expiring items: {expiring}".center(80))
-        report.append("="*80)
-        
-        self.report_text.insert(tk.END, "\n".join(report))
+        """Generate report for medicines expiring within the expiry window"""
+        report, expiring = build_expiring_report(self.medicines, settings=self.receipt_settings, 
+                                                 index=self.stock_index)
+        self.report_text.insert(tk.END, report)
         self.status_var.set(f"Expiring soon report generated ({expiring} items)")
     
     def generate_empty_stock_report(self):
         """Generate report for medicines with empty stock (quantity = 0)"""
-        report = []
-        report.append("EMPTY STOCK REPORT (Quantity = 0)".center(80))
-        report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
-        report.append("="*80)
-        report.append("{:<25} {:<15} {:<10} {:<12} {:<10}".format(
-            "Medicine Name", "Company", "Price", "Expiry Date", "Batch No."))
-        report.append("-"*80)
-        
-        empty_stock_items = 0
-        for name, details in sorted(self.medicines.items()):
-            if details['quantity'] == 0:
-                empty_stock_items += 1
-                report.append("{:<25} {:<15} {:<10.2f} {:<12} {:<10}".format(
-                    name[:25], details.get('company', 'All')[:15], details['price'], 
-                    details['expiry'], details['batch']))
-        
-        if empty_stock_items == 0:
-            report.append("No empty stock items found (all items have quantity > 0)".center(80))
-        
-        report.append("="*80)
-        report.append(f"Total empty stock items: {empty_stock_items}".center(80))
-        report.append("="*80)
-        
-        self.report_text.insert(tk.END, "\n".join(report))
+        report, empty_stock_items = build_empty_stock_report(self.medicines)
+        self.report_text.insert(tk.END, report)
         self.status_var.set(f"Empty stock report generated ({empty_stock_items} items)")
     
     def generate_sales_summary_report(self):
         """Generate sales summary report"""
-        report = []
-        report.append("SALES SUMMARY REPORT".center(80))
-        report.append(f"Generated on: {datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
-        report.append("="*80)
-        report.append("{:<12} {:<15} {:<10} {:<15} {:<15}".format(
-            "Date", "Transactions", "Items Sold", "Gross Total", "Net Total"))
-        report.append("-"*80)
-        
-        # Group sales by date
-        sales_by_date = {}
-        for sale in self.sales_history:
-            date = sale['date']
-            if date not in sales_by_date:
-                sales_by_date[date] = {
-                    'transactions': 0,
-                    'items_sold': 0,
-                    'gross_total': 0.0,
-                    'net_total': 0.0
-                }
-            
-            sales_by_date[date]['transactions'] += 1
-            sales_by_date[date]['items_sold'] += sum(item['qty'] for item in sale['items'])
-            sales_by_date[date]['gross_total'] += sale['gross_total']
-            sales_by_date[date]['net_total'] += sale['total']
-        
-        # Sort by date (newest first)
-        sorted_dates = sorted(sales_by_date.keys(), reverse=True)
-        
-        for date in sorted_dates:
-            data = sales_by_date[date]
-            report.append("{:<12} {:<15} {:<10} {:<15.2f} {:<15.2f}".format(
-                date, 
-                data['transactions'], 
-                data['items_sold'], 
-                data['gross_total'], 
-                data['net_total']
-            ))
-        
-        # Add totals
-        total_transactions = sum(data['transactions'] for data in sales_by_date.values())
-        total_items = sum(data['items_sold'] for data in sales_by_date.values())
-        total_gross = sum(data['gross_total'] for data in sales_by_date.values())
-        total_net = sum(data['net_total'] for data in sales_by_date.values())
-        
-        report.append("="*80)
-        report.append("{:<12} {:<15} {:<10} {:<15.2f} {<-15.2f}".format(
-                "TOTAL", 
-                total_transactions, 
-                total_items, 
-                total_gross, 
-                total_net
-            ))
-        report.append("="*80)
-        
-        self.report_text.insert(tk.END, "\n".join(report))
+        report, total_transactions = build_sales_summary_report(self.medicines, self.sales_history, 
+                                                                self.receipt_settings)
+        self.report_text.insert(tk.END, report)
         self.status_var.set(f"Sales summary report generated ({total_transactions} transactions)")
     
+    def generate_reorder_report(self):
+        """Generate purchase-order drafts for medicines selling faster than their stock covers"""
+        report, lines = build_reorder_report(self.medicines, self.sales_store)
+        self.report_text.insert(tk.END, report)
+        self.status_var.set(f"Reorder suggestions generated ({lines} lines)")
+    
+    def generate_analytics_report(self):
+        """Generate vectorized sales analytics from the cached sale-line columns"""
+        try:
+            analytics = self.sales_analytics()
+            analytics.sync(self.sales_history, self.medicines)
+        except ImportError:
+            messagebox.showerror("Error", "Sales analytics needs NumPy (pip install numpy)")
+            return
+        report, lines = build_analytics_report(self.medicines, self.sales_history, analytics=analytics)
+        self.report_text.insert(tk.END, report)
+        self.status_var.set(f"Sales analytics generated ({lines} sale lines)")
+    
+    def generate_expiry_forecast_report(self):
+        """Generate projected expiry losses with markdown or transfer suggestions"""
+        report, batches = build_expiry_forecast_report(self.medicines, self.sales_store)
+        self.report_text.insert(tk.END, report)
+        self.status_var.set(f"Expiry loss forecast generated ({batches} batches at risk)")
+    
+    def recall_batch(self):
+        """Run the batch recall report for the batch entered in the reports tab"""
+        self.report_type.set("Batch Recall")
+        self.generate_report()
+    
+    def generate_recall_report(self):
+        """Find every sale of a recalled batch from the batch index and offer to export the customers"""
+        batch = self.recall_batch_entry.get().strip()
+        if not batch:
+            self.status_var.set("Enter the recalled batch number next to Recall")
+            return
+        started = time.perf_counter()
+        recall = self.sales_store.recall(batch)
+        report, affected = build_recall_report(batch, recall, self.customers)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.report_text.insert(tk.END, report)
+        self.status_var.set(f"Recall of batch {batch}: {len(recall)} sale lines, "
+                            f"{affected} customers to contact ({elapsed:.1f} ms)")
+        
+        if affected and messagebox.askyesno("Batch Recall", f"Export the {affected} affected customers to CSV?"):
+            file_path = filedialog.asksaveasfilename(
+                defaultextension=".csv",
+                filetypes=[("CSV Files", "*.csv"), ("All Files", "*.*")],
+                initialfile=f"recall_{batch}.csv",
+                title="Save Affected Customers As"
+            )
+            if file_path:
+                try:
+                    export_recall_customers(file_path, batch, recall_customers(recall, self.customers))
+                    self.status_var.set(f"Affected customers exported to {file_path}")
+                except OSError as e:
+                    messagebox.showerror("Error", f"Could not save the file: {str(e)}")
+    
+    def sales_analytics(self):
+        """The active profile's analytics columns, cached on disk next to its autosave"""
+        directory = self.autosave_store.directory
+        if directory not in self.analytics_cache:
+            self.analytics_cache[directory] = SalesAnalytics(os.path.join(directory, "analytics"))
+        return self.analytics_cache[directory]
+    
     def print_report(self):
         """Print the current report"""
         report = self.report_text.get(1.0, tk.END)
@@ -1653,6 +5248,100 @@ class ModernMedicalStore:
                 messagebox.showerror("Error", "Could not save the file")
                 self.status_var.set("Error exporting report")
     
+    def export_report_pdf(self):
+        """Export the current report as a PDF file"""
+        report = self.report_text.get(1.0, tk.END)
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".pdf",
+            filetypes=[("PDF Files", "*.pdf"), ("All Files", "*.*")],
+            title="Save Report As PDF"
+        )
+        
+        if file_path:
+            try:
+                with open(file_path, 'wb') as f:
+                    f.write(text_to_pdf(report, self.report_type.get()))
+                messagebox.showinfo("Success", f"Report saved to {file_path}")
+                self.status_var.set(f"Report exported to {file_path}")
+            except Exception as e:
+                messagebox.showerror("Error", f"Could not save the file: {str(e)}")
+                self.status_var.set("Error exporting report")
+    
+    def export_all_reports_pdf(self):
+        """Render every report type to PDF files in a chosen folder"""
+        folder = filedialog.askdirectory(title="Select Folder for Report PDFs")
+        if not folder:
+            return
+        
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        data = ({name: dict(details) for name, details in self.medicines.items()}, list(self.sales_history),
+                copy_settings(self.receipt_settings))
+        names = list(REPORT_BUILDERS)
+        skipped = None
+        try:
+            import numpy
+        except ImportError:
+            # NumPy is optional; the other reports still export without it
+            names.remove('Sales Analytics')
+            skipped = "Sales Analytics skipped, needs NumPy"
+        jobs = [('report', name, data,
+                 os.path.join(folder, f"{name.lower().replace(' ', '_')}_{stamp}.pdf"))
+                for name in names]
+        self.run_pdf_export(jobs, "report", skipped)
+    
+    def export_receipts_pdf(self):
+        """Render a PDF receipt for every sale in the history into a chosen folder"""
+        if not self.sales_history:
+            messagebox.showwarning("Warning", "No sales to export")
+            return
+        
+        folder = filedialog.askdirectory(title="Select Folder for Receipt PDFs")
+        if not folder:
+            return
+        
+        settings = copy_settings(self.receipt_settings)
+        jobs = [('receipt', sale, settings,
+                 os.path.join(folder, f"receipt_{sale['id']:06d}_{sale['date']}.pdf"))
+                for sale in self.sales_history]
+        self.run_pdf_export(jobs, "receipt")
+    
+    def run_pdf_export(self, jobs, kind, note=None):
+        """Run PDF jobs in the background and report progress (and any note) in the status bar"""
+        self.status_var.set(f"Exporting {len(jobs)} {kind} PDFs...")
+        
+        def work():
+            return sum(1 for _ in export_pdfs(jobs))
+        
+        def done(count, error):
+            if error:
+                messagebox.showerror("Error", f"PDF export failed: {str(error)}")
+                self.status_var.set("Error exporting PDFs")
+            else:
+                self.status_var.set(f"Exported {count} {kind} PDFs" + (f" ({note})" if note else ""))
+        
+        self.run_in_background(work, done)
+    
+    def run_in_background(self, func, on_done, poll_ms=200):
+        """Run func on a worker thread and call on_done(result, error) back on the Tk thread"""
+        outcome = {}
+        
+        def target():
+            try:
+                outcome['result'] = func()
+            except Exception as e:
+                outcome['error'] = e
+        
+        worker = threading.Thread(target=target, daemon=True)
+        worker.start()
+        
+        def poll():
+            if worker.is_alive():
+                self.root.after(poll_ms, poll)
+            else:
+                on_done(outcome.get('result'), outcome.get('error'))
+        
+        self.root.after(poll_ms, poll)
+    
     def create_settings_tab(self):
         """Create the settings tab"""
         self.settings_frame = ttk.Frame(self.content)
@@ -1701,7 +5390,9 @@ class ModernMedicalStore:
             ("Generator Name:", "generator_name", self.receipt_settings["generator_name"]),
             ("Default Discount %:", "default_discount", self.receipt_settings["default_discount"]),
             ("Show Customer Name:", "show_customer_name", self.receipt_settings["show_customer_name"]),
-            ("Show Discount:", "show_discount", self.receipt_settings["show_discount"])
+            ("Show Discount:", "show_discount", self.receipt_settings["show_discount"]),
+            ("Quick Checkout (no receipt window):", "quick_checkout", self.receipt_settings["quick_checkout"]),
+            ("Auto-print Receipts:", "auto_print_receipts", self.receipt_settings["auto_print_receipts"])
         ]
         
         self.settings_entries = {}
@@ -1722,6 +5413,93 @@ class ModernMedicalStore:
                 entry.pack(side=tk.RIGHT, fill=tk.X, expand=True)
                 self.settings_entries[name] = entry
         
+        # Stock Alerts Tab
+        stock_tab = ttk.Frame(notebook)
+        notebook.add(stock_tab, text="Stock Alerts")
+        
+        ttk.Label(stock_tab, text="Stock Alerts", style='CardHeader.TLabel').pack(anchor='w', pady=(10, 5))
+        
+        stock_fields = [
+            ("Low-Stock Threshold (units):", "low_stock_threshold"),
+            ("Expiry Window (days):", "expiry_window_days"),
+            ("Sales Summary Window (days, 0 = all):", "sales_window_days")
+        ]
+        self.stock_entries = {}
+        for label, name in stock_fields:
+            frame = ttk.Frame(stock_tab)
+            frame.pack(fill=tk.X, padx=5, pady=2)
+            
+            ttk.Label(frame, text=label).pack(side=tk.LEFT)
+            entry = ttk.Entry(frame)
+            entry.insert(0, str(self.receipt_settings[name]))
+            entry.pack(side=tk.RIGHT, fill=tk.X, expand=True)
+            self.stock_entries[name] = entry
+        
+        # Per-company thresholds override the store default
+        ttk.Label(stock_tab, text="Company Thresholds", style='CardHeader.TLabel').pack(anchor='w', pady=(15, 5))
+        
+        company_frame = ttk.Frame(stock_tab)
+        company_frame.pack(fill=tk.X, padx=5, pady=2)
+        
+        ttk.Label(company_frame, text="Company:").pack(side=tk.LEFT)
+        self.threshold_company_var = tk.StringVar()
+        self.threshold_company_combo = ttk.Combobox(company_frame, textvariable=self.threshold_company_var, width=25)
+        self.threshold_company_combo.pack(side=tk.LEFT, padx=5)
+        ttk.Label(company_frame, text="Threshold:").pack(side=tk.LEFT)
+        self.company_threshold_entry = ttk.Entry(company_frame, width=8)
+        self.company_threshold_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Button(company_frame, text="Set", style='Primary.TButton', 
+                  command=self.set_company_threshold).pack(side=tk.LEFT, padx=5)
+        ttk.Button(company_frame, text="Clear", style='TButton', 
+                  command=self.clear_company_threshold).pack(side=tk.LEFT, padx=5)
+        
+        self.company_thresholds_list = tk.Listbox(stock_tab, height=6)
+        self.company_thresholds_list.pack(fill=tk.X, padx=5, pady=5)
+        self.refresh_company_thresholds()
+        
+        # Tax Tab
+        tax_tab = ttk.Frame(notebook)
+        notebook.add(tax_tab, text="Tax")
+        
+        ttk.Label(tax_tab, text="Tax", style='CardHeader.TLabel').pack(anchor='w', pady=(10, 5))
+        
+        tax_fields = [
+            ("Tax Name on Receipts:", "tax_label"),
+            ("Store Tax Rate (%):", "tax_rate")
+        ]
+        self.tax_entries = {}
+        for label, name in tax_fields:
+            frame = ttk.Frame(tax_tab)
+            frame.pack(fill=tk.X, padx=5, pady=2)
+            
+            ttk.Label(frame, text=label).pack(side=tk.LEFT)
+            entry = ttk.Entry(frame)
+            entry.insert(0, str(self.receipt_settings[name]))
+            entry.pack(side=tk.RIGHT, fill=tk.X, expand=True)
+            self.tax_entries[name] = entry
+        
+        # Per-company rates override the store rate; a medicine's own rate overrides both
+        ttk.Label(tax_tab, text="Company Tax Rates (0 = exempt)", style='CardHeader.TLabel').pack(anchor='w', pady=(15, 5))
+        
+        company_frame = ttk.Frame(tax_tab)
+        company_frame.pack(fill=tk.X, padx=5, pady=2)
+        
+        ttk.Label(company_frame, text="Company:").pack(side=tk.LEFT)
+        self.tax_company_var = tk.StringVar()
+        self.tax_company_combo = ttk.Combobox(company_frame, textvariable=self.tax_company_var, width=25)
+        self.tax_company_combo.pack(side=tk.LEFT, padx=5)
+        ttk.Label(company_frame, text="Rate %:").pack(side=tk.LEFT)
+        self.company_tax_entry = ttk.Entry(company_frame, width=8)
+        self.company_tax_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Button(company_frame, text="Set", style='Primary.TButton', 
+                  command=self.set_company_tax_rate).pack(side=tk.LEFT, padx=5)
+        ttk.Button(company_frame, text="Clear", style='TButton', 
+                  command=self.clear_company_tax_rate).pack(side=tk.LEFT, padx=5)
+        
+        self.company_tax_list = tk.Listbox(tax_tab, height=6)
+        self.company_tax_list.pack(fill=tk.X, padx=5, pady=5)
+        self.refresh_company_tax_rates()
+        
         # Data Management Tab
         data_tab = ttk.Frame(notebook)
         notebook.add(data_tab, text="Data Management")
@@ -1737,6 +5515,8 @@ class ModernMedicalStore:
         ttk.Button(btn_frame, text="Load Data", style='TButton', 
                   command=self.load_data).pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         
+        ttk.Label(data_tab, text=f"Data folder: {self.profiles.data_dir}").pack(anchor='w', pady=5)
+        
         # Save button for settings
         btn_frame = ttk.Frame(self.settings_frame)
         btn_frame.pack(fill=tk.X, pady=5)
@@ -1744,25 +5524,269 @@ class ModernMedicalStore:
         ttk.Button(btn_frame, text="Save Settings", style='Primary.TButton', 
                   command=self.save_settings).pack(side=tk.RIGHT, padx=5)
     
-    def save_data(self):
-        """Save all application data to a file"""
-        data = {
+    def collect_data(self):
+        """Gather all persisted application state"""
+        return {
             'medicines': self.medicines,
+            'customers': self.customers.records(),
             'sales_history': self.sales_history,
             'receipt_settings': self.receipt_settings,
             'today_sales': self.today_sales_var.get()
         }
+    
+    def apply_data(self, data, autosaved=False):
+        """Replace application state with loaded data and refresh the UI.
+        
+        autosaved means the data came from the autosave store itself, so it is
+        already on disk and the next autosave has nothing to write.
+        """
+        replaced = list(self.medicines)
+        self.medicines = data.get('medicines', {})
+        self.customers = CustomerRegistry(data.get('customers', []))
+        self.sales_history = data.get('sales_history', [])
+        self.receipt_settings = app_settings(data.get('receipt_settings', self.receipt_settings))
+        self.today_sales_var.set(data.get('today_sales', "Pkr 0.00"))
+        self.stock_index = StockIndex(self.medicines, self.receipt_settings)
+        self.mark_dirty('medicines', 'customers', 'settings', 'sales', names=replaced + list(self.medicines))
+        if autosaved:
+            self.changed_medicines = {}
+            self.saved_versions = dict(self.versions, today_sales=self.today_sales_var.get(),
+                                       sales_count=len(self.sales_history), 
+                                       outbox_sales=len(self.sales_history))
+        else:
+            # The outbox already sent the replaced sales; reset the branch centrally and resend all
+            # (after any running autosave, which would otherwise overwrite this when it finishes)
+            if self.autosave_thread is not None:
+                self.autosave_thread.join()
+            self.saved_versions = dict(self.saved_versions, outbox_sales=0, outbox_reset=True)
+        self.refresh_views()
+    
+    def refresh_views(self):
+        """Redraw every view and settings field from the current state"""
+        # A full redraw covers any queued medicine, sales or settings events
+        for topic in ('medicines', 'sales', 'settings'):
+            self.pending_changes.pop(topic, None)
+        self.update_dashboard()
+        if 'inventory' in self.tabs:
+            self.refresh_inventory()
+        if 'sales' in self.tabs:
+            self.refresh_sales_list()
+            self.discount_entry.delete(0, tk.END)
+            self.discount_entry.insert(0, str(self.receipt_settings["default_discount"]))
+            self.update_cart_totals()
+        if 'settings' in self.tabs:
+            self.refresh_settings_fields()
+    
+    def refresh_settings_fields(self):
+        """Show the current settings in the settings tab"""
+        self.store_name_entry.delete(0, tk.END)
+        self.store_name_entry.insert(0, self.receipt_settings["header_text"])
+        self.address_entry.delete(0, tk.END)
+        self.address_entry.insert(0, self.receipt_settings["address"])
+        self.phone_entry.delete(0, tk.END)
+        self.phone_entry.insert(0, self.receipt_settings["phone"])
+        for name, entry in self.settings_entries.items():
+            if isinstance(entry, tk.BooleanVar):
+                entry.set(self.receipt_settings[name])
+            else:
+                entry.delete(0, tk.END)
+                entry.insert(0, str(self.receipt_settings[name]))
+        for name, entry in self.stock_entries.items():
+            entry.delete(0, tk.END)
+            entry.insert(0, str(self.receipt_settings[name]))
+        for name, entry in self.tax_entries.items():
+            entry.delete(0, tk.END)
+            entry.insert(0, str(self.receipt_settings[name]))
+        self.refresh_company_thresholds()
+        self.refresh_company_tax_rates()
+    
+    def refresh_company_thresholds(self):
+        """List company threshold overrides and offer every known company"""
+        thresholds = self.receipt_settings['company_thresholds']
+        self.threshold_company_combo['values'] = sorted(set(self.stock_index.by_company) | set(thresholds))
+        self.company_thresholds_list.delete(0, tk.END)
+        for company, threshold in sorted(thresholds.items()):
+            self.company_thresholds_list.insert(tk.END, f"{company or '(no company)'}: {threshold} units")
+    
+    def set_company_threshold(self):
+        """Override the low-stock threshold for one company"""
+        company = self.threshold_company_var.get().strip()
+        try:
+            threshold = int(self.company_threshold_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a whole number of units")
+            return
+        self.receipt_settings['company_thresholds'][company] = threshold
+        self.mark_dirty('settings')
+        count = self.stock_index.rethreshold(company)
+        self.refresh_company_thresholds()
+        self.status_var.set(f"Low-stock threshold for {company or '(no company)'} set to {threshold} ({count} items)")
+    
+    def clear_company_threshold(self):
+        """Drop a company override so its medicines fall back to the store default"""
+        company = self.threshold_company_var.get().strip()
+        if self.receipt_settings['company_thresholds'].pop(company, None) is None:
+            return
+        self.mark_dirty('settings')
+        self.stock_index.rethreshold(company)
+        self.refresh_company_thresholds()
+        self.status_var.set(f"Low-stock threshold for {company or '(no company)'} cleared")
+    
+    def refresh_company_tax_rates(self):
+        """List company tax rates and offer every known company"""
+        rates = self.receipt_settings['company_tax_rates']
+        self.tax_company_combo['values'] = sorted(set(self.stock_index.by_company) | set(rates))
+        self.company_tax_list.delete(0, tk.END)
+        for company, rate in sorted(rates.items()):
+            label = f"{rate:g}%" if rate else "exempt"
+            self.company_tax_list.insert(tk.END, f"{company or '(no company)'}: {label}")
+    
+    def set_company_tax_rate(self):
+        """Set the tax rate for one company's medicines (0 exempts them)"""
+        company = self.tax_company_var.get().strip()
+        try:
+            rate = float(self.company_tax_entry.get())
+            if rate < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a tax rate of 0% or more")
+            return
+        self.receipt_settings['company_tax_rates'][company] = rate
+        self.mark_dirty('settings')
+        count = self.stock_index.retax(company)
+        self.refresh_company_tax_rates()
+        self.status_var.set(f"Tax rate for {company or '(no company)'} set to {rate:g}% ({count} items)")
+    
+    def clear_company_tax_rate(self):
+        """Drop a company rate so its medicines fall back to the store rate"""
+        company = self.tax_company_var.get().strip()
+        if self.receipt_settings['company_tax_rates'].pop(company, None) is None:
+            return
+        self.mark_dirty('settings')
+        self.stock_index.retax(company)
+        self.refresh_company_tax_rates()
+        self.status_var.set(f"Tax rate for {company or '(no company)'} cleared")
+    
+    def profile_names(self):
+        names = self.profiles.names()
+        return names if self.profile in names else sorted(names + [self.profile])
+    
+    def capture_profile(self):
+        """The active profile's state, to park in the profile cache"""
+        return {
+            'medicines': self.medicines,
+            'customers': self.customers,
+            'sales_store': self.sales_store,
+            'receipt_settings': self.receipt_settings,
+            'today_sales': self.today_sales_var.get(),
+            'versions': self.versions,
+            'saved_versions': self.saved_versions,
+            'changed_medicines': self.changed_medicines,
+            'stock_index': self.stock_index,
+            'autosave_store': self.autosave_store
+        }
+    
+    def open_profile(self, name):
+        """Load a profile from its autosave store and build its indexes; a new profile starts empty"""
+        store = SegmentedStore(self.profiles.path(name))
+        versions = {'medicines': 0, 'customers': 0, 'settings': 0, 'sales': 0}
+        if store.exists():
+            data = store.load()
+            saved_versions = dict(versions, today_sales=data['today_sales'], 
+                                  sales_count=len(data['sales_history']),
+                                  outbox_sales=len(data['sales_history']))
+        else:
+            # Receipt layout carries over from the current store until edited
+            data = {'medicines': {}, 'customers': [], 'sales_history': [], 
+                    'receipt_settings': copy_settings(self.receipt_settings), 'today_sales': "Pkr 0.00"}
+            saved_versions = {'medicines': -1, 'customers': -1, 'settings': -1, 'sales': -1, 
+                              'today_sales': None, 'sales_count': 0, 'outbox_sales': 0}
+        receipt_settings = app_settings(data['receipt_settings'])
+        return {
+            'medicines': data['medicines'],
+            'customers': CustomerRegistry(data['customers']),
+            'sales_store': SalesStore(data['sales_history']),
+            'receipt_settings': receipt_settings,
+            'today_sales': data['today_sales'],
+            'versions': versions,
+            'saved_versions': saved_versions,
+            'changed_medicines': {},
+            'stock_index': StockIndex(data['medicines'], receipt_settings),
+            'autosave_store': store
+        }
+    
+    def switch_profile(self, name):
+        """Make another store profile active without restarting; recently used ones come from cache"""
+        if name == self.profile:
+            return
+        if self.cart:
+            messagebox.showwarning("Warning", "Complete or clear the current sale before switching stores")
+            self.profile_var.set(self.profile)
+            return
+        
+        try:
+            # Write the outgoing profile first, so cached profiles are always saved and can be dropped
+            self.flush_autosave()
+            state = self.profile_cache.pop(name, None) or self.open_profile(name)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not switch to '{name}': {str(e)}")
+            self.profile_var.set(self.profile)
+            return
+        
+        self.profile_cache[self.profile] = self.capture_profile()
+        while len(self.profile_cache) > PROFILE_CACHE_SIZE:
+            self.profile_cache.popitem(last=False)
+        
+        self.profile = name
+        self.medicines = state['medicines']
+        self.customers = state['customers']
+        self.sales_store = state['sales_store']
+        self.receipt_settings = state['receipt_settings']
+        self.today_sales_var.set(state['today_sales'])
+        self.versions = state['versions']
+        self.saved_versions = state['saved_versions']
+        self.changed_medicines = state['changed_medicines']
+        self.stock_index = state['stock_index']
+        self.autosave_store = state['autosave_store']
+        
+        self.profile_var.set(name)
+        self.root.title(f"PharmaCare - Medical Store Management [{name}]")
+        self.refresh_views()
+        try:
+            self.profiles.set_active(name)
+        except OSError as e:
+            print(f"Could not remember active store: {str(e)}")
+        self.status_var.set(f"Switched to store '{name}'")
+    
+    def new_profile(self):
+        """Create a store profile and switch to it"""
+        name = simpledialog.askstring("New Store", "Store name:", parent=self.root)
+        if name is None:
+            return
+        name = name.strip()
+        if name in self.profile_names():
+            messagebox.showerror("Error", f"Store '{name}' already exists")
+            return
+        try:
+            self.profiles.create(name)
+        except (ValueError, OSError) as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.switch_profile(name)
+    
+    def save_data(self):
+        """Save all application data to a file"""
+        data = self.collect_data()
         
         file_path = filedialog.asksaveasfilename(
-            defaultextension=".pkl",
-            filetypes=[("Medical Store Data", "*.pkl"), ("All Files", "*.*")],
+            defaultextension=SNAPSHOT_EXTENSION,
+            filetypes=[("Medical Store Data", f"*{SNAPSHOT_EXTENSION}"), ("All Files", "*.*")],
             title="Save Medical Store Data"
         )
         
         if file_path:
             try:
-                with open(file_path, 'wb') as f:
-                    pickle.dump(data, f)
+                save_snapshot(file_path, data)
                 messagebox.showinfo("Success", f"Data saved successfully to {file_path}")
                 self.status_var.set(f"Data saved to {file_path}")
             except Exception as e:
@@ -1770,34 +5794,15 @@ class ModernMedicalStore:
                 self.status_var.set("Error saving data")
     
     def load_data(self):
-        """Load application data from a file"""
+        """Load application data from a file (older .pkl saves are read safely and converted)"""
         file_path = filedialog.askopenfilename(
-            filetypes=[("Medical Store Data", "*.pkl"), ("All Files", "*.*")],
+            filetypes=[("Medical Store Data", f"*{SNAPSHOT_EXTENSION} *.pkl"), ("All Files", "*.*")],
             title="Open Medical Store Data"
         )
         
         if file_path:
             try:
-                with open(file_path, 'rb') as f:
-                    data = pickle.load(f)
-                
-                self.medicines = data.get('medicines', {})
-                self.sales_history = data.get('sales_history', [])
-                self.receipt_settings = data.get('receipt_settings', self.receipt_settings)
-                self.today_sales_var.set(data.get('today_sales', "Pkr 0.00"))
-                
-                # Update UI
-                self.refresh_inventory()
-                self.refresh_sales_list()
-                self.update_dashboard()
-                
-                # Update settings UI
-                self.store_name_entry.delete(0, tk.END)
-                self.store_name_entry.insert(0, self.receipt_settings["header_text"])
-                self.address_entry.delete(0, tk.END)
-                self.address_entry.insert(0, self.receipt_settings["address"])
-                self.phone_entry.delete(0, tk.END)
-                self.phone_entry.insert(0, self.receipt_settings["phone"])
+                self.apply_data(load_store_file(file_path))
                 
                 messagebox.showinfo("Success", f"Data loaded successfully from {file_path}")
                 self.status_var.set(f"Data loaded from {file_path}")
@@ -1805,82 +5810,231 @@ class ModernMedicalStore:
                 messagebox.showerror("Error", f"Could not load data: {str(e)}")
                 self.status_var.set("Error loading data")
     
+    def mark_dirty(self, *partitions, names=()):
+        """Record that partitions ('medicines', 'customers', 'settings', 'sales') and medicines by name changed"""
+        for partition in partitions:
+            self.versions[partition] += 1
+        for name in names:
+            self.changed_medicines[name] = self.versions['medicines']
+            self.stock_index.update(name)
+        if names:
+            self.publish('medicines', names)
+        if 'settings' in partitions:
+            self.publish('settings')
+    
+    def subscribe(self, topic, callback):
+        """Have callback(keys) called with the keys changed under topic, once per idle cycle"""
+        self.subscribers.setdefault(topic, []).append(callback)
+    
+    def publish(self, topic, keys=()):
+        """Queue a change event; events are coalesced until Tk is next idle"""
+        self.pending_changes.setdefault(topic, set()).update(keys)
+        if not self.changes_scheduled:
+            self.changes_scheduled = True
+            self.root.after_idle(self.deliver_changes)
+    
+    def deliver_changes(self):
+        """Hand each subscriber the union of its topics' changed keys, calling it once"""
+        pending, self.pending_changes = self.pending_changes, {}
+        self.changes_scheduled = False
+        calls = {}
+        for topic, keys in pending.items():
+            for callback in self.subscribers.get(topic, ()):
+                calls.setdefault(callback, set()).update(keys)
+        for callback, keys in calls.items():
+            callback(keys)
+    
+    def autosave_changes(self):
+        """Copy only the partitions changed since the last autosave, with the versions they represent.
+        
+        Runs on the Tk thread; new sales are appended to the log rather than rewritten,
+        so the cost follows what changed rather than the size of the store.
+        """
+        saved = self.saved_versions
+        changes = {}
+        
+        if self.versions['medicines'] != saved['medicines']:
+            changes['medicines'] = {name: dict(details) for name, details in self.medicines.items()}
+        
+        if self.versions['customers'] != saved['customers']:
+            changes['customers'] = self.customers.records()
+        
+        today_sales = self.today_sales_var.get()
+        if self.versions['settings'] != saved['settings'] or today_sales != saved['today_sales']:
+            changes['settings'] = {'receipt_settings': copy_settings(self.receipt_settings),
+                                   'today_sales': today_sales}
+        
+        # Sale records are never modified once stored, so only the tail past the last save is new
+        sales = self.sales_history
+        if (self.versions['sales'] != saved['sales'] 
+                or self.autosave_store.sales_log.frames >= SegmentedStore.COMPACT_AFTER_FRAMES):
+            changes['sales_rewrite'] = list(sales)
+        elif len(sales) > saved['sales_count']:
+            changes['sales_append'] = sales[saved['sales_count']:]
+            changes['sales_start'] = saved['sales_count']
+        
+        # Replication outbox: medicines changed since the last save and sales not yet sent;
+        # a store without an outbox yet sends all of its data once as a baseline, and one
+        # that loaded a data file resets its branch centrally first
+        self.changed_medicines = {name: version for name, version in self.changed_medicines.items()
+                                  if version > saved['medicines']}
+        reset = saved.get('outbox_reset', False)
+        if self.autosave_store.outbox.exists() and not reset:
+            names = sorted(self.changed_medicines)
+            sent = saved['outbox_sales']
+        else:
+            names = sorted(self.medicines)
+            sent = 0
+        outbox = [{'op': 'reset'}] if reset else []
+        outbox.extend({'op': 'upsert', 'name': name, 'medicine': dict(self.medicines[name])} 
+                      if name in self.medicines else {'op': 'delete', 'name': name} for name in names)
+        outbox.extend({'op': 'sale', 'sale': sale} for sale in sales[sent:])
+        if outbox:
+            changes['outbox'] = outbox
+        
+        versions = dict(self.versions, today_sales=today_sales, sales_count=len(sales), 
+                        outbox_sales=len(sales))
+        return changes, versions
+    
     def auto_save_data(self):
-        """Auto-save data to a default location"""
+        """Auto-save changed partitions in the background every 5 minutes"""
         try:
-            data = {
-                'medicines': self.medicines,
-                'sales_history': self.sales_history,
-                'receipt_settings': self.receipt_settings,
-                'today_sales': self.today_sales_var.get()
-            }
-            
-            # Save to a default location in temp directory
-            save_path = os.path.join(tempfile.gettempdir(), "pharmacare_autosave.pkl")
-            
-            with open(save_path, 'wb') as f:
-                pickle.dump(data, f)
-            
-            # Schedule the next auto-save
-            self.root.after(300000, self.auto_save_data)  # Auto-save every 5 minutes
+            # Skip this round if the previous write is still running
+            if self.autosave_thread is None or not self.autosave_thread.is_alive():
+                changes, versions = self.autosave_changes()
+                if changes:  # nothing changed means no I/O at all
+                    self.autosave_thread = threading.Thread(target=self.write_autosave, 
+                                                            args=(changes, versions), daemon=True)
+                    self.autosave_thread.start()
+        except Exception as e:
+            print(f"Auto-save failed: {str(e)}")
+        
+        # Schedule the next auto-save
+        self.root.after(300000, self.auto_save_data)  # Auto-save every 5 minutes
+    
+    def write_autosave(self, changes, versions):
+        """Write changed partitions (runs on the autosave thread); a failed write is retried next round"""
+        try:
+            self.autosave_store.save(changes)
+            self.saved_versions = versions
         except Exception as e:
             print(f"Auto-save failed: {str(e)}")
     
+    def flush_autosave(self):
+        """Finish any background autosave, then write whatever changed since synchronously"""
+        if self.autosave_thread is not None:
+            self.autosave_thread.join()
+        changes, versions = self.autosave_changes()
+        if changes:
+            self.autosave_store.save(changes)
+            self.saved_versions = versions
+    
     def try_auto_load(self):
-        """Try to auto-load data from default location"""
+        """Auto-load the active profile; on first run, migrate an autosave left in the temp folder"""
+        self.root.title(f"PharmaCare - Medical Store Management [{self.profile}]")
+        if self.autosave_store.exists():
+            try:
+                self.apply_data(self.autosave_store.load(), autosaved=True)
+                self.status_var.set(f"Auto-loaded store '{self.profile}'")
+            except Exception as e:
+                print(f"Auto-load of {self.autosave_store.directory} failed: {str(e)}")
+                # Autosaving over an unreadable store would replace its sales log, so keep it aside
+                try:
+                    aside = self.autosave_store.set_aside()
+                    self.autosave_store = SegmentedStore(self.autosave_store.directory)
+                    self.status_var.set(f"Store '{self.profile}' could not be loaded; its files were kept in {aside}")
+                except OSError as e:
+                    print(f"Could not set aside {self.autosave_store.directory}: {str(e)}")
+                    self.autosave_store.read_only = True
+                    self.status_var.set(f"Store '{self.profile}' could not be loaded; autosave is off")
+            return
+        if self.profiles.names():
+            return
+        
+        data = None
+        temp_store = SegmentedStore(AUTOSAVE_DIR)
+        if temp_store.exists():
+            try:
+                data = temp_store.load()
+            except Exception as e:
+                print(f"Auto-load of {AUTOSAVE_DIR} failed: {str(e)}")
+        
+        # Fall back through older generations if the newest one is missing or damaged
+        if data is None:
+            for path in generation_paths(AUTOSAVE_PATH, AUTOSAVE_GENERATIONS):
+                if not os.path.exists(path):
+                    continue
+                try:
+                    data = load_snapshot(path)
+                    break
+                except Exception as e:
+                    print(f"Auto-load of {path} failed: {str(e)}")
+        
         try:
-            save_path = os.path.join(tempfile.gettempdir(), "pharmacare_autosave.pkl")
-            if os.path.exists(save_path):
-                with open(save_path, 'rb') as f:
-                    data = pickle.load(f)
-                
-                self.medicines = data.get('medicines', {})
-                self.sales_history = data.get('sales_history', [])
-                self.receipt_settings = data.get('receipt_settings', self.receipt_settings)
-                self.today_sales_var.set(data.get('today_sales', "Pkr 0.00"))
-                
-                # Update UI
-                self.refresh_inventory()
-                self.refresh_sales_list()
-                self.update_dashboard()
-                
-                # Update settings UI
-                self.store_name_entry.delete(0, tk.END)
-                self.store_name_entry.insert(0, self.receipt_settings["header_text"])
-                self.address_entry.delete(0, tk.END)
-                self.address_entry.insert(0, self.receipt_settings["address"])
-                self.phone_entry.delete(0, tk.END)
-                self.phone_entry.insert(0, self.receipt_settings["phone"])
-                
-                self.status_var.set("Auto-loaded previous session data")
+            if data is None and os.path.exists(LEGACY_AUTOSAVE_PATH):
+                data = load_legacy_pickle(LEGACY_AUTOSAVE_PATH)
+            if data is None:
+                return
+            
+            # Everything is marked changed, so the next autosave writes it into the profile
+            self.apply_data(data)
+            self.status_var.set(f"Imported previous session data into store '{self.profile}'")
         except Exception as e:
             print(f"Auto-load failed: {str(e)}")
     
     def save_settings(self):
         """Save system settings"""
+        # Parse every number first, so an invalid entry leaves all settings as they were
         try:
-            self.receipt_settings["header_text"] = self.store_name_entry.get()
-            self.receipt_settings["address"] = self.address_entry.get()
-            self.receipt_settings["phone"] = self.phone_entry.get()
-            
-            self.receipt_settings["footer_text"] = self.settings_entries["footer_text"].get()
-            self.receipt_settings["receipt_width"] = int(self.settings_entries["receipt_width"].get())
-            self.receipt_settings["generator_name"] = self.settings_entries["generator_name"].get()
-            self.receipt_settings["default_discount"] = float(self.settings_entries["default_discount"].get())
-            
-            # Handle boolean values
-            if isinstance(self.settings_entries["show_customer_name"], tk.BooleanVar):
-                self.receipt_settings["show_customer_name"] = self.settings_entries["show_customer_name"].get()
-                self.receipt_settings["show_discount"] = self.settings_entries["show_discount"].get()
-            
-            # Update discount entry in sales tab
-            self.discount_entry.delete(0, tk.END)
-            self.discount_entry.insert(0, str(self.receipt_settings["default_discount"]))
-            
-            messagebox.showinfo("Success", "Settings saved successfully")
-            self.status_var.set("Settings updated")
+            receipt_width = int(self.settings_entries["receipt_width"].get())
+            default_discount = float(self.settings_entries["default_discount"].get())
+            stock = {key: int(self.stock_entries[key].get()) 
+                     for key in ("low_stock_threshold", "expiry_window_days", "sales_window_days")}
+            tax_rate = float(self.tax_entries["tax_rate"].get())
+            if tax_rate < 0:
+                raise ValueError("tax rate cannot be negative")
         except ValueError as e:
             messagebox.showerror("Error", f"Invalid input: {str(e)}")
+            return
+        
+        self.receipt_settings["header_text"] = self.store_name_entry.get()
+        self.receipt_settings["address"] = self.address_entry.get()
+        self.receipt_settings["phone"] = self.phone_entry.get()
+        
+        self.receipt_settings["footer_text"] = self.settings_entries["footer_text"].get()
+        self.receipt_settings["receipt_width"] = receipt_width
+        self.receipt_settings["generator_name"] = self.settings_entries["generator_name"].get()
+        self.receipt_settings["default_discount"] = default_discount
+        
+        # Handle boolean values
+        if isinstance(self.settings_entries["show_customer_name"], tk.BooleanVar):
+            self.receipt_settings["show_customer_name"] = self.settings_entries["show_customer_name"].get()
+            self.receipt_settings["show_discount"] = self.settings_entries["show_discount"].get()
+            self.receipt_settings["quick_checkout"] = self.settings_entries["quick_checkout"].get()
+            self.receipt_settings["auto_print_receipts"] = self.settings_entries["auto_print_receipts"].get()
+        
+        # Stock alerts; only a new default threshold needs the low-stock index reclassified
+        old_threshold = self.receipt_settings["low_stock_threshold"]
+        self.receipt_settings.update(stock)
+        if self.receipt_settings["low_stock_threshold"] != old_threshold:
+            self.stock_index.rethreshold()
+        
+        # Tax; a new store rate recompiles the rates of medicines that use it
+        old_rate = self.receipt_settings["tax_rate"]
+        self.receipt_settings["tax_label"] = self.tax_entries["tax_label"].get().strip() or "Tax"
+        self.receipt_settings["tax_rate"] = tax_rate
+        if tax_rate != old_rate:
+            self.stock_index.retax()
+        self.mark_dirty('settings')
+        
+        # Update discount entry in sales tab
+        if 'sales' in self.tabs:
+            self.discount_entry.delete(0, tk.END)
+            self.discount_entry.insert(0, str(self.receipt_settings["default_discount"]))
+            self.update_cart_totals()
+        
+        messagebox.showinfo("Success", "Settings saved successfully")
+        self.status_var.set("Settings updated")
     
     def center_window(self, window):
         """Center a window on screen"""
@@ -1892,27 +6046,104 @@ class ModernMedicalStore:
         window.geometry(f'{width}x{height}+{x}+{y}')
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PharmaCare - Medical Store Management")
+    parser.add_argument('--bench-snapshot', type=int, nargs='?', const=100000, metavar='SALES',
+                        help="benchmark snapshot vs pickle load time and size, then exit")
+    parser.add_argument('--bench-analytics', type=int, nargs='?', const=2000000, metavar='LINES',
+                        help="time the sales analytics queries on a synthetic ledger, then exit")
+    parser.add_argument('--bench-startup', type=int, nargs='?', const=20000, metavar='MEDICINES',
+                        help="time a cold start against the startup budget on a synthetic store, then exit")
+    parser.add_argument('--scanner', metavar='PORT', help="read barcode scans from a serial scanner (needs pyserial)")
+    parser.add_argument('--simulate-scans', metavar='FILE', 
+                        help="replay barcodes from FILE (one per line) as a simulated scanner")
+    parser.add_argument('--scan-interval', type=float, default=1.0, metavar='SECONDS', 
+                        help="seconds between simulated scans")
+    parser.add_argument('--data-dir', metavar='DIR',
+                        help=f"folder holding store profiles (default: $PHARMACARE_DATA_DIR or {DEFAULT_DATA_DIR})")
+    parser.add_argument('--profile', metavar='NAME', help="store profile to open (default: the last one used)")
+    parser.add_argument('--consolidate', nargs='+', metavar='PATH',
+                        help="merge branch data files or store folders into a chain report, then exit")
+    parser.add_argument('--output', metavar='FILE', help="write the chain report here (.pdf or text) instead of printing it")
+    parser.add_argument('--ledger', metavar='FILE', 
+                        help="also save the merged inventory and branch-tagged sales ledger as a .phc snapshot")
+    parser.add_argument('--export-changes', metavar='DIR', 
+                        help="write the profile's unsent changes as batch files into DIR, then exit")
+    parser.add_argument('--batch-size', type=int, default=5000, metavar='N', help="changes per exported batch file")
+    parser.add_argument('--apply-changes', nargs='+', metavar='PATH', 
+                        help="apply branch batch files or folders of them to the --central store, then exit")
+    parser.add_argument('--central', metavar='DIR', help="central store folder used by --apply-changes")
+    args = parser.parse_args()
+    
+    if args.profile is not None and not ProfileManager.valid_name(args.profile):
+        parser.error(f"invalid store name: {args.profile}")
+    
+    if args.bench_snapshot:
+        benchmark_snapshot(args.bench_snapshot)
+        sys.exit()
+    
+    if args.bench_analytics:
+        benchmark_analytics(args.bench_analytics)
+        sys.exit()
+    
+    if args.bench_startup:
+        benchmark_startup(args.bench_startup)
+        sys.exit()
+    
+    if args.export_changes:
+        profiles = ProfileManager(args.data_dir or DEFAULT_DATA_DIR)
+        profile = args.profile or profiles.active()
+        written = export_changes(profiles.path(profile), args.export_changes, profile, args.batch_size)
+        print(f"Exported {len(written)} batch file(s) from '{profile}'")
+        sys.exit()
+    
+    if args.apply_changes:
+        if not args.central:
+            parser.error("--apply-changes needs --central DIR")
+        result = apply_change_files(args.central, args.apply_changes)
+        print(f"Applied {result['applied']} change(s) from {result['batches']} batch file(s)")
+        for path in result['pending']:
+            print(f"Waiting for earlier batches before {path}", file=sys.stderr)
+        for path, error in result['failed']:
+            print(f"Skipped {path}: {error}", file=sys.stderr)
+        sys.exit(1 if result['failed'] else 0)
+    
+    if args.consolidate:
+        chain = consolidate_branches(args.consolidate, include_sales=bool(args.ledger))
+        text, _ = build_chain_report(chain)
+        if args.output and args.output.lower().endswith('.pdf'):
+            write_file_atomic(args.output, text_to_pdf(text, "Chain Consolidation Report"))
+        elif args.output:
+            write_file_atomic(args.output, text.encode('utf-8'))
+        else:
+            print(text)
+        if args.ledger:
+            save_snapshot(args.ledger, {key: chain[key] for key in ('branches', 'inventory', 'sales_history')})
+        for path, error in chain['failed']:
+            print(f"Skipped {path}: {error}", file=sys.stderr)
+        sys.exit(1 if chain['failed'] else 0)
+    
     root = tk.Tk()
-    app = ModernMedicalStore(root)
+    app = ModernMedicalStore(root, data_dir=args.data_dir, profile=args.profile)
+    
+    if args.scanner:
+        app.start_scanner(SerialScanner(args.scanner))
+    elif args.simulate_scans:
+        with open(args.simulate_scans, 'r', encoding='utf-8') as f:
+            codes = [line.rstrip('\r\n') for line in f if line.strip()]
+        app.start_scanner(SimulatedScanner(codes, args.scan_interval))
     
     def on_closing():
         if messagebox.askokcancel("Quit", "Do you want to quit? All unsaved changes will be auto-saved."):
+            app.stop_scanner()
+            app.receipt_printer.close(timeout=10)
+            
             # Perform one final auto-save
             try:
-                data = {
-                    'medicines': app.medicines,
-                    'sales_history': app.sales_history,
-                    'receipt_settings': app.receipt_settings,
-                    'today_sales': app.today_sales_var.get()
-                }
-                
-                save_path = os.path.join(tempfile.gettempdir(), "pharmacare_autosave.pkl")
-                with open(save_path, 'wb') as f:
-                    pickle.dump(data, f)
+                app.flush_autosave()
             except Exception as e:
                 print(f"Final auto-save failed: {str(e)}")
             
             root.destroy()
     
     root.protocol("WM_DELETE_WINDOW", on_closing)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()